@@ -45,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so the timings cover the other middleware as well
+    "publictransit.instrumentation.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -136,3 +138,54 @@ STATICFILES_DIRS = [
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Overpass API endpoints, tried in order if an endpoint is unavailable
+
+OVERPASS_ENDPOINTS = [
+    "https://overpass-api.de/api/interpreter",
+    "https://overpass.kumi.systems/api/interpreter",
+]
+
+# Send all queries to one endpoint, such as a local stand-in server started
+# with 'python manage.py overpass_server'
+if os.environ.get("OVERPASS_ENDPOINT"):
+    OVERPASS_ENDPOINTS = [os.environ["OVERPASS_ENDPOINT"]]
+
+# Overpass API response cache
+# Set OVERPASS_CACHE to None to disable caching
+
+OVERPASS_CACHE = {
+    "DIRECTORY": BASE_DIR / ".overpass_cache",
+    "MAX_SIZE": 256 * 1024 * 1024,  # bytes
+    # Time-to-live in seconds for each query output format
+    "TTLS": {
+        "json": 30 * 24 * 60 * 60,
+        "csv": 7 * 24 * 60 * 60,
+    },
+}
+
+# Replayed responses are not cached, so every query reaches the stand-in
+if os.environ.get("OVERPASS_ENDPOINT"):
+    OVERPASS_CACHE = None
+
+# Background job queue
+# Jobs run in a thread pool inside the server process. Set EAGER to True to
+# run jobs synchronously when they are enqueued. Jobs still running after
+# STALE_AFTER seconds are assumed abandoned by a stopped worker and failed.
+
+JOB_QUEUE = {
+    "WORKERS": 2,
+    "EAGER": False,
+    "STALE_AFTER": 3600,
+}
+
+# Projection used for metric computations on boundaries: "utm" picks the UTM
+# zone containing the centre of the boundary, "british_national_grid" uses
+# EPSG:27700 for boundaries within Great Britain
+
+BOUNDARY_PROJECTION = "utm"
+
+# Boundary polygons are always stored packed in a single BoundaryGeometry
+# row. Set to False to stop also writing one BoundaryPoint row per vertex.
+
+STORE_BOUNDARY_POINT_ROWS = True
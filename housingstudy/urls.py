@@ -1,6 +1,8 @@
 from django.contrib import admin
 from django.urls import include, path
 
+from publictransit.views import MetricsView
+
 from . import views
 
 app_name = "housingstudy"
@@ -8,5 +10,6 @@ app_name = "housingstudy"
 urlpatterns = [
     path("", views.home, name="home"),
     path("publictransit/", include("publictransit.urls")),
+    path("metrics", MetricsView.as_view(), name="metrics"),
     path("admin/", admin.site.urls),
 ]
@@ -0,0 +1,484 @@
+"""Benchmarks of the polygon, boundary and ingest code on synthetic data.
+
+Each stage is timed on inputs of increasing size, generated from a fractal
+coastline so that the polygons have the irregular detail of real
+boundaries. For every stage and size the fastest wall time of several
+runs, the peak memory allocated by Python (measured with 'tracemalloc') and
+the number of database queries are recorded. The results can be written to
+JSON and compared with the results of an earlier commit with
+'compare_results'.
+
+The import time of the web application is measured separately by
+'measure_import_time', as it has to start from a fresh interpreter.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+from scipy.spatial import Voronoi
+
+from publictransit import models
+from publictransit.overpass_server import OverpassStandInServer, Recordings
+from publictransit.utilities.boundary_tools import (
+    build_polygon,
+    get_boundary_coordinates,
+)
+from publictransit.utilities.polygon_tools import (
+    generate_circle,
+    ramer_douglas_peucker,
+    to_utm,
+    voronoi_cells_intersect_boundary,
+)
+
+STAGES = (
+    "build_polygon",
+    "to_utm",
+    "ramer_douglas_peucker",
+    "voronoi_intersect",
+    "download_data",
+)
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+# Number of boundary vertices per way of the synthetic relations
+VERTICES_PER_WAY = 250
+# Number of boundary vertices per synthetic station
+VERTICES_PER_STATION = 10
+
+# Imports a web server worker makes before it can handle a request
+SERVING_IMPORTS = (
+    "import housingstudy.wsgi\n"
+    "from django.urls import get_resolver\n"
+    "get_resolver().url_patterns"
+)
+# Slow packages which are only needed by commands and background jobs
+SERVING_EXCLUDED_MODULES = ("matplotlib", "scipy", "pandas", "pyproj")
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+
+def fractal_coastline(
+    num_points, seed=0, center=(52.0, -1.0), radius=0.2, roughness=0.25
+):
+    """Return a closed, irregular polygon made by midpoint displacement.
+
+    Starting from an octagon, the midpoint of every edge is inserted and
+    moved along the normal of the edge by a random fraction of its length,
+    until the polygon has at least 'num_points' vertices. The vertices are
+    then evenly subsampled to exactly 'num_points'.
+
+    Parameters
+    ----------
+    num_points : int
+        The number of vertices.
+    seed : int, optional
+        Seed of the random displacements.
+    center : tuple, optional
+        The (latitude, longitude) of the centre of the polygon.
+    radius : float, optional
+        The radius of the polygon in degrees of latitude.
+    roughness : float, optional
+        The largest displacement of a midpoint relative to its edge length.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (num_points, 2) of the (latitude, longitude) vertices,
+        without repeating the first vertex.
+    """
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0, 2 * np.pi, 8, endpoint=False)
+    ring = np.column_stack([np.cos(angles), np.sin(angles)])
+    while len(ring) < num_points:
+        edges = np.roll(ring, -1, axis=0) - ring
+        normals = np.column_stack([-edges[:, 1], edges[:, 0]])
+        offsets = rng.uniform(-roughness, roughness, (len(ring), 1))
+        midpoints = ring + edges / 2 + normals * offsets
+        refined = np.empty((2 * len(ring), 2))
+        refined[0::2] = ring
+        refined[1::2] = midpoints
+        ring = refined
+    ring = ring[np.linspace(0, len(ring) - 1, num_points).astype(int)]
+    # Degrees of longitude are shorter than degrees of latitude
+    scale = np.cos(np.radians(center[0]))
+    return np.column_stack(
+        [
+            center[0] + radius * ring[:, 1],
+            center[1] + radius / scale * ring[:, 0],
+        ]
+    )
+
+
+def polygon_elements(points, num_ways, seed=0, osm_id=1):
+    """Return an Overpass JSON response for a polygon split into ways.
+
+    The ways are shuffled and some of them reversed, as in real relations,
+    so they have to be stitched together by 'build_polygon'.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        Array of shape (n, 2) of the (latitude, longitude) vertices.
+    num_ways : int
+        The number of outer ways of the relation.
+    seed : int, optional
+        Seed of the order and direction of the ways.
+    osm_id : int, optional
+        The OSM ID of the relation.
+
+    Returns
+    -------
+    dict
+        The response, with the relation, way and node elements.
+    """
+    rng = np.random.default_rng(seed)
+    node_ids = np.arange(1, len(points) + 1)
+    bounds = np.linspace(0, len(points), num_ways + 1).astype(int)
+    ways = []
+    for i, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        # Consecutive ways share their end nodes, and the last one closes
+        # the ring
+        nodes = np.append(node_ids[start:end], node_ids[end % len(points)])
+        if rng.random() < 0.5:
+            nodes = nodes[::-1]
+        ways.append({"type": "way", "id": i + 1, "nodes": nodes.tolist()})
+    rng.shuffle(ways)
+    relation = {
+        "type": "relation",
+        "id": osm_id,
+        "members": [
+            {"type": "way", "ref": way["id"], "role": "outer"} for way in ways
+        ],
+    }
+    nodes = [
+        {"type": "node", "id": int(node_id), "lat": lat, "lon": lon}
+        for node_id, (lat, lon) in zip(node_ids, points.tolist())
+    ]
+    return {"elements": [relation, *ways, *nodes]}
+
+
+def random_stations(points, num_stations, seed=0, margin=0.05):
+    """Return random station coordinates in and around a polygon.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        Array of shape (n, 2) of the (latitude, longitude) vertices.
+    num_stations : int
+        The number of stations.
+    seed : int, optional
+        Seed of the station coordinates.
+    margin : float, optional
+        Distance in degrees the bounding box of the polygon is extended by.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (num_stations, 2) of (latitude, longitude) points.
+    """
+    rng = np.random.default_rng(seed)
+    low = points.min(axis=0) - margin
+    high = points.max(axis=0) + margin
+    return rng.uniform(low, high, (num_stations, 2))
+
+
+def stations_csv(stations):
+    """Return station coordinates as an Overpass CSV response body."""
+    rows = [
+        f"Station {i}\t{i + 1}\t{lat:.7f}\t{lon:.7f}\n"
+        for i, (lat, lon) in enumerate(stations)
+    ]
+    return ("name\t@id\t@lat\t@lon\n" + "".join(rows)).encode("utf-8")
+
+
+def measure(stage, size, func, repeat=3):
+    """Measure the wall time, peak memory and queries of a function.
+
+    The function is run 'repeat' times to find the fastest wall time, then
+    once more with 'tracemalloc' and the query log enabled, as they slow it
+    down.
+
+    Returns
+    -------
+    dict
+        The 'stage', 'size', 'seconds', 'peak_memory' in bytes and number of
+        'queries'.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "stage": stage,
+        "size": size,
+        "seconds": min(times),
+        "peak_memory": peak_memory,
+        "queries": len(queries),
+    }
+
+
+def benchmark_download(size, points, stations, repeat):
+    """Measure the download_data actions against a local Overpass stand-in.
+
+    The polygon and then the stations of a new boundary are downloaded
+    through the API, with the jobs run eagerly, from synthetic responses
+    replayed by an 'OverpassStandInServer'.
+    """
+    boundary = models.MapBoundary.objects.create(
+        admin_level=6,
+        iso31662=f"GB-B{size}",
+        name=f"Benchmark {size}",
+        osm_id=size,
+        ref_gss=f"B{size}",
+    )
+    client = APIClient()
+    with tempfile.TemporaryDirectory() as directory:
+        recordings = Recordings(directory)
+        recordings.save(
+            boundary.polygon_query,
+            json.dumps(
+                polygon_elements(points, max(size // VERTICES_PER_WAY, 4))
+            ).encode("utf-8"),
+        )
+
+        def download(kind, job_kind):
+            response = client.post(
+                f"/publictransit/{kind}/download_data/"
+                f"?boundary_id={boundary.pk}"
+            )
+            job = models.Job.objects.get(pk=response.json()["job_id"])
+            if job.status != models.Job.Status.SUCCESS:
+                raise RuntimeError(f"{job_kind} failed: {job.error}")
+
+        def download_data():
+            download("polygon", "download_polygon")
+            boundary.refresh_from_db()
+            recordings.save(
+                boundary.get_stations_bbox_query(), stations_csv(stations)
+            )
+            download("stations", "download_stations")
+
+        with OverpassStandInServer(recordings) as server:
+            with override_settings(
+                OVERPASS_ENDPOINTS=[server.url],
+                OVERPASS_CACHE=None,
+                JOB_QUEUE={"EAGER": True},
+            ):
+                result = measure("download_data", size, download_data, repeat)
+    boundary.delete()
+    return result
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, stages=STAGES, repeat=3, log=None):
+    """Run the benchmark stages on synthetic inputs of each size.
+
+    The 'download_data' stage writes to the default database, so it must be
+    run against a test database.
+
+    Parameters
+    ----------
+    sizes : iterable of int, optional
+        The numbers of boundary vertices. Each size uses one way per
+        'VERTICES_PER_WAY' vertices and one station per
+        'VERTICES_PER_STATION' vertices.
+    stages : iterable of str, optional
+        The stages to run, from 'STAGES'.
+    repeat : int, optional
+        The number of timed runs of each stage.
+    log : callable, optional
+        Called with each result as it is measured.
+
+    Returns
+    -------
+    list of dict
+        The results of 'measure' for each stage and size.
+    """
+    results = []
+    for size in sizes:
+        points = fractal_coastline(size, seed=size)
+        stations = random_stations(
+            points, max(size // VERTICES_PER_STATION, 10), seed=size
+        )
+        elements = polygon_elements(
+            points, max(size // VERTICES_PER_WAY, 4), seed=size
+        )
+        projected = to_utm(points)
+        projected_stations = to_utm(stations)
+        voronoi = Voronoi(
+            np.vstack(
+                [
+                    projected_stations,
+                    generate_circle(
+                        np.vstack([projected_stations, projected])
+                    ),
+                ]
+            )
+        )
+        stage_functions = {
+            "build_polygon": lambda: build_polygon(
+                get_boundary_coordinates(elements)
+            ),
+            "to_utm": lambda: to_utm(points),
+            "ramer_douglas_peucker": lambda: ramer_douglas_peucker(
+                projected, 1
+            ),
+            "voronoi_intersect": lambda: voronoi_cells_intersect_boundary(
+                voronoi, projected, np.arange(len(stations))
+            ),
+        }
+        for stage in stages:
+            if stage == "download_data":
+                result = benchmark_download(size, points, stations, repeat)
+            else:
+                result = measure(stage, size, stage_functions[stage], repeat)
+            results.append(result)
+            if log is not None:
+                log(result)
+    return results
+
+
+def get_environment():
+    """Return a description of the code and machine the benchmarks ran on."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+    }
+
+
+def compare_results(results, baseline, threshold=0.25):
+    """Find the stages which got slower or use more queries than before.
+
+    Parameters
+    ----------
+    results : list of dict
+        The current results of 'run_benchmarks'.
+    baseline : list of dict
+        Earlier results to compare with. Stages and sizes which are only in
+        one of the lists are ignored.
+    threshold : float, optional
+        The relative increase of the wall time or peak memory which counts
+        as a regression.
+
+    Returns
+    -------
+    list of str
+        A description of each regression.
+    """
+    previous = {(r["stage"], r["size"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get((result["stage"], result["size"]))
+        if old is None:
+            continue
+        name = f"{result['stage']} ({result['size']})"
+        for key in ("seconds", "peak_memory"):
+            if old[key] and result[key] > old[key] * (1 + threshold):
+                regressions.append(
+                    f"{name}: {key} {old[key]:.4g} -> {result[key]:.4g}"
+                    f" (+{result[key] / old[key] - 1:.0%})"
+                )
+        if result["queries"] > old["queries"]:
+            regressions.append(
+                f"{name}: queries {old['queries']} -> {result['queries']}"
+            )
+    return regressions
+
+
+def parse_importtime(output):
+    """Read the output of 'python -X importtime'.
+
+    Parameters
+    ----------
+    output : str
+        The standard error of the interpreter.
+
+    Returns
+    -------
+    total : float
+        The total import time in seconds.
+    modules : dict
+        Dictionary of the imported module names and their cumulative import
+        times in seconds, including the modules they import.
+    """
+    total = 0.0
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            # The header line
+            continue
+        seconds = int(cumulative) / 1e6
+        modules[name.strip()] = seconds
+        # Top level imports are indented by a single space
+        if not name.startswith("  "):
+            total += seconds
+    return total, modules
+
+
+def measure_import_time(code=SERVING_IMPORTS, repeat=3):
+    """Measure the imports of a snippet of code in fresh interpreters.
+
+    Parameters
+    ----------
+    code : str, optional
+        The code to run, by default the imports of a web server worker.
+    repeat : int, optional
+        The number of interpreters to start. The fastest run is returned,
+        so that the first run can compile the bytecode.
+
+    Returns
+    -------
+    total : float
+        The total import time in seconds.
+    modules : dict
+        The cumulative import time of each module, see 'parse_importtime'.
+    """
+    env = {
+        **os.environ,
+        "DJANGO_SETTINGS_MODULE": os.environ.get(
+            "DJANGO_SETTINGS_MODULE", "housingstudy.settings"
+        ),
+    }
+    runs = []
+    for _ in range(repeat):
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            capture_output=True,
+            text=True,
+            env=env,
+            cwd=PROJECT_DIR,
+            check=True,
+        )
+        runs.append(parse_importtime(process.stderr))
+    return min(runs, key=lambda run: run[0])
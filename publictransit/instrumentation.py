@@ -0,0 +1,265 @@
+"""Timing spans, request tracing and latency histograms.
+
+Code on the hot paths is wrapped in named spans with 'span' or 'timed'.
+Every span is recorded in a latency histogram, and while a trace is active,
+such as during a request handled by 'ServerTimingMiddleware' or a job run
+by the worker pool, its time is also added to the trace. The time of a
+span in a trace excludes the time of the spans nested in it, so the spans
+of a trace do not count the same time twice.
+
+The histograms are rendered in the Prometheus text format by
+'render_metrics', which is served by the '/metrics' endpoint.
+"""
+
+import contextvars
+import functools
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import connection
+
+# Upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+# Upper bounds of the query count histogram buckets
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+_trace = contextvars.ContextVar("publictransit_trace", default=None)
+_parent_span = contextvars.ContextVar("publictransit_span", default=None)
+
+
+class Histogram:
+    """Cumulative histogram of observations, grouped by one label."""
+
+    def __init__(self, name, help_text, label, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = {
+                    "buckets": [0] * len(self.buckets),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def get(self, label_value):
+        """Return the bucket counts, sum and count of a label value."""
+        with self._lock:
+            series = self._series.get(label_value)
+            return None if series is None else {**series}
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        """Return the histogram in the Prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = sorted(self._series.items())
+            for label_value, values in series:
+                label = f'{self.label}="{label_value}"'
+                for bound, count in zip(self.buckets, values["buckets"]):
+                    lines.append(
+                        f'{self.name}_bucket{{{label},le="{bound}"}} {count}'
+                    )
+                lines.append(
+                    f'{self.name}_bucket{{{label},le="+Inf"}}'
+                    f' {values["count"]}'
+                )
+                lines.append(f"{self.name}_sum{{{label}}} {values['sum']}")
+                lines.append(f"{self.name}_count{{{label}}} {values['count']}")
+        return "\n".join(lines) + "\n"
+
+
+SPAN_SECONDS = Histogram(
+    "publictransit_span_seconds", "Duration of instrumented code.", "span"
+)
+REQUEST_SECONDS = Histogram(
+    "publictransit_request_seconds", "Duration of HTTP requests.", "view"
+)
+REQUEST_QUERIES = Histogram(
+    "publictransit_request_queries",
+    "Database queries per HTTP request.",
+    "view",
+    buckets=QUERY_BUCKETS,
+)
+HISTOGRAMS = (SPAN_SECONDS, REQUEST_SECONDS, REQUEST_QUERIES)
+
+
+def render_metrics():
+    """Return all histograms in the Prometheus text format."""
+    return "".join(histogram.render() for histogram in HISTOGRAMS)
+
+
+class Trace:
+    """Time spent in each span, and database queries, during a trace."""
+
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.queries = 0
+        self.query_time = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.durations[name] += seconds
+
+    def count_query(self, execute, sql, params, many, context):
+        """Database execute wrapper which counts and times the queries."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.queries += 1
+                self.query_time += elapsed
+
+    def as_dict(self):
+        """Return the span durations and query counts in milliseconds."""
+        with self._lock:
+            timings = {
+                name: round(seconds * 1000, 3)
+                for name, seconds in self.durations.items()
+            }
+            timings["db"] = round(self.query_time * 1000, 3)
+            timings["queries"] = self.queries
+        return timings
+
+    def server_timing(self, total=None):
+        """Return the trace as the value of a 'Server-Timing' header."""
+        with self._lock:
+            metrics = [
+                f"{name};dur={seconds * 1000:.1f}"
+                for name, seconds in self.durations.items()
+            ]
+            metrics.append(
+                f"db;dur={self.query_time * 1000:.1f};"
+                f'desc="{self.queries} queries"'
+            )
+        if total is not None:
+            metrics.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(metrics)
+
+
+@contextmanager
+def trace():
+    """Collect the spans and database queries of the enclosed code.
+
+    The spans of a trace nested in another one, such as a job run eagerly
+    during a request, are also added to the outer trace.
+
+    Yields
+    ------
+    Trace
+        The trace, which is complete once the block has exited.
+    """
+    outer = _trace.get()
+    current = Trace()
+    token = _trace.set(current)
+    try:
+        with connection.execute_wrapper(current.count_query):
+            yield current
+    finally:
+        _trace.reset(token)
+        if outer is not None:
+            # The queries were also counted by the wrapper of the outer trace
+            for name, seconds in current.durations.items():
+                outer.add(name, seconds)
+
+
+class _SpanFrame:
+    __slots__ = ("child_time",)
+
+    def __init__(self):
+        self.child_time = 0.0
+
+
+@contextmanager
+def span(name):
+    """Time the enclosed code as a span called 'name'."""
+    parent = _parent_span.get()
+    frame = _SpanFrame()
+    token = _parent_span.set(frame)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _parent_span.reset(token)
+        if parent is not None:
+            parent.child_time += elapsed
+        SPAN_SECONDS.observe(name, elapsed)
+        current = _trace.get()
+        if current is not None:
+            current.add(name, elapsed - frame.child_time)
+
+
+def timed(name):
+    """Decorate a function so that each call is timed as a span."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class ServerTimingMiddleware:
+    """Trace each request and report its timings in a 'Server-Timing' header.
+
+    The request duration and query count are recorded in the histograms of
+    the view that handled the request. The duration of a streaming response
+    only covers the time until its first chunk is ready to be sent.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with trace() as current:
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match is not None else "unresolved"
+        REQUEST_SECONDS.observe(view, total)
+        REQUEST_QUERIES.observe(view, current.queries)
+        response["Server-Timing"] = current.server_timing(total)
+        return response
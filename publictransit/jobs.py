@@ -0,0 +1,331 @@
+"""Background jobs run by a local worker pool.
+
+Jobs are stored in the 'Job' table and run by a thread pool in the web
+server process, so no external message broker is needed. A job is created
+with 'enqueue', which returns immediately, and its status and progress are
+read back from the database while it runs.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from publictransit import instrumentation, models
+from publictransit.overpass_api import OverpassClient
+from publictransit.utilities.catchment_tools import update_catchments
+from publictransit.utilities.ingest_tools import (
+    reclassify_stations,
+    save_boundary_rings,
+    save_classified_stations,
+    save_stations,
+    simplify_boundary_polygon,
+)
+
+_handlers = {}
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_options():
+    """Return the 'JOB_QUEUE' settings, with defaults for missing keys."""
+    options = getattr(settings, "JOB_QUEUE", {})
+    return {"WORKERS": 2, "EAGER": False, "STALE_AFTER": 3600, **options}
+
+
+def register(kind):
+    """Register a function as the handler for a kind of job.
+
+    The handler is called with the Job and a JobProgress, and its return
+    value is stored as the result of the job.
+    """
+
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+
+    return decorator
+
+
+class JobProgress:
+    """Progress counters of a running job.
+
+    Calling the object updates the counters, which are saved to the database
+    at most once every 'interval' seconds so they can be polled.
+    """
+
+    def __init__(self, job, interval=0.5):
+        self.job = job
+        self.interval = interval
+        self._last_save = 0.0
+
+    def __call__(self, **counts):
+        self.job.progress.update(counts)
+        if time.monotonic() - self._last_save >= self.interval:
+            self.save()
+
+    def save(self):
+        models.Job.objects.filter(pk=self.job.pk).update(
+            progress=self.job.progress
+        )
+        self._last_save = time.monotonic()
+
+
+def get_executor():
+    """Return the worker pool, creating it on first use.
+
+    When the pool is created, a worker is asked to run the jobs left pending
+    by a previous server process.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=get_options()["WORKERS"],
+                thread_name_prefix="publictransit-job",
+            )
+            _executor.submit(run_pending_jobs)
+        return _executor
+
+
+def start_workers():
+    """Start the worker pool unless jobs are run eagerly."""
+    if not get_options()["EAGER"]:
+        get_executor()
+
+
+def enqueue(kind, boundary=None, **params):
+    """Create a job and schedule it to run in the worker pool.
+
+    Parameters
+    ----------
+    kind : str
+        The kind of job, which must have a registered handler.
+    boundary : MapBoundary, optional
+        The boundary the job works on.
+    **params
+        JSON serialisable parameters passed to the handler in 'job.params'.
+
+    Returns
+    -------
+    Job
+        The created job. If the 'EAGER' option of the 'JOB_QUEUE' setting is
+        set, the job has already been run.
+    """
+    if kind not in _handlers:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job = models.Job.objects.create(
+        kind=kind, boundary=boundary, params=params
+    )
+    if get_options()["EAGER"]:
+        if claim_job(job.pk):
+            job.refresh_from_db()
+            run_job(job)
+    else:
+        # The workers can only see the job once it has been committed
+        transaction.on_commit(submit_pending_jobs)
+    return job
+
+
+def submit_pending_jobs():
+    """Ask a worker in the pool to run the pending jobs."""
+    get_executor().submit(run_pending_jobs)
+
+
+def claim_job(job_id):
+    """Mark a pending job as running, returning False if already claimed."""
+    claimed = models.Job.objects.filter(
+        pk=job_id, status=models.Job.Status.PENDING
+    ).update(status=models.Job.Status.RUNNING, started=timezone.now())
+    return claimed == 1
+
+
+def fail_stale_jobs():
+    """Mark jobs abandoned by a stopped worker as failed.
+
+    A job which has been running for longer than the 'STALE_AFTER' option
+    of the 'JOB_QUEUE' setting, in seconds, is assumed to have been left
+    behind by a server process which crashed or was restarted, so clients
+    polling it are told that it failed.
+
+    Returns
+    -------
+    int
+        The number of jobs marked as failed.
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=get_options()["STALE_AFTER"])
+    return models.Job.objects.filter(
+        status=models.Job.Status.RUNNING, started__lt=cutoff
+    ).update(
+        status=models.Job.Status.FAILED,
+        error="Abandoned: the worker running the job stopped",
+        finished=now,
+    )
+
+
+def claim_next_job():
+    """Claim the oldest pending job, or return None if there are none.
+
+    Stale running jobs are marked as failed first, see 'fail_stale_jobs'.
+    """
+    fail_stale_jobs()
+    pending = models.Job.objects.filter(
+        status=models.Job.Status.PENDING
+    ).order_by("created", "pk")
+    for job_id in pending.values_list("pk", flat=True):
+        if claim_job(job_id):
+            return models.Job.objects.get(pk=job_id)
+    return None
+
+
+def run_pending_jobs():
+    """Run pending jobs until there are none left.
+
+    Jobs left pending by a previous server process are picked up as well.
+    """
+    try:
+        while (job := claim_next_job()) is not None:
+            run_job(job)
+    finally:
+        connection.close()
+
+
+def run_job(job):
+    """Run a claimed job and store its result or error.
+
+    The time spent in each instrumented span is stored in 'job.timings'.
+    """
+    progress = JobProgress(job)
+    with instrumentation.trace() as timings:
+        try:
+            job.result = _handlers[job.kind](job, progress)
+            job.status = models.Job.Status.SUCCESS
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = models.Job.Status.FAILED
+    job.timings = timings.as_dict()
+    job.finished = timezone.now()
+    job.save(
+        update_fields=[
+            "progress",
+            "result",
+            "error",
+            "status",
+            "finished",
+            "timings",
+        ]
+    )
+
+
+def count_rows(rows, progress, counts, key):
+    """Pass rows through while counting them in 'counts[key]'."""
+    for row in rows:
+        counts[key] += 1
+        progress(**counts)
+        yield row
+
+
+@register("add_boundary")
+def add_boundary(job, progress):
+    """Download the tags of an OSM relation and create its MapBoundary."""
+    osm_id = job.params["osm_id"]
+    query = f"[out:json];\nrelation({osm_id});\nout tags;"
+    client = OverpassClient()
+    response = client.get(query)
+    progress(rows_fetched=len(response["elements"]))
+    tags = response["elements"][0]["tags"]
+    map_boundary, _ = models.MapBoundary.objects.get_or_create(
+        admin_level=tags["admin_level"],
+        iso31662=tags["ISO3166-2"],
+        name=tags["name"],
+        osm_id=osm_id,
+        ref_gss=tags["ref:gss"],
+    )
+    progress(rows_written=1)
+    return {"name": map_boundary.name, "boundary_id": map_boundary.pk}
+
+
+@register("download_stations")
+def download_stations(job, progress):
+    """Download the stations in and near a boundary and save them.
+
+    If the polygon of the boundary has been downloaded, the stations in its
+    bounding box are downloaded with one query and classified locally.
+    """
+    boundary = job.boundary
+    client = OverpassClient()
+    counts = {"rows_fetched": 0}
+    bbox_query = boundary.get_stations_bbox_query()
+    if bbox_query is not None:
+        stations = client.get(bbox_query, stream=True)
+        # Skip the CSV header
+        next(stations, None)
+        num_stations = save_classified_stations(
+            boundary, count_rows(stations, progress, counts, "rows_fetched")
+        )
+        progress(rows_written=num_stations)
+        enqueue("compute_catchments", boundary=boundary)
+        return {"num_stations": num_stations}
+
+    stations_inside = client.get(boundary.stations_list_query, stream=True)
+    stations_outside = client.get(
+        boundary.stations_list_query_outside_boundary, stream=True
+    )
+
+    # Skip the CSV headers
+    next(stations_inside, None)
+    next(stations_outside, None)
+    num_stations = save_stations(
+        boundary,
+        count_rows(stations_inside, progress, counts, "rows_fetched"),
+        count_rows(stations_outside, progress, counts, "rows_fetched"),
+    )
+    progress(rows_written=num_stations)
+    enqueue("compute_catchments", boundary=boundary)
+    return {"num_stations": num_stations}
+
+
+@register("download_polygon")
+def download_polygon(job, progress):
+    """Download the polygon of a boundary, simplify it and save it.
+
+    The job fails, and the saved polygon is kept, if the response has no
+    ring of at least 3 points, such as an empty or partial response.
+    """
+    boundary = job.boundary
+    client = OverpassClient()
+    elements = client.get(boundary.polygon_query, stream=True)
+
+    counts = {"rows_fetched": 0}
+    simplified_rings = simplify_boundary_polygon(
+        boundary, count_rows(elements, progress, counts, "rows_fetched")
+    )
+    progress(points_simplified=sum(len(ring) for ring in simplified_rings))
+    if not simplified_rings:
+        raise ValueError(
+            f"The polygon of {boundary.name} has no ring of 3 or more points"
+        )
+    num_nodes = save_boundary_rings(boundary, simplified_rings)
+    reclassify_stations(boundary)
+    progress(rows_written=num_nodes)
+    enqueue("compute_catchments", boundary=boundary)
+    return {"num_nodes": num_nodes}
+
+
+@register("compute_catchments")
+def compute_catchments(job, progress):
+    """Recompute the station catchments of a boundary if they are stale."""
+    num_catchments = update_catchments(
+        job.boundary, force=job.params.get("force", False)
+    )
+    if num_catchments is not None:
+        progress(rows_written=num_catchments)
+    return {
+        "num_catchments": num_catchments,
+        "up_to_date": num_catchments is None,
+    }
@@ -0,0 +1,116 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    setup_test_environment,
+    teardown_test_environment,
+)
+from django.utils import timezone
+
+from publictransit.benchmarks import (
+    DEFAULT_SIZES,
+    STAGES,
+    compare_results,
+    get_environment,
+    run_benchmarks,
+)
+
+
+def parse_list(value, cast=str):
+    return [cast(item) for item in value.split(",") if item]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the polygon, boundary and ingest code on synthetic data,"
+        " optionally comparing with earlier results"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            type=lambda value: parse_list(value, int),
+            default=list(DEFAULT_SIZES),
+            help="Comma separated numbers of boundary vertices",
+        )
+        parser.add_argument(
+            "--stages",
+            type=parse_list,
+            default=list(STAGES),
+            help=f"Comma separated stages, from {', '.join(STAGES)}",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Number of timed runs of each stage",
+        )
+        parser.add_argument(
+            "--output", help="Write the results to this JSON file"
+        )
+        parser.add_argument(
+            "--compare",
+            help="Compare with the results in this JSON file",
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.25,
+            help="Relative slowdown which counts as a regression",
+        )
+
+    def handle(self, *args, **options):
+        unknown = set(options["stages"]) - set(STAGES)
+        if unknown:
+            raise CommandError(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+        self.stdout.write(
+            f"{'stage':<24}{'size':>10}{'seconds':>12}{'peak MiB':>12}"
+            f"{'queries':>10}"
+        )
+        # The download stage writes to the database, so a throwaway test
+        # database is used
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True
+        )
+        try:
+            results = run_benchmarks(
+                options["sizes"],
+                options["stages"],
+                options["repeat"],
+                log=self.log_result,
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options["output"]:
+            report = {
+                "created": timezone.now().isoformat(),
+                "environment": get_environment(),
+                "results": results,
+            }
+            Path(options["output"]).write_text(json.dumps(report, indent=2))
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if options["compare"]:
+            baseline = json.loads(Path(options["compare"]).read_text())
+            regressions = compare_results(
+                results, baseline["results"], options["threshold"]
+            )
+            if regressions:
+                raise CommandError(
+                    "Performance regressions:\n" + "\n".join(regressions)
+                )
+            self.stdout.write(self.style.SUCCESS("No regressions"))
+
+    def log_result(self, result):
+        self.stdout.write(
+            f"{result['stage']:<24}{result['size']:>10}"
+            f"{result['seconds']:>12.4f}"
+            f"{result['peak_memory'] / 2**20:>12.1f}"
+            f"{result['queries']:>10}"
+        )
@@ -1,30 +1,139 @@
 import json
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
+from publictransit.models import BoundaryGeometry
 from publictransit.utilities.boundary_tools import (
     build_polygon,
     get_boundary_coordinates,
+)
+from publictransit.utilities.plot_tools import (
+    RenderBatch,
+    add_batch_arguments,
+    get_render_key,
     plot_boundary_coordinates,
+    snake_case,
+)
+from publictransit.utilities.polygon_tools import (
+    simplify_points,
+    split_rings,
 )
-from publictransit.utilities.polygon_tools import simplify_points
 
 
 class Command(BaseCommand):
-    help = "Test out algorithms for building boundary polygon"
+    help = (
+        "Test out algorithms for building boundary polygon, or render the"
+        " stored polygons of MapBoundaries with --output-dir"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "names", nargs="*", type=str, help="Names of the MapBoundaries"
+        )
+        parser.add_argument(
+            "--response",
+            default="response.json",
+            help="Overpass API boundary response to build the polygon from",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=100,
+            help=(
+                "Simplification tolerance in metres of the level drawn over"
+                " the stored polygons"
+            ),
+        )
+        add_batch_arguments(parser)
 
     def handle(self, *args, **options):
+        if options["output_dir"]:
+            self.render_batch(options)
+            return
+
         # Load GeoJSON file with explicit encoding
-        with open("response.json", encoding="utf-8") as f:
+        with open(options["response"], encoding="utf-8") as f:
             data = json.load(f)
         boundary_coordinates = get_boundary_coordinates(data)
         polygon = build_polygon(boundary_coordinates)
         simplified_polygon = simplify_points(polygon, epsilon=1)
-        print(f"Num coordinates: {len(polygon)}")
-        print(f"Num simplified coordinates: {len(simplified_polygon)}")
+        self.stdout.write(f"Num coordinates: {len(polygon)}")
+        self.stdout.write(
+            f"Num simplified coordinates: {len(simplified_polygon)}"
+        )
         plot_boundary_coordinates(
             {
                 "Shape": polygon,
                 "Shape New": simplified_polygon,
             }
         )
+
+    def render_batch(self, options):
+        geometries = BoundaryGeometry.objects.select_related("boundary")
+        if options["all"]:
+            pass
+        elif options["names"]:
+            geometries = geometries.filter(boundary__name__in=options["names"])
+            found = {geometry.boundary.name for geometry in geometries}
+            for name in sorted(set(options["names"]) - found):
+                self.stdout.write(
+                    self.style.WARNING(f"MapBoundary {name} has no polygon")
+                )
+        else:
+            raise CommandError("Give the names of MapBoundaries, or --all")
+
+        batch = RenderBatch(options["output_dir"], force=options["force"])
+        skipped = 0
+        # The polygon data is only loaded for the figures which are rendered
+        for geometry in geometries.defer("data", "importance").order_by(
+            "boundary__name"
+        ):
+            boundary = geometry.boundary
+            filename = (
+                f"{snake_case(boundary.name)}_{boundary.osm_id}_polygon"
+                f".{options['fmt']}"
+            )
+            key = get_render_key(
+                "boundary_coordinates",
+                boundary.osm_id,
+                geometry.version,
+                geometry.checksum,
+                options["tolerance"],
+                options["dpi"],
+            )
+            if batch.is_current(filename, key):
+                skipped += 1
+                continue
+            coordinates = self.label_rings(
+                "Polygon", geometry.to_array(), geometry.get_ring_starts()
+            )
+            level, simplified, ring_starts = geometry.get_level(
+                options["tolerance"]
+            )
+            if level:
+                coordinates.update(
+                    self.label_rings(f"{level:g} m", simplified, ring_starts)
+                )
+            batch.add(
+                filename,
+                key,
+                "boundary_coordinates",
+                {"coordinates_dict": coordinates, "title": boundary.name},
+                figsize=(10, 10),
+                dpi=options["dpi"],
+            )
+
+        rendered = batch.run(workers=options["workers"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rendered {len(rendered)} figures to {options['output_dir']},"
+                f" {skipped} up to date"
+            )
+        )
+
+    @staticmethod
+    def label_rings(label, points, ring_starts):
+        rings = split_rings(points, ring_starts)
+        if len(rings) == 1:
+            return {label: rings[0]}
+        return {f"{label} {i}": ring for i, ring in enumerate(rings, 1)}
@@ -0,0 +1,101 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand
+
+from publictransit.models import MapBoundary
+from publictransit.overpass_api import AsyncOverpassClient
+from publictransit.utilities.catchment_tools import update_catchments
+from publictransit.utilities.ingest_tools import (
+    save_boundary_rings,
+    save_classified_stations,
+    simplify_boundary_polygon,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Download the polygon and stations of several MapBoundaries"
+        " concurrently"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "names",
+            nargs="*",
+            type=str,
+            help="Names of the MapBoundaries, defaults to all of them",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="Maximum number of concurrent Overpass API requests",
+        )
+
+    def handle(self, *args, **options):
+        boundaries = MapBoundary.objects.order_by("name")
+        if options["names"]:
+            boundaries = boundaries.filter(name__in=options["names"])
+        boundaries = list(boundaries)
+        if not boundaries:
+            self.stdout.write(self.style.ERROR("No matching MapBoundaries"))
+            return
+        asyncio.run(self.download_all(boundaries, options["concurrency"]))
+
+    async def download_all(self, boundaries, concurrency):
+        client = AsyncOverpassClient()
+        semaphore = asyncio.Semaphore(concurrency)
+        results = await asyncio.gather(
+            *[
+                self.download_boundary(client, semaphore, boundary)
+                for boundary in boundaries
+            ],
+            return_exceptions=True,
+        )
+        for boundary, result in zip(boundaries, results):
+            if isinstance(result, Exception):
+                self.stdout.write(
+                    self.style.ERROR(f"{boundary.name}: {result}")
+                )
+            else:
+                num_points, num_stations = result
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"{boundary.name}: {num_points} boundary points,"
+                        f" {num_stations} stations"
+                    )
+                )
+
+    async def download_boundary(self, client, semaphore, boundary):
+        async def get(query):
+            async with semaphore:
+                return await client.get(query)
+
+        # The stations are downloaded for the bounding box of the saved
+        # polygon and classified locally
+        polygon = await get(boundary.polygon_query)
+        num_points = await sync_to_async(self.save_polygon)(boundary, polygon)
+        stations_query = boundary.get_stations_bbox_query()
+        if stations_query is None:
+            raise ValueError("no polygon")
+        stations = await get(stations_query)
+        num_stations = await sync_to_async(self.save_stations)(
+            boundary, stations
+        )
+        return num_points, num_stations
+
+    @staticmethod
+    def save_polygon(boundary, polygon):
+        simplified_rings = simplify_boundary_polygon(boundary, polygon)
+        if not simplified_rings:
+            # Keep the saved polygon rather than replacing it with nothing
+            raise ValueError("no polygon in the response")
+        return save_boundary_rings(boundary, simplified_rings)
+
+    @staticmethod
+    def save_stations(boundary, stations):
+        # Skip the CSV header
+        num_stations = save_classified_stations(boundary, stations[1:])
+        update_catchments(boundary)
+        return num_stations
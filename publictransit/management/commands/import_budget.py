@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from publictransit.benchmarks import (
+    SERVING_EXCLUDED_MODULES,
+    measure_import_time,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Check that a web server worker imports the application within a"
+        " time budget and without the slow plotting and analysis packages"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--budget",
+            type=float,
+            default=1.0,
+            help="Largest acceptable import time in seconds",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Number of fresh interpreters to time",
+        )
+        parser.add_argument(
+            "--top",
+            type=int,
+            default=10,
+            help="Number of slowest modules to list",
+        )
+
+    def handle(self, *args, **options):
+        total, modules = measure_import_time(repeat=options["repeat"])
+        slowest = sorted(modules.items(), key=lambda item: -item[1])
+        for name, seconds in slowest[: options["top"]]:
+            self.stdout.write(f"{seconds * 1000:>10.1f} ms  {name}")
+        self.stdout.write(f"Total import time: {total * 1000:.1f} ms")
+
+        errors = []
+        excluded = [
+            name for name in SERVING_EXCLUDED_MODULES if name in modules
+        ]
+        if excluded:
+            errors.append(f"Excluded packages imported: {', '.join(excluded)}")
+        if total > options["budget"]:
+            errors.append(
+                f"Import time {total:.3f} s exceeds the budget of"
+                f" {options['budget']:.3f} s"
+            )
+        if errors:
+            raise CommandError("\n".join(errors))
+        self.stdout.write(self.style.SUCCESS("Within the import budget"))
@@ -1,133 +1,141 @@
-import matplotlib.pyplot as plt
-from django.core.management.base import BaseCommand
-from scipy.spatial import Voronoi
+from django.core.management.base import BaseCommand, CommandError
 
-from publictransit.models import BoundaryPoint, MapBoundary, Station
-from publictransit.utilities.boundary_tools import remove_irrelevant_stations
-from publictransit.utilities.polygon_tools import generate_circle, to_utm
-
-
-def snake_case(s):
-    return s.lower().replace(" ", "_")
+from publictransit.models import MapBoundary, Station
+from publictransit.utilities.plot_tools import (
+    RenderBatch,
+    add_batch_arguments,
+    draw_stations_voronoi,
+    get_render_key,
+    snake_case,
+)
+from publictransit.utilities.polygon_tools import to_utm
 
 
 class Command(BaseCommand):
     help = (
         "Plots boundary points, stations, and Voronoi diagram for a given"
-        " MapBoundary"
+        " MapBoundary, or renders them for many MapBoundaries with"
+        " --output-dir"
     )
 
     def add_arguments(self, parser):
-        parser.add_argument("name", type=str, help="Name of the MapBoundary")
+        parser.add_argument(
+            "names", nargs="*", type=str, help="Names of the MapBoundaries"
+        )
+        add_batch_arguments(parser)
 
     def handle(self, *args, **options):
+        if options["output_dir"]:
+            self.render_batch(options)
+            return
+        if len(options["names"]) != 1 or options["all"]:
+            raise CommandError(
+                "Give the name of one MapBoundary, or use --output-dir to"
+                " render several"
+            )
+
         try:
-            boundary = MapBoundary.objects.get(name=options["name"])
+            boundary = MapBoundary.objects.get(name=options["names"][0])
         except MapBoundary.DoesNotExist:
             self.stdout.write(
                 self.style.ERROR("MapBoundary with given name does not exist")
             )
             return
 
-        bp_vals = self.boundary_points_coords(boundary)
-        stations_inside = self.inside_boundary_stations_coords(boundary)
-        stations_outside = self.outside_boundary_stations_coords(boundary)
-        voronoi_points = stations_inside + stations_outside
-
-        circle_points = generate_circle(stations_outside)
-
-        # Add the circle points to the points list
-        voronoi_points = voronoi_points + circle_points
-
-        vor = Voronoi(voronoi_points)
-        relevant_stations_outside = remove_irrelevant_stations(
-            bp_vals, stations_inside, stations_outside, vor
-        )
-
-        x_bp_vals, y_bp_vals = zip(*bp_vals)
-        x_in_vals, y_in_vals = zip(*stations_inside)
-        x_out_vals, y_out_vals = zip(*stations_outside)
-        x_outer_bp_vals, y_outer_bp_vals = zip(*circle_points)
-        fig, ax = plt.subplots(figsize=(8, 7))
-
-        # Set the axis to be equal and square
-        ax.axis("equal")
-
-        ax.plot(x_bp_vals, y_bp_vals, c="black", label="Boundary")
-        ax.scatter(
-            x_in_vals, y_in_vals, c="blue", label="Inside boundary stations"
-        )
-        ax.scatter(
-            x_out_vals, y_out_vals, c="red", label="Outside boundary stations"
-        )
-        # ax.scatter(
-        #     x_outer_bp_vals, y_outer_bp_vals, c="orange", label="Outer boundary"
-        # )
+        import matplotlib.pyplot as plt
 
-        # Create a scatter plot of the data
-        x_relevant_stations_vals, y_relevant_stations_vals = zip(
-            *relevant_stations_outside
-        )
-        plt.scatter(
-            x_relevant_stations_vals,
-            y_relevant_stations_vals,
-            c="green",
-            label="Outside stations to keep",
-        )
+        _, ax = plt.subplots(figsize=(8, 7))
+        draw_stations_voronoi(ax, **self.get_figure_data(boundary))
+        plt.show()
 
-        for simplex in vor.ridge_vertices:
-            if -1 not in simplex:
-                x = vor.vertices[simplex, 0]
-                y = vor.vertices[simplex, 1]
-                ax.plot(x, y, "k-", linewidth=0.5)
+    def render_batch(self, options):
+        if options["all"]:
+            boundaries = MapBoundary.objects.all()
+        elif options["names"]:
+            boundaries = MapBoundary.objects.filter(name__in=options["names"])
+            missing = set(options["names"]) - {b.name for b in boundaries}
+            for name in sorted(missing):
+                self.stdout.write(
+                    self.style.WARNING(f"MapBoundary {name} does not exist")
+                )
+        else:
+            raise CommandError("Give the names of MapBoundaries, or --all")
+
+        batch = RenderBatch(options["output_dir"], force=options["force"])
+        skipped = 0
+        for boundary in boundaries.order_by("name"):
+            filename = (
+                f"{snake_case(boundary.name)}_{boundary.osm_id}"
+                f".{options['fmt']}"
+            )
+            key = get_render_key(
+                "stations_voronoi",
+                boundary.osm_id,
+                boundary.polygon_version,
+                boundary.stations_version,
+                options["dpi"],
+            )
+            if batch.is_current(filename, key):
+                skipped += 1
+                continue
+            data = self.get_figure_data(boundary)
+            if not len(data["boundary"]):
+                self.stdout.write(
+                    self.style.WARNING(f"{boundary.name} has no polygon")
+                )
+                continue
+            batch.add(
+                filename,
+                key,
+                "stations_voronoi",
+                data,
+                figsize=(8, 7),
+                dpi=options["dpi"],
+            )
 
-        # Set x and y limits to min and max values of station locations
-        xmin = min(min(x_in_vals), min(x_out_vals))
-        xmax = max(max(x_in_vals), max(x_out_vals))
-        ymin = min(min(y_in_vals), min(y_out_vals))
-        ymax = max(max(y_in_vals), max(y_out_vals))
-        ax.set_xlim(xmin, xmax)
-        ax.set_ylim(ymin, ymax)
-        ax.set_xlabel("Longitude")
-        ax.set_ylabel("Latitude")
-        ax.set_title(
-            f"Boundary, stations, and Voronoi diagram for {boundary.name}"
+        rendered = batch.run(workers=options["workers"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rendered {len(rendered)} figures to {options['output_dir']},"
+                f" {skipped} up to date"
+            )
         )
-        ax.legend()
 
-        outfile = f'{snake_case(options["name"])}.png'
-        plt.show()
-        # plt.savefig(outfile, dpi=200, bbox_inches="tight")
+    def get_figure_data(self, boundary):
+        points, ring_starts = self.boundary_points_coords(boundary)
+        return {
+            "title": boundary.name,
+            "boundary": points,
+            "ring_starts": ring_starts,
+            "stations_inside": self.inside_boundary_stations_coords(boundary),
+            "stations_outside": self.outside_boundary_stations_coords(
+                boundary
+            ),
+        }
 
     def boundary_points_coords(self, boundary):
-        boundary_points = BoundaryPoint.objects.filter(
-            boundary=boundary
-        ).order_by("order")
-        coordinates = [
-            [point.location.latitude, point.location.longitude]
-            for point in boundary_points
-        ]
-        utm_coordinates = to_utm(coordinates)
-        return utm_coordinates
+        coordinates, ring_starts = boundary.get_polygon_rings()
+        utm_coordinates = to_utm(coordinates, crs=boundary.get_projected_crs())
+        return utm_coordinates, ring_starts
 
     def inside_boundary_stations_coords(self, boundary):
-        in_boundary_stations = Station.objects.filter(
-            boundary=boundary, isin_boundary=True
-        ).order_by("name")
-        coordinates = [
-            [station.location.latitude, station.location.longitude]
-            for station in in_boundary_stations
-        ]
-        utm_coordinates = to_utm(coordinates)
+        coordinates = (
+            Station.objects.filter(boundary=boundary, isin_boundary=True)
+            .order_by("name")
+            .values_list("location__latitude", "location__longitude")
+        )
+        utm_coordinates = to_utm(
+            list(coordinates), crs=boundary.get_projected_crs()
+        )
         return utm_coordinates
 
     def outside_boundary_stations_coords(self, boundary):
-        out_boundary_stations = Station.objects.filter(
-            boundary=boundary, isin_boundary=False
-        ).order_by("name")
-        coordinates = [
-            [station.location.latitude, station.location.longitude]
-            for station in out_boundary_stations
-        ]
-        utm_coordinates = to_utm(coordinates)
+        coordinates = (
+            Station.objects.filter(boundary=boundary, isin_boundary=False)
+            .order_by("name")
+            .values_list("location__latitude", "location__longitude")
+        )
+        utm_coordinates = to_utm(
+            list(coordinates), crs=boundary.get_projected_crs()
+        )
         return utm_coordinates
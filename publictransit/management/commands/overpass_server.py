@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand
+
+from publictransit.overpass_server import (
+    DEFAULT_RECORDINGS,
+    OverpassStandInServer,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a local stand-in for the Overpass API which replays recorded"
+        " responses"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument(
+            "--recordings",
+            default=str(DEFAULT_RECORDINGS),
+            help="Directory of the recorded responses",
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0,
+            help="Seconds to wait before answering each query",
+        )
+        parser.add_argument(
+            "--scale",
+            type=int,
+            default=1,
+            help="Number of copies of each element in the responses",
+        )
+        parser.add_argument(
+            "--throttle-every",
+            type=int,
+            default=0,
+            help="Answer every n-th query with HTTP 429",
+        )
+        parser.add_argument(
+            "--retry-after",
+            type=int,
+            default=1,
+            help="Retry-After header of the HTTP 429 responses in seconds",
+        )
+        parser.add_argument(
+            "--record",
+            metavar="UPSTREAM",
+            help=(
+                "Forward queries which have not been recorded to this"
+                " Overpass API endpoint and record the responses"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        server = OverpassStandInServer(
+            options["recordings"],
+            address=(options["host"], options["port"]),
+            latency=options["latency"],
+            scale=options["scale"],
+            throttle_every=options["throttle_every"],
+            retry_after=options["retry_after"],
+            upstream=options["record"],
+            verbose=options["verbosity"] > 1,
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"Overpass stand-in listening on {server.url}")
+        )
+        self.stdout.write(f"Use it with: OVERPASS_ENDPOINT={server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Served {server.counts}")
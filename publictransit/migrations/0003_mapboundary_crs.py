@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 15:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("publictransit", "0002_job"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mapboundary",
+            name="crs",
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
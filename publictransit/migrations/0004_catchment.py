@@ -0,0 +1,59 @@
+# Generated by Django 4.1.7 on 2026-10-18 15:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("publictransit", "0003_mapboundary_crs"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mapboundary",
+            name="catchment_key",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="mapboundary",
+            name="polygon_version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="station",
+            name="is_relevant",
+            field=models.BooleanField(default=True),
+        ),
+        migrations.CreateModel(
+            name="Catchment",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("polygon", models.JSONField(default=list)),
+                ("area", models.FloatField(default=0)),
+                (
+                    "boundary",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="publictransit.mapboundary",
+                    ),
+                ),
+                (
+                    "station",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="catchment",
+                        to="publictransit.station",
+                    ),
+                ),
+            ],
+        ),
+    ]
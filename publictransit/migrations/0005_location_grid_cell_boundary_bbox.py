@@ -0,0 +1,81 @@
+# Generated by Django 4.1.7 on 2026-10-18 15:50
+
+import math
+
+from django.db import migrations, models
+from django.db.models import Max, Min
+
+# The grid of publictransit.models when this migration was written, which is
+# copied so that later changes to the models do not change the migration
+GRID_CELL_SIZE = 0.1
+GRID_COLUMNS = 3600
+
+
+def grid_cell(latitude, longitude):
+    row = math.floor((float(latitude) + 90) / GRID_CELL_SIZE)
+    column = math.floor((float(longitude) + 180) / GRID_CELL_SIZE)
+    return row * GRID_COLUMNS + min(max(column, 0), GRID_COLUMNS - 1)
+
+
+def populate_cells_and_bboxes(apps, schema_editor):
+    Location = apps.get_model("publictransit", "Location")
+    MapBoundary = apps.get_model("publictransit", "MapBoundary")
+    locations = list(Location.objects.all())
+    for location in locations:
+        location.cell = grid_cell(location.latitude, location.longitude)
+    Location.objects.bulk_update(locations, ["cell"], batch_size=400)
+    for boundary in MapBoundary.objects.all():
+        bbox = boundary.boundarypoint_set.aggregate(
+            min_latitude=Min("location__latitude"),
+            min_longitude=Min("location__longitude"),
+            max_latitude=Max("location__latitude"),
+            max_longitude=Max("location__longitude"),
+        )
+        if bbox["min_latitude"] is not None:
+            MapBoundary.objects.filter(pk=boundary.pk).update(
+                **{key: float(value) for key, value in bbox.items()}
+            )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("publictransit", "0004_catchment"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="location",
+            name="cell",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="mapboundary",
+            name="max_latitude",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="mapboundary",
+            name="max_longitude",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="mapboundary",
+            name="min_latitude",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="mapboundary",
+            name="min_longitude",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="location",
+            index=models.Index(
+                fields=["cell", "latitude", "longitude"],
+                name="publictrans_cell_adaf9c_idx",
+            ),
+        ),
+        migrations.RunPython(
+            populate_cells_and_bboxes, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.1.7 on 2026-10-18 15:53
+
+import hashlib
+
+import django.db.models.deletion
+import numpy as np
+from django.db import migrations, models
+
+
+def pack_boundary_points(apps, schema_editor):
+    MapBoundary = apps.get_model("publictransit", "MapBoundary")
+    BoundaryGeometry = apps.get_model("publictransit", "BoundaryGeometry")
+    for boundary in MapBoundary.objects.all():
+        points = list(
+            boundary.boundarypoint_set.order_by("order").values_list(
+                "location__latitude", "location__longitude"
+            )
+        )
+        if not points:
+            continue
+        data = np.array(points, dtype="<f8").tobytes()
+        BoundaryGeometry.objects.create(
+            boundary=boundary,
+            version=boundary.polygon_version,
+            num_points=len(points),
+            checksum=hashlib.sha256(data).hexdigest(),
+            data=data,
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("publictransit", "0005_location_grid_cell_boundary_bbox"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BoundaryGeometry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("version", models.PositiveIntegerField()),
+                ("num_points", models.PositiveIntegerField()),
+                ("checksum", models.CharField(max_length=64)),
+                ("data", models.BinaryField()),
+                (
+                    "boundary",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="geometry",
+                        to="publictransit.mapboundary",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(pack_boundary_points, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 15:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("publictransit", "0006_boundarygeometry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="boundarygeometry",
+            name="importance",
+            field=models.BinaryField(default=b""),
+        ),
+    ]
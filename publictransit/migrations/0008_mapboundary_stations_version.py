@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 15:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("publictransit", "0007_boundarygeometry_importance"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mapboundary",
+            name="stations_version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
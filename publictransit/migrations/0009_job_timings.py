@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 16:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("publictransit", "0008_mapboundary_stations_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="job",
+            name="timings",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 16:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("publictransit", "0009_job_timings"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="boundarygeometry",
+            name="ring_starts",
+            field=models.BinaryField(default=b""),
+        ),
+    ]
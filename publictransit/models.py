@@ -1,11 +1,149 @@
+import hashlib
+import math
 from decimal import Decimal
 
-import pyproj
+import numpy as np
+from django.conf import settings
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import models, transaction
 
+from publictransit.utilities.polygon_tools import (
+    UTM_ZONE_30N,
+    select_projected_crs,
+)
 
-class LocationManager(models.Manager):
+# Number of coordinate pairs looked up per query by 'get_or_create_many'.
+# Kept below SQLite's default limit of 999 bound parameters per statement.
+LOCATION_LOOKUP_BATCH_SIZE = 400
+
+# Size in degrees of the cells of the grid used to index Locations
+GRID_CELL_SIZE = 0.1
+GRID_COLUMNS = round(360 / GRID_CELL_SIZE)
+# Largest number of grid rows filtered by cell ranges, as each row adds a
+# term to the query and SQLite limits the depth of expressions to 1000
+MAX_BBOX_GRID_ROWS = 100
+
+# Largest magnitude the 'Location.longitude' DecimalField can store
+MAX_STORED_LONGITUDE = 99.99999
+
+EARTH_RADIUS = 6_371_000  # Metres
+
+# Simplification tolerances in metres of the levels of boundary polygons
+POLYGON_TOLERANCES = (1, 10, 100, 1000)
+
+
+def location_key(latitude, longitude):
+    """Return the rounded (latitude, longitude) key used by Location rows."""
+    return round(Decimal(latitude), 5), round(Decimal(longitude), 5)
+
+
+def grid_row(latitude):
+    return math.floor((float(latitude) + 90) / GRID_CELL_SIZE)
+
+
+def grid_column(longitude):
+    column = math.floor((float(longitude) + 180) / GRID_CELL_SIZE)
+    return min(max(column, 0), GRID_COLUMNS - 1)
+
+
+def grid_cell(latitude, longitude):
+    """Return the index of the grid cell containing a point.
+
+    Cells are numbered row by row from the south west, so the cells of a
+    row of the grid form a contiguous range of indices.
+    """
+    return grid_row(latitude) * GRID_COLUMNS + grid_column(longitude)
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """Return the great circle distance in metres between points.
+
+    The arguments are in degrees and may be NumPy arrays.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def radius_bbox(latitude, longitude, radius):
+    """Return the (south, west, north, east) box containing a circle."""
+    dlat = math.degrees(radius / EARTH_RADIUS)
+    cos_lat = math.cos(math.radians(latitude))
+    dlon = 180.0 if cos_lat < 1e-9 else min(dlat / cos_lat, 180.0)
+    return (
+        max(latitude - dlat, -90.0),
+        longitude - dlon,
+        min(latitude + dlat, 90.0),
+        longitude + dlon,
+    )
+
+
+def bbox_q(south, west, north, east, prefix=""):
+    """Return a filter for the Locations inside a bounding box.
+
+    The filter selects the ranges of grid cells covering the box, so the
+    lookup is answered by the ('cell', 'latitude', 'longitude') index, and
+    then the exact coordinates. A box spanning all the columns of the grid
+    is a single range of cells, and a box spanning more than
+    'MAX_BBOX_GRID_ROWS' rows is only filtered by its coordinates.
+
+    Parameters
+    ----------
+    south, west, north, east : float
+        The bounding box in degrees. West may be greater than east for
+        boxes crossing the antimeridian.
+    prefix : str, optional
+        Prefix of the field names, such as "location__" to filter a related
+        model.
+    """
+    if west > east:
+        return bbox_q(south, west, north, 180, prefix) | bbox_q(
+            south, -180, north, east, prefix
+        )
+    first_column, last_column = grid_column(west), grid_column(east)
+    first_row, last_row = grid_row(south), grid_row(north)
+    # Bounds outside of the range of the field cannot be converted to it
+    west = max(west, -MAX_STORED_LONGITUDE)
+    east = min(east, MAX_STORED_LONGITUDE)
+    cells = models.Q()
+    if first_column == 0 and last_column == GRID_COLUMNS - 1:
+        # The rows are contiguous ranges of cells, which merge into one
+        cells = models.Q(
+            **{
+                f"{prefix}cell__range": (
+                    first_row * GRID_COLUMNS,
+                    (last_row + 1) * GRID_COLUMNS - 1,
+                )
+            }
+        )
+    elif last_row - first_row < MAX_BBOX_GRID_ROWS:
+        for row in range(first_row, last_row + 1):
+            cells |= models.Q(
+                **{
+                    f"{prefix}cell__range": (
+                        row * GRID_COLUMNS + first_column,
+                        row * GRID_COLUMNS + last_column,
+                    )
+                }
+            )
+    return cells & models.Q(
+        **{
+            f"{prefix}latitude__range": (south, north),
+            f"{prefix}longitude__range": (west, east),
+        }
+    )
+
+
+class LocationQuerySet(models.QuerySet):
+    def in_bbox(self, south, west, north, east):
+        """Return the Locations inside a (south, west, north, east) box."""
+        return self.filter(bbox_q(south, west, north, east))
+
+
+class LocationManager(models.Manager.from_queryset(LocationQuerySet)):
     def get_or_create(self, *args, **kwargs):
         # Round the latitude and longitude to 5 digits
         if "latitude" in kwargs:
@@ -16,10 +154,67 @@ class LocationManager(models.Manager):
         # Call the parent class's get_or_create method
         return super().get_or_create(*args, **kwargs)
 
+    def get_or_create_many(self, coordinates):
+        """Resolve many coordinates to Location objects in bulk.
+
+        Existing locations are looked up in batches and the missing ones are
+        inserted with a single 'bulk_create', so the number of queries does
+        not grow with the number of coordinates.
+
+        Parameters
+        ----------
+        coordinates : iterable of tuple
+            Iterable of (latitude, longitude) pairs.
+
+        Returns
+        -------
+        dict
+            Dictionary mapping rounded (latitude, longitude) keys, as returned
+            by 'location_key', to their Location objects.
+        """
+        keys = list(dict.fromkeys(location_key(*c) for c in coordinates))
+        with transaction.atomic(using=self.db):
+            locations = self._get_existing(keys)
+            missing = [key for key in keys if key not in locations]
+            if missing:
+                self.bulk_create(
+                    [
+                        self.model(
+                            latitude=lat,
+                            longitude=lon,
+                            cell=grid_cell(lat, lon),
+                        )
+                        for lat, lon in missing
+                    ],
+                    batch_size=LOCATION_LOOKUP_BATCH_SIZE,
+                    ignore_conflicts=True,
+                )
+                # Primary keys are not returned when conflicts are ignored
+                locations.update(self._get_existing(missing))
+        return locations
+
+    def _get_existing(self, keys):
+        """Return a dictionary of the existing Locations matching 'keys'."""
+        locations = {}
+        for i in range(0, len(keys), LOCATION_LOOKUP_BATCH_SIZE):
+            batch = keys[i : i + LOCATION_LOOKUP_BATCH_SIZE]
+            wanted = set(batch)
+            qs = self.filter(
+                latitude__in={lat for lat, _ in batch},
+                longitude__in={lon for _, lon in batch},
+            )
+            for location in qs:
+                key = (location.latitude, location.longitude)
+                if key in wanted:
+                    locations[key] = location
+        return locations
+
 
 class Location(models.Model):
     latitude = models.DecimalField(max_digits=7, decimal_places=5)
     longitude = models.DecimalField(max_digits=7, decimal_places=5)
+    # Grid cell index used for bounding box lookups, see 'grid_cell'
+    cell = models.IntegerField(default=0)
 
     objects = LocationManager()
 
@@ -27,6 +222,7 @@ class Location(models.Model):
         """Metadata options."""
 
         unique_together = ("latitude", "longitude")
+        indexes = [models.Index(fields=["cell", "latitude", "longitude"])]
 
     def __str__(self) -> str:
         return f"{self.latitude:0.3f}, {self.longitude:0.3f}"
@@ -35,6 +231,7 @@ class Location(models.Model):
         # Round the latitude and longitude to 5 digits
         self.latitude = round(Decimal(self.latitude), 5)
         self.longitude = round(Decimal(self.longitude), 5)
+        self.cell = grid_cell(self.latitude, self.longitude)
 
         # Call the parent class's save method
         super().save(*args, **kwargs)
@@ -46,6 +243,19 @@ class MapBoundary(models.Model):
     name = models.CharField(max_length=128)
     osm_id = models.IntegerField()  # Openstreetmap ID
     ref_gss = models.CharField(max_length=128)
+    # Projected coordinate system used for metric computations
+    crs = models.CharField(max_length=32, blank=True)
+    # Incremented whenever the boundary points are replaced or removed
+    polygon_version = models.PositiveIntegerField(default=0)
+    # Incremented whenever the stations of the boundary are written
+    stations_version = models.PositiveIntegerField(default=0)
+    # Fingerprint of the polygon and stations the catchments were built from
+    catchment_key = models.CharField(max_length=64, blank=True)
+    # Bounding box of the boundary points
+    min_latitude = models.FloatField(null=True, blank=True)
+    min_longitude = models.FloatField(null=True, blank=True)
+    max_latitude = models.FloatField(null=True, blank=True)
+    max_longitude = models.FloatField(null=True, blank=True)
 
     def __str__(self) -> str:
         return self.name
@@ -61,6 +271,130 @@ class MapBoundary(models.Model):
         url = f"https://www.openstreetmap.org/relation/{self.osm_id}"
         return url
 
+    def get_projected_crs(self, points=None):
+        """Return the projected coordinate system used for this boundary.
+
+        The coordinate system is chosen from the centre of the boundary the
+        first time it is needed, and saved so that all metric computations
+        for the boundary use the same projection.
+
+        Parameters
+        ----------
+        points : array_like, optional
+            (latitude, longitude) points of the boundary used to choose the
+            coordinate system. Defaults to the stored boundary points, or the
+            stations if there are none.
+
+        Returns
+        -------
+        str
+            The EPSG code of the projected coordinate system.
+        """
+        if self.crs:
+            return self.crs
+        if points is None:
+            points = self.get_polygon()
+            if not len(points):
+                points = self.station_set.values_list(
+                    "location__latitude", "location__longitude"
+                )
+        points = np.asarray(list(points), dtype=np.float64).reshape(-1, 2)
+        if len(points) == 0:
+            return UTM_ZONE_30N
+        latitude, longitude = points.mean(axis=0)
+        projection = getattr(settings, "BOUNDARY_PROJECTION", "utm")
+        self.crs = select_projected_crs(
+            latitude,
+            longitude,
+            prefer_national_grid=projection == "british_national_grid",
+        )
+        if self.pk is not None:
+            self.save(update_fields=["crs"])
+        return self.crs
+
+    def get_polygon(self):
+        """Return the ordered points of the boundary polygon.
+
+        The points are read from the packed 'BoundaryGeometry' row, or from
+        the BoundaryPoint rows for polygons saved before it existed. The
+        points of all rings are returned, see 'get_polygon_rings'.
+
+        Returns
+        -------
+        numpy.ndarray
+            Array of shape (n, 2) of (latitude, longitude) points, empty if
+            the polygon has not been downloaded.
+        """
+        points, _ = self.get_polygon_rings()
+        return points
+
+    def get_polygon_rings(self):
+        """Return the points of the boundary polygon and where rings start.
+
+        Returns
+        -------
+        points : numpy.ndarray
+            Array of shape (n, 2) of (latitude, longitude) points, empty if
+            the polygon has not been downloaded.
+        ring_starts : numpy.ndarray
+            The index in 'points' of the first point of each ring, such as a
+            mainland and its islands.
+        """
+        try:
+            geometry = BoundaryGeometry.objects.get(boundary=self)
+        except BoundaryGeometry.DoesNotExist:
+            points = self.boundarypoint_set.order_by("order").values_list(
+                "location__latitude", "location__longitude"
+            )
+            points = np.array(list(points), dtype=np.float64).reshape(-1, 2)
+            return points, np.zeros(1, dtype=np.intp)
+        return geometry.to_array(), geometry.get_ring_starts()
+
+    def increment_polygon_version(self):
+        """Record that the boundary points have changed."""
+        MapBoundary.objects.filter(pk=self.pk).update(
+            polygon_version=models.F("polygon_version") + 1
+        )
+        self.refresh_from_db(fields=["polygon_version"])
+
+    def increment_stations_version(self):
+        """Record that the stations of the boundary have changed."""
+        MapBoundary.objects.filter(pk=self.pk).update(
+            stations_version=models.F("stations_version") + 1
+        )
+        self.refresh_from_db(fields=["stations_version"])
+
+    @property
+    def bbox(self):
+        """The (south, west, north, east) bounding box, or None if unset."""
+        if self.min_latitude is None:
+            return None
+        return (
+            self.min_latitude,
+            self.min_longitude,
+            self.max_latitude,
+            self.max_longitude,
+        )
+
+    def update_bbox(self, points):
+        """Set the bounding box to that of (latitude, longitude) points."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if len(points):
+            south, west = points.min(axis=0).tolist()
+            north, east = points.max(axis=0).tolist()
+        else:
+            south = west = north = east = None
+        self.min_latitude, self.min_longitude = south, west
+        self.max_latitude, self.max_longitude = north, east
+        self.save(
+            update_fields=[
+                "min_latitude",
+                "min_longitude",
+                "max_latitude",
+                "max_longitude",
+            ]
+        )
+
     @property
     def polygon_query(self):
         query = f"""[out:json][timeout:25];
@@ -80,6 +414,38 @@ class MapBoundary(models.Model):
                     out;"""
         return query
 
+    def get_stations_bbox_query(self, radius=2000):
+        """Return a query for the stations in and near the boundary bbox.
+
+        The stations are classified locally with 'classify_stations', which
+        replaces the 'stations_list_query' and
+        'stations_list_query_outside_boundary' pair of queries.
+
+        Parameters
+        ----------
+        radius : float, optional
+            Distance in metres the bounding box is extended by.
+
+        Returns
+        -------
+        str or None
+            The query, or None if the boundary has no bounding box because
+            its polygon has not been downloaded.
+        """
+        if self.bbox is None:
+            return None
+        south, west = radius_bbox(
+            self.min_latitude, self.min_longitude, radius
+        )[:2]
+        north, east = radius_bbox(
+            self.max_latitude, self.max_longitude, radius
+        )[2:]
+        query = f"""[out:csv(name, ::id, ::lat, ::lon)][timeout:25];
+                    node["railway"="station"]["usage"!="tourism"]["name"]
+                    ({south:.5f},{west:.5f},{north:.5f},{east:.5f});
+                    out;"""
+        return query
+
     @property
     def stations_list_query_outside_boundary(self, radius=2000):
         query = f"""[out:csv(name, ::id, ::lat, ::lon)][timeout:25];
@@ -91,12 +457,39 @@ class MapBoundary(models.Model):
         return query
 
 
+class StationQuerySet(models.QuerySet):
+    def in_bbox(self, south, west, north, east):
+        """Return the Stations inside a (south, west, north, east) box."""
+        return self.filter(
+            location__in=Location.objects.in_bbox(south, west, north, east)
+        )
+
+    def near(self, latitude, longitude, radius):
+        """Return the Stations within 'radius' metres of a point."""
+        candidates = self.in_bbox(
+            *radius_bbox(latitude, longitude, radius)
+        ).values_list("pk", "location__latitude", "location__longitude")
+        candidates = np.array(list(candidates), dtype=np.float64)
+        if len(candidates) == 0:
+            return self.none()
+        distances = haversine_distance(
+            latitude, longitude, candidates[:, 1], candidates[:, 2]
+        )
+        return self.filter(
+            pk__in=candidates[distances <= radius, 0].astype(int).tolist()
+        )
+
+
 class Station(models.Model):
     boundary = models.ForeignKey(MapBoundary, on_delete=models.CASCADE)
     location = models.ForeignKey(Location, on_delete=models.CASCADE)
     name = models.CharField(max_length=128)
     osm_id = models.IntegerField()
     isin_boundary = models.BooleanField(default=True)
+    # False for outside stations whose catchment does not reach the boundary
+    is_relevant = models.BooleanField(default=True)
+
+    objects = StationQuerySet.as_manager()
 
     def __str__(self) -> str:
         return self.name
@@ -119,3 +512,143 @@ class BoundaryPoint(models.Model):
         """Metadata options."""
 
         unique_together = ("boundary", "order")
+
+
+class BoundaryGeometry(models.Model):
+    """The points of a boundary polygon packed into a single row."""
+
+    boundary = models.OneToOneField(
+        MapBoundary, on_delete=models.CASCADE, related_name="geometry"
+    )
+    version = models.PositiveIntegerField()  # MapBoundary.polygon_version
+    num_points = models.PositiveIntegerField()
+    checksum = models.CharField(max_length=64)  # SHA-256 of 'data'
+    # Little-endian float64 (latitude, longitude) pairs
+    data = models.BinaryField()
+    # Little-endian float64 RDP importance in metres of each point, see
+    # 'ramer_douglas_peucker_importance'. Empty for polygons without levels.
+    importance = models.BinaryField(default=b"")
+    # Little-endian int64 index of the first point of each ring, see
+    # 'join_rings'. Empty for polygons with a single ring.
+    ring_starts = models.BinaryField(default=b"")
+
+    def __str__(self) -> str:
+        return f"{self.boundary} v{self.version} ({self.num_points} points)"
+
+    @staticmethod
+    def pack(points):
+        """Return the packed bytes and checksum of (lat, lon) points."""
+        data = np.ascontiguousarray(points, dtype="<f8").reshape(-1, 2)
+        data = data.tobytes()
+        return data, hashlib.sha256(data).hexdigest()
+
+    def to_array(self):
+        """Return the points as a read-only array of shape (n, 2).
+
+        Raises
+        ------
+        ValueError
+            If the data does not match its checksum.
+        """
+        if hashlib.sha256(self.data).hexdigest() != self.checksum:
+            raise ValueError(f"Corrupt polygon geometry for {self.boundary}")
+        return np.frombuffer(self.data, dtype="<f8").reshape(-1, 2)
+
+    def get_ring_starts(self):
+        """Return the index of the first point of each ring."""
+        if not len(self.ring_starts):
+            return np.zeros(1, dtype=np.intp)
+        return np.frombuffer(self.ring_starts, dtype="<i8").astype(np.intp)
+
+    def get_level(self, tolerance):
+        """Return the coarsest simplification level within a tolerance.
+
+        Parameters
+        ----------
+        tolerance : float
+            The largest acceptable simplification tolerance in metres.
+
+        Returns
+        -------
+        level : float
+            The tolerance of the chosen level from 'POLYGON_TOLERANCES', or
+            0 for the full polygon.
+        points : numpy.ndarray
+            Array of shape (n, 2) of the (latitude, longitude) points of the
+            level, with at least three distinct points in each ring of three
+            or more.
+        ring_starts : numpy.ndarray
+            The index in 'points' of the first point of each ring.
+        """
+        points = self.to_array()
+        ring_starts = self.get_ring_starts()
+        levels = [level for level in POLYGON_TOLERANCES if level <= tolerance]
+        if not levels or not len(self.importance):
+            return 0, points, ring_starts
+        level = levels[-1]
+        importance = np.frombuffer(self.importance, dtype="<f8")
+        keep = importance > level
+        # Keep the most important vertices of each ring which simplifies to
+        # fewer than three, such as a small island at a coarse level. A ring
+        # closed by repeating its first point needs one more.
+        ring_ends = np.append(ring_starts[1:], len(points))
+        for start, end in zip(ring_starts, ring_ends):
+            closed = end - start > 1 and np.array_equal(
+                points[start], points[end - 1]
+            )
+            needed = min(3 + closed, end - start)
+            if np.count_nonzero(keep[start:end]) < needed:
+                order = np.argsort(-importance[start:end], kind="stable")
+                keep[start + order[:needed]] = True
+        # The first point of each ring is always kept
+        kept_before = np.cumsum(keep) - 1
+        return level, points[keep], kept_before[ring_starts]
+
+
+class Catchment(models.Model):
+    """The Voronoi cell of a station clipped to its boundary."""
+
+    boundary = models.ForeignKey(MapBoundary, on_delete=models.CASCADE)
+    station = models.OneToOneField(
+        Station, on_delete=models.CASCADE, related_name="catchment"
+    )
+    # Ordered [latitude, longitude] points, empty if the cell is outside
+    polygon = models.JSONField(default=list)
+    area = models.FloatField(default=0)  # Square metres
+
+    def __str__(self) -> str:
+        return f"{self.station} ({self.area / 1e6:0.2f} km2)"
+
+
+class Job(models.Model):
+    class Status(models.TextChoices):
+        PENDING = "pending"
+        RUNNING = "running"
+        SUCCESS = "success"
+        FAILED = "failed"
+
+    kind = models.CharField(max_length=64)
+    boundary = models.ForeignKey(
+        MapBoundary, on_delete=models.CASCADE, null=True, blank=True
+    )
+    params = models.JSONField(default=dict)
+    status = models.CharField(
+        max_length=16, choices=Status.choices, default=Status.PENDING
+    )
+    # Counters such as rows_fetched, points_simplified and rows_written
+    progress = models.JSONField(default=dict)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    # Milliseconds spent in each instrumented span while the job ran
+    timings = models.JSONField(default=dict, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f"{self.kind} ({self.status})"
+
+    class Meta:
+        """Metadata options."""
+
+        indexes = [models.Index(fields=["status", "created"])]
@@ -1,14 +1,76 @@
 """Get data from the Overpass API."""
 
+import asyncio
+import codecs
 import csv
 import json
+import random
+import re
+import threading
+import time
 from io import StringIO
 
 import requests
+from django.conf import settings
+
+from publictransit.instrumentation import span
+from publictransit.overpass_cache import OverpassCache
+
+
+def get_default_cache():
+    """Return the response cache configured by the 'OVERPASS_CACHE' setting.
+
+    Returns
+    -------
+    OverpassCache or None
+        The configured cache, or None if caching is disabled.
+    """
+    options = getattr(settings, "OVERPASS_CACHE", None)
+    if not options:
+        return None
+    return OverpassCache.from_settings(options)
+
+
+class OverpassError(requests.exceptions.RequestException):
+    """Raised when no Overpass API endpoint returned a successful response."""
+
+
+def get_status_url(endpoint):
+    """Return the '/api/status' URL of an Overpass API interpreter endpoint."""
+    return endpoint.rsplit("/", 1)[0] + "/status"
+
+
+def parse_status(text):
+    """Read the number of seconds until a query slot is free.
+
+    Parameters
+    ----------
+    text : str
+        The body of an Overpass API '/api/status' response.
+
+    Returns
+    -------
+    int
+        Zero if a slot is available now, or if the server has no rate limit.
+        Otherwise the number of seconds until the next slot becomes free.
+    """
+    rate_limit = re.search(r"Rate limit: (\d+)", text)
+    if rate_limit and int(rate_limit.group(1)) == 0:
+        return 0
+    available = re.search(r"(\d+) slots? available now", text)
+    if available and int(available.group(1)) > 0:
+        return 0
+    waits = [int(s) for s in re.findall(r"in (-?\d+) seconds", text)]
+    return max(min(waits), 0) if waits else 0
 
 
 class OverpassClient:
-    """Python wrapper for the OpenStreetMap Overpass API."""
+    """Python wrapper for the OpenStreetMap Overpass API.
+
+    All clients share one pooled HTTP session, so connections to the API are
+    kept alive between queries. Queries are sent to the first endpoint in
+    'endpoints' and fail over to the following mirrors if it is unavailable.
+    """
 
     _timeout = 25  # second
     _endpoint = "https://overpass-api.de/api/interpreter"
@@ -18,91 +80,421 @@ class OverpassClient:
         "application/xml",
         "application/osm3s+xml",
     ]
+    _retry_status_codes = (429, 504)
+    _max_retries = 4
+    _backoff_factor = 1.0  # second
+    _max_backoff = 60  # second
+    _pool_size = 10
+    _chunk_size = 2**16  # bytes
+
+    _session = None
+    _session_lock = threading.Lock()
 
     def __init__(self, *args, **kwargs):
-        self.endpoint = kwargs.get("endpoint", self._endpoint)
+        if "endpoint" in kwargs:
+            self.endpoints = [kwargs["endpoint"]]
+        else:
+            self.endpoints = kwargs.get(
+                "endpoints",
+                getattr(settings, "OVERPASS_ENDPOINTS", [self._endpoint]),
+            )
         self.headers = kwargs.get("headers", self._headers)
         self.timeout = kwargs.get("timeout", self._timeout)
+        self.max_retries = kwargs.get("max_retries", self._max_retries)
+        self.check_status = kwargs.get("check_status", True)
+        if "cache" in kwargs:
+            self.cache = kwargs["cache"]
+        else:
+            self.cache = get_default_cache()
+
+    @property
+    def endpoint(self):
+        """The primary endpoint, which is also used to key cached responses."""
+        return self.endpoints[0]
+
+    @classmethod
+    def get_session(cls):
+        """Return the HTTP session shared by all clients, creating it once."""
+        with cls._session_lock:
+            if cls._session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=cls._pool_size,
+                    pool_maxsize=cls._pool_size,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                cls._session = session
+            return cls._session
+
+    def _backoff(self, attempt, response=None):
+        """Sleep before retrying, using exponential backoff with jitter.
+
+        A 'Retry-After' header sent by the server takes precedence over the
+        computed delay. Nothing is done after the last attempt.
+        """
+        if attempt >= self.max_retries:
+            return
+        retry_after = None
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            delay = int(retry_after)
+        else:
+            delay = min(self._max_backoff, self._backoff_factor * 2**attempt)
+            delay = random.uniform(delay / 2, delay)
+        time.sleep(delay)
 
-    def _make_request(self, query: str) -> requests.Response:
+    def _wait_for_slot(self, endpoint):
+        """Wait until the endpoint's '/api/status' reports a free query slot.
+
+        Endpoints which do not provide a status page are not waited for.
+        """
+        try:
+            response = self.get_session().get(
+                get_status_url(endpoint), timeout=self.timeout
+            )
+        except requests.exceptions.RequestException:
+            return
+        if response.ok:
+            delay = parse_status(response.text)
+            if delay:
+                time.sleep(min(delay, self._max_backoff))
+
+    def _make_request(
+        self, query: str, stream: bool = False
+    ) -> requests.Response:
         """Send a POST request to the Overpass API with the given query.
 
+        Each endpoint is tried in turn. Timeouts and responses with a status
+        code in '_retry_status_codes' are retried on the same endpoint with
+        exponential backoff, up to 'max_retries' times, before moving on to
+        the next endpoint.
+
         Parameters
         ----------
         query : str
             A string containing the Overpass query to send to the API.
+        stream : bool, optional
+            If True, the response body is not downloaded until it is read.
 
         Returns
         -------
         requests.Response
-            A 'requests.Response' object representing the response to the POST
-            request. If the request was successful (i.e., the status code is
-            less than 400), the response object will contain the data returned
-            by the Overpass API. Otherwise, None will be returned.
+            A 'requests.Response' object containing the data returned by the
+            Overpass API.
 
         Raises
         ------
-        requests.exceptions.Timeout
-            If a timeout occurs while trying to make the request.
-        requests.exceptions.RequestException
-            If any other exception occurs while making the request.
+        OverpassError
+            If the query is rejected by the API, or if no endpoint returned a
+            successful response.
         """
         payload = {"data": query}
-        try:
-            response = requests.post(
-                self.endpoint,
-                data=payload,
-                timeout=self.timeout,
-                headers=self.headers,
-            )
-            # raise error if response is not successful (status code >= 400)
-            response.raise_for_status()
-            response.encoding = "utf-8"
-            return response
-        except requests.exceptions.Timeout:
-            # Timeout occurred while trying to make the request
-            print("Timeout error occurred while making the request.")
-            return None
-        except requests.exceptions.RequestException as e:
-            # Other exceptions occurred
-            print("An error occurred while making the request:", e)
-            return None
-
-    def get(self, query):
+        session = self.get_session()
+        errors = []
+        for endpoint in self.endpoints:
+            for attempt in range(self.max_retries + 1):
+                if self.check_status:
+                    self._wait_for_slot(endpoint)
+                try:
+                    response = session.post(
+                        endpoint,
+                        data=payload,
+                        timeout=self.timeout,
+                        headers=self.headers,
+                        stream=stream,
+                    )
+                except requests.exceptions.Timeout as e:
+                    errors.append(f"{endpoint}: {e}")
+                    self._backoff(attempt)
+                    continue
+                except requests.exceptions.RequestException as e:
+                    # Connection errors are not retried on the same endpoint
+                    errors.append(f"{endpoint}: {e}")
+                    break
+
+                if response.status_code in self._retry_status_codes:
+                    errors.append(f"{endpoint}: HTTP {response.status_code}")
+                    self._backoff(attempt, response)
+                    continue
+                if response.status_code == 400:
+                    # The query itself is invalid, so other mirrors won't help
+                    raise OverpassError(
+                        f"Invalid query: {response.text}", response=response
+                    )
+                if not response.ok:
+                    errors.append(f"{endpoint}: HTTP {response.status_code}")
+                    break
+                response.encoding = "utf-8"
+                return response
+        raise OverpassError(
+            "No Overpass API endpoint returned a response: "
+            + "; ".join(errors)
+        )
+
+    def get(self, query, stream=False):
         """Send an Overpass QL query to the API endpoint and return a response.
 
         Parameters
         ----------
         query : str
             The Overpass QL query to send to the endpoint.
+        stream : bool, optional
+            If True, the response body is parsed incrementally as it is
+            downloaded and a generator is returned instead, see Notes.
 
         Returns
         -------
-        response : str or list
+        response : str or list or dict or generator
             The response from the Overpass API.
             If the content type is "text/csv", the response is returned as a
-            list of lists (using the csv.reader function). Otherwise, the
-            response is returned as a string.
+            list of lists (using the csv.reader function). JSON responses are
+            returned as a dictionary. Otherwise, the response is returned as a
+            string.
 
         Notes
         -----
-        The '_make_request' method is used to make the request to the Overpass
-        API endpoint. If an error occurs while making the request, the method
-        returns 'None'.
+        Responses are first looked up in the client's cache, if it has one,
+        and successful responses from the API are added to it. The
+        '_make_request' method is used to make the request to the Overpass
+        API endpoint, and raises 'OverpassError' if the request fails.
+
+        In streaming mode the generator yields CSV rows for "text/csv"
+        responses, the members of the "elements" array for JSON responses,
+        and chunks of text otherwise, so the whole body is never held in
+        memory.
         """
+        if self.cache is not None:
+            entry = self.cache.lookup(self.endpoint, query)
+            if entry is not None:
+                if stream:
+                    return self._iter_parse(
+                        entry.content_type, entry.iter_bytes()
+                    )
+                with span("overpass_parse"):
+                    return self._parse(entry.content_type, entry.read_text())
+
         # Get the response from Overpass
-        response = self._make_request(query)
-        if response:
-            content_type = response.headers.get("content-type")
-            if content_type == "text/csv":
-                return list(
-                    csv.reader(StringIO(response.text), delimiter="\t")
-                )
-            elif content_type in self._text_content_types:
-                return response.text
-            elif content_type == "application/json":
-                response = json.loads(response.text)
-        return response
+        with span("overpass"):
+            response = self._make_request(query, stream=stream)
+        content_type = response.headers.get("content-type")
+        if stream:
+            return self._iter_parse(
+                content_type, self._iter_response(query, response)
+            )
+        if self.cache is not None:
+            self.cache.store(self.endpoint, query, content_type, response.text)
+        with span("overpass_parse"):
+            return self._parse(content_type, response.text)
+
+    def _iter_response(self, query, response):
+        """Yield the body of a streamed response, caching it if possible."""
+        content_type = response.headers.get("content-type")
+        chunks = response.iter_content(chunk_size=self._chunk_size)
+        if self.cache is not None:
+            chunks = self.cache.store_stream(
+                self.endpoint, query, content_type, chunks
+            )
+        try:
+            yield from chunks
+        finally:
+            response.close()
+
+    def _parse(self, content_type, text):
+        """Convert the body of an Overpass API response by its content type.
+
+        Parameters
+        ----------
+        content_type : str
+            The content type of the response.
+        text : str
+            The body of the response.
+
+        Returns
+        -------
+        str or list or dict
+            The parsed response, see 'get'.
+        """
+        if content_type == "text/csv":
+            return list(csv.reader(StringIO(text), delimiter="\t"))
+        elif content_type in self._text_content_types:
+            return text
+        elif content_type == "application/json":
+            return json.loads(text)
+        return text
+
+    def _iter_parse(self, content_type, chunks):
+        """Incrementally convert the body of an Overpass API response.
+
+        Parameters
+        ----------
+        content_type : str
+            The content type of the response.
+        chunks : iterable of bytes
+            The body of the response as chunks of UTF-8 bytes.
+
+        Returns
+        -------
+        generator
+            A generator of parsed items, see 'get'.
+        """
+        text_chunks = codecs.iterdecode(chunks, "utf-8")
+        if content_type == "text/csv":
+            return csv.reader(iter_lines(text_chunks), delimiter="\t")
+        elif content_type == "application/json":
+            return iter_json_elements(text_chunks)
+        return text_chunks
+
+
+class AsyncOverpassClient:
+    """Asyncio interface to the OpenStreetMap Overpass API.
+
+    Queries are sent by an 'OverpassClient' running in an executor, so they
+    share its pooled session, response cache, retries and mirror failover,
+    and 'get' dispatches on the response content type in the same way.
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor, optional
+        The executor the requests run in. Defaults to the event loop's
+        default thread pool.
+    **kwargs
+        Keyword arguments passed to 'OverpassClient'.
+    """
+
+    def __init__(self, *args, executor=None, **kwargs):
+        self.client = OverpassClient(*args, **kwargs)
+        self.executor = executor
+
+    async def get(self, query):
+        """Send an Overpass QL query and return the parsed response.
+
+        Parameters
+        ----------
+        query : str
+            The Overpass QL query to send to the endpoint.
+
+        Returns
+        -------
+        response : str or list or dict
+            The response from the Overpass API, see 'OverpassClient.get'.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self.client.get, query
+        )
+
+
+def iter_lines(text_chunks):
+    """Split chunks of text into lines, keeping the line endings.
+
+    Parameters
+    ----------
+    text_chunks : iterable of str
+        Consecutive chunks of text.
+
+    Yields
+    ------
+    str
+        The lines of the text.
+    """
+    remainder = ""
+    for chunk in text_chunks:
+        *lines, remainder = (remainder + chunk).split("\n")
+        for line in lines:
+            yield line + "\n"
+    if remainder:
+        yield remainder
+
+
+def iter_json_elements(text_chunks):
+    """Yield the members of the "elements" array of an Overpass JSON response.
+
+    The response is parsed incrementally, so only the element being decoded
+    and the current chunk of text are held in memory.
+
+    Parameters
+    ----------
+    text_chunks : iterable of str
+        Consecutive chunks of the JSON response body.
+
+    Yields
+    ------
+    dict
+        The elements of the response, in order.
+
+    Raises
+    ------
+    ValueError
+        If the response is not a JSON object, or ends before the "elements"
+        array is complete.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(text_chunks)
+    buffer = ""
+    pos = 0
+    exhausted = False
+
+    def fill():
+        nonlocal buffer, pos, exhausted
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+        else:
+            buffer = buffer[pos:] + chunk
+            pos = 0
+        return not exhausted
+
+    def skip(characters):
+        # Advance past whitespace and the given separator characters
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in characters:
+                pos += 1
+            if pos < len(buffer) or not fill():
+                return buffer[pos] if pos < len(buffer) else None
+
+    def decode():
+        # Decode the next value, reading more text until it is complete
+        nonlocal pos
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if fill():
+                    continue
+                raise
+            # A value is complete once it is followed by a separator, as
+            # e.g. a number at the end of the buffer may continue in the
+            # next chunk
+            complete = end < len(buffer) and buffer[end] in " \t\r\n,:]}"
+            if complete or exhausted or not fill():
+                pos = end
+                return value
+
+    if skip(" \t\r\n") != "{":
+        raise ValueError("Overpass JSON response is not an object")
+    pos += 1
+    while skip(" \t\r\n,") not in ("}", None):
+        key = decode()
+        if skip(" \t\r\n:") is None:
+            break
+        if key != "elements":
+            decode()
+            continue
+        if skip(" \t\r\n") != "[":
+            raise ValueError('"elements" is not an array')
+        pos += 1
+        while skip(" \t\r\n,") not in ("]", None):
+            yield decode()
+        if skip("") == "]":
+            pos += 1
+            continue
+        break
+    else:
+        return
+    raise ValueError("Overpass JSON response ended unexpectedly")
 
 
 def get_boundary_check_query(area_value, test_area_standard):
@@ -0,0 +1,334 @@
+"""Persistent on-disk cache for Overpass API responses."""
+
+import hashlib
+import os
+import re
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import NamedTuple
+
+DAY = 24 * 60 * 60
+
+# Matches quoted strings, which are kept as they are, or runs of whitespace
+_QUERY_TOKEN_RE = re.compile(r"(\"(?:[^\"\\]|\\.)*\"|'(?:[^'\\]|\\.)*')|\s+")
+_OUTPUT_FORMAT_RE = re.compile(r"\[out:(\w+)")
+# Overpass reports errors while running a query, such as a timeout or
+# running out of memory, with HTTP 200 and a remark after the partial data
+_RUNTIME_ERROR_RE = re.compile(rb"runtime error:")
+# Number of bytes at the end of a response body searched for the remark
+_REMARK_TAIL_SIZE = 4096
+
+
+def has_runtime_error(tail):
+    """Return True if the end of a response body reports a runtime error.
+
+    Parameters
+    ----------
+    tail : bytes
+        The last bytes of an Overpass API response body, which hold the
+        "remark" key of JSON responses and the remark of other formats.
+
+    Returns
+    -------
+    bool
+        True if the query failed while running, so the data is partial.
+    """
+    return _RUNTIME_ERROR_RE.search(tail) is not None
+
+
+def normalise_query(query):
+    """Collapse the whitespace of an Overpass QL query.
+
+    Whitespace inside quoted strings is left unchanged, so two queries which
+    only differ in indentation or line breaks normalise to the same string.
+
+    Parameters
+    ----------
+    query : str
+        The Overpass QL query.
+
+    Returns
+    -------
+    str
+        The normalised query.
+    """
+
+    def replace(match):
+        return match.group(1) or " "
+
+    return _QUERY_TOKEN_RE.sub(replace, query).strip()
+
+
+def get_query_type(query):
+    """Return the output format of an Overpass QL query.
+
+    Parameters
+    ----------
+    query : str
+        The Overpass QL query.
+
+    Returns
+    -------
+    str
+        The output format, e.g. "json" or "csv". Queries without an
+        '[out:...]' setting return "xml", the Overpass API default.
+    """
+    match = _OUTPUT_FORMAT_RE.search(query)
+    return match.group(1) if match else "xml"
+
+
+class CacheEntry(NamedTuple):
+    content_type: str
+    path: Path
+
+    def read_text(self):
+        return self.path.read_text(encoding="utf-8")
+
+    def iter_bytes(self, chunk_size=2**16):
+        with open(self.path, "rb") as f:
+            while chunk := f.read(chunk_size):
+                yield chunk
+
+
+class OverpassCache:
+    """Cache of Overpass API responses stored in a local directory.
+
+    Response bodies are stored as files and indexed in a SQLite database,
+    keyed on the endpoint and the normalised query. Entries expire after a
+    time-to-live which depends on the query output format, and the least
+    recently used entries are evicted once the cache grows beyond
+    'max_size' bytes.
+    """
+
+    default_ttls = {
+        "json": 30 * DAY,  # Boundary relations rarely change
+        "csv": 7 * DAY,
+        "xml": 7 * DAY,
+    }
+
+    def __init__(
+        self, directory, ttls=None, default_ttl=DAY, max_size=2**28
+    ):
+        self.directory = Path(directory)
+        self.ttls = {**self.default_ttls, **(ttls or {})}
+        self.default_ttl = default_ttl
+        self.max_size = max_size
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY,"
+                " query_type TEXT, content_type TEXT, size INTEGER,"
+                " created REAL, accessed REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY,"
+                " value INTEGER)"
+            )
+
+    @classmethod
+    def from_settings(cls, options):
+        """Create a cache from an 'OVERPASS_CACHE' settings dictionary."""
+        return cls(
+            options["DIRECTORY"],
+            ttls=options.get("TTLS"),
+            default_ttl=options.get("DEFAULT_TTL", DAY),
+            max_size=options.get("MAX_SIZE", 2**28),
+        )
+
+    @contextmanager
+    def _connect(self):
+        """Open the index database, committing and closing it on exit."""
+        conn = sqlite3.connect(self.directory / "index.sqlite3", timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(endpoint, query):
+        """Return the cache key for a query sent to an endpoint."""
+        text = f"{endpoint}\n{normalise_query(query)}"
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return self.directory / f"{key}.body"
+
+    def _increment(self, conn, name):
+        conn.execute(
+            (
+                "INSERT INTO counters VALUES (?, 1) ON CONFLICT(name)"
+                " DO UPDATE SET value = value + 1"
+            ),
+            (name,),
+        )
+
+    def lookup(self, endpoint, query):
+        """Return the cached response for a query, or None if there is none.
+
+        Parameters
+        ----------
+        endpoint : str
+            The URL of the Overpass API endpoint.
+        query : str
+            The Overpass QL query.
+
+        Returns
+        -------
+        CacheEntry or None
+            The content type and file path of the cached response body, or
+            None if the response is not cached or has expired.
+        """
+        key = self.make_key(endpoint, query)
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                (
+                    "SELECT query_type, content_type, created FROM entries"
+                    " WHERE key = ?"
+                ),
+                (key,),
+            ).fetchone()
+            if row is not None:
+                query_type, content_type, created = row
+                ttl = self.ttls.get(query_type, self.default_ttl)
+                if now - created <= ttl and self._path(key).exists():
+                    conn.execute(
+                        "UPDATE entries SET accessed = ? WHERE key = ?",
+                        (now, key),
+                    )
+                    self._increment(conn, "hits")
+                    return CacheEntry(content_type, self._path(key))
+                self._delete(conn, key)
+            self._increment(conn, "misses")
+        return None
+
+    def store(self, endpoint, query, content_type, chunks):
+        """Store a response body in the cache.
+
+        Parameters
+        ----------
+        endpoint : str
+            The URL of the Overpass API endpoint.
+        query : str
+            The Overpass QL query.
+        content_type : str
+            The content type of the response.
+        chunks : str or iterable of bytes
+            The response body, either as text or as chunks of UTF-8 bytes.
+
+        Returns
+        -------
+        CacheEntry or None
+            The content type and file path of the cached response body, or
+            None if it was not stored, see 'store_stream'.
+        """
+        if isinstance(chunks, str):
+            chunks = [chunks.encode("utf-8")]
+        for _ in self.store_stream(endpoint, query, content_type, chunks):
+            pass
+        path = self._path(self.make_key(endpoint, query))
+        return CacheEntry(content_type, path) if path.exists() else None
+
+    def store_stream(self, endpoint, query, content_type, chunks):
+        """Store a response body in the cache while passing it through.
+
+        The body is written to a temporary file as the chunks are consumed,
+        and only indexed once the last chunk has been read, so a partially
+        written body is never served. If the consumer stops early, or the
+        body ends with a runtime error remark, nothing is stored.
+
+        Parameters
+        ----------
+        endpoint : str
+            The URL of the Overpass API endpoint.
+        query : str
+            The Overpass QL query.
+        content_type : str
+            The content type of the response.
+        chunks : iterable of bytes
+            The response body as chunks of UTF-8 bytes.
+
+        Yields
+        ------
+        bytes
+            The chunks of the response body.
+        """
+        key = self.make_key(endpoint, query)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        tail = b""
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    tail = (
+                        tail[-_REMARK_TAIL_SIZE:] + chunk[-_REMARK_TAIL_SIZE:]
+                    )
+                    yield chunk
+            if has_runtime_error(tail):
+                # The partial results of a failed query are not cached
+                os.unlink(tmp_path)
+                return
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    get_query_type(query),
+                    content_type,
+                    self._path(key).stat().st_size,
+                    now,
+                    now,
+                ),
+            )
+            self._evict(conn)
+
+    def _delete(self, conn, key):
+        conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self._path(key).unlink(missing_ok=True)
+
+    def _evict(self, conn):
+        """Remove the least recently used entries until under 'max_size'."""
+        (total,) = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        if total <= self.max_size:
+            return
+        rows = conn.execute(
+            "SELECT key, size FROM entries ORDER BY accessed"
+        ).fetchall()
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            self._delete(conn, key)
+            total -= size
+
+    def clear(self):
+        """Remove all entries and reset the hit and miss counters."""
+        with self._connect() as conn:
+            keys = conn.execute("SELECT key FROM entries").fetchall()
+            for (key,) in keys:
+                self._delete(conn, key)
+            conn.execute("DELETE FROM counters")
+
+    def stats(self):
+        """Return the hit and miss counters and the size of the cache."""
+        with self._connect() as conn:
+            counters = dict(conn.execute("SELECT name, value FROM counters"))
+            entries, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        return {
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "entries": entries,
+            "size": size,
+        }
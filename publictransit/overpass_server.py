@@ -0,0 +1,300 @@
+"""Local stand-in for the Overpass API which replays recorded responses.
+
+The server answers Overpass QL queries from a directory of recorded
+response bodies, so downloads can be tested and benchmarked without network
+access and without the latency of the public API dominating the timings.
+Slow responses, larger payloads and rate limiting can be simulated, and
+queries which have not been recorded can be forwarded to a real endpoint
+and recorded.
+
+Point the clients at the server with the 'OVERPASS_ENDPOINT' environment
+variable, or pass its 'url' as the 'endpoint' of an 'OverpassClient'.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from publictransit.overpass_cache import get_query_type, normalise_query
+
+# The content types the Overpass API returns for each output format, which
+# 'OverpassClient.get' dispatches on
+CONTENT_TYPES = {
+    "csv": "text/csv",
+    "json": "application/json",
+    "xml": "application/osm3s+xml",
+}
+
+# Added to the OSM IDs of each copy of a scaled response
+SCALE_ID_OFFSET = 10**12
+
+DEFAULT_RECORDINGS = Path(__file__).resolve().parent / "fixtures" / "overpass"
+
+
+class Recordings:
+    """Directory of recorded Overpass API responses.
+
+    Each response body is stored in a file named after the hash of the
+    normalised query and its output format, next to a '.query' file with
+    the query text.
+    """
+
+    def __init__(self, directory=DEFAULT_RECORDINGS):
+        self.directory = Path(directory)
+
+    @staticmethod
+    def make_key(query):
+        """Return the file name stem of the recording of a query."""
+        text = normalise_query(query).encode("utf-8")
+        return hashlib.sha256(text).hexdigest()[:24]
+
+    def _path(self, query):
+        name = f"{self.make_key(query)}.{get_query_type(query)}"
+        return self.directory / name
+
+    def load(self, query):
+        """Return the recorded body of a query, or None if there is none."""
+        path = self._path(query)
+        if not path.exists():
+            return None
+        return path.read_bytes()
+
+    def save(self, query, body):
+        """Record the response body of a query."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(query)
+        path.with_suffix(".query").write_text(
+            normalise_query(query) + "\n", encoding="utf-8"
+        )
+        path.write_bytes(body)
+
+
+def scale_response(query_type, body, scale):
+    """Return a response body with its elements repeated 'scale' times.
+
+    Each copy of a JSON element or CSV row gets its OSM IDs, and the node
+    and member references of JSON elements, offset by a multiple of
+    'SCALE_ID_OFFSET', so the copies are distinct objects. XML responses,
+    and CSV responses without an '@id' column, are not scaled.
+
+    Parameters
+    ----------
+    query_type : str
+        The output format of the query, see 'get_query_type'.
+    body : bytes
+        The recorded response body.
+    scale : int
+        The number of copies of each element.
+
+    Returns
+    -------
+    bytes
+        The scaled response body.
+    """
+    if scale <= 1:
+        return body
+    if query_type == "json":
+        data = json.loads(body)
+        elements = []
+        for copy in range(scale):
+            offset = copy * SCALE_ID_OFFSET
+            for element in data.get("elements", []):
+                element = {**element, "id": element["id"] + offset}
+                if "nodes" in element:
+                    element["nodes"] = [
+                        node + offset for node in element["nodes"]
+                    ]
+                if "members" in element:
+                    element["members"] = [
+                        {**member, "ref": member["ref"] + offset}
+                        for member in element["members"]
+                    ]
+                elements.append(element)
+        return json.dumps({**data, "elements": elements}).encode("utf-8")
+    if query_type == "csv":
+        header, *rows = body.decode("utf-8").splitlines()
+        columns = header.split("\t")
+        if "@id" not in columns:
+            return body
+        id_column = columns.index("@id")
+        lines = [header]
+        for copy in range(scale):
+            for row in rows:
+                values = row.split("\t")
+                osm_id = int(values[id_column]) + copy * SCALE_ID_OFFSET
+                values[id_column] = str(osm_id)
+                lines.append("\t".join(values))
+        return ("\n".join(lines) + "\n").encode("utf-8")
+    return body
+
+
+class OverpassRequestHandler(BaseHTTPRequestHandler):
+    server_version = "OverpassStandIn/1.0"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path.endswith("/status"):
+            self.send_body(200, "text/plain", b"Rate limit: 0\n")
+        else:
+            query = parse_qs(url.query).get("data", [""])[0]
+            self.server.respond(self, query)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        self.server.respond(self, form.get("data", [""])[0])
+
+    def send_body(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class OverpassStandInServer(ThreadingHTTPServer):
+    """HTTP server which answers Overpass queries from recordings.
+
+    Parameters
+    ----------
+    recordings : Recordings or str or Path, optional
+        The recorded responses, or the directory they are stored in.
+    address : tuple, optional
+        The (host, port) the server listens on. Port 0 picks a free port.
+    latency : float, optional
+        Seconds to wait before answering each query.
+    scale : int, optional
+        Number of copies of each element in the responses, see
+        'scale_response'.
+    throttle_every : int, optional
+        If set, every n-th query is answered with HTTP 429 Too Many Requests,
+        like a rate limited public endpoint.
+    retry_after : int, optional
+        The 'Retry-After' header of the 429 responses in seconds.
+    upstream : str, optional
+        URL of an Overpass API endpoint which queries that have not been
+        recorded are forwarded to. Successful responses are recorded.
+    verbose : bool, optional
+        Log each request to standard error.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        recordings=DEFAULT_RECORDINGS,
+        address=("127.0.0.1", 0),
+        latency=0,
+        scale=1,
+        throttle_every=0,
+        retry_after=1,
+        upstream=None,
+        verbose=False,
+    ):
+        super().__init__(address, OverpassRequestHandler)
+        if not isinstance(recordings, Recordings):
+            recordings = Recordings(recordings)
+        self.recordings = recordings
+        self.latency = latency
+        self.scale = scale
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.upstream = upstream
+        self.verbose = verbose
+        self.counts = {"queries": 0, "throttled": 0, "missing": 0}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        """The URL of the interpreter endpoint of the server."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api/interpreter"
+
+    def respond(self, handler, query):
+        """Answer a query with its recorded response."""
+        with self._lock:
+            self.counts["queries"] += 1
+            number = self.counts["queries"]
+        if self.latency:
+            time.sleep(self.latency)
+        if self.throttle_every and number % self.throttle_every == 0:
+            with self._lock:
+                self.counts["throttled"] += 1
+            handler.send_body(
+                429,
+                "text/plain",
+                b"Too Many Requests",
+                {"Retry-After": str(self.retry_after)},
+            )
+            return
+
+        body = self.recordings.load(query)
+        if body is None and self.upstream:
+            body = self.record(query)
+        if body is None:
+            with self._lock:
+                self.counts["missing"] += 1
+            handler.send_body(
+                404, "text/plain", b"No recorded response for the query"
+            )
+            return
+        query_type = get_query_type(query)
+        handler.send_body(
+            200,
+            CONTENT_TYPES.get(query_type, "text/plain"),
+            scale_response(query_type, body, self.scale),
+        )
+
+    def record(self, query):
+        """Forward a query to the upstream endpoint and record the response.
+
+        Returns
+        -------
+        bytes or None
+            The response body, or None if the request failed.
+        """
+        try:
+            response = requests.post(
+                self.upstream, data={"data": query}, timeout=180
+            )
+        except requests.exceptions.RequestException:
+            return None
+        if not response.ok:
+            return None
+        self.recordings.save(query, response.content)
+        return response.content
+
+    def start(self):
+        """Serve requests in a background thread and return the server."""
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="overpass-stand-in", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the background thread and close the server."""
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -1,6 +1,9 @@
+from django.db.models import FloatField
+from django.db.models.functions import Cast
 from rest_framework import serializers
 
 from publictransit import models
+from publictransit.utilities.export_tools import EXPORT_FORMATS
 
 
 class MapBoundarySerializer(serializers.ModelSerializer):
@@ -28,6 +31,64 @@ class StationSerializer(serializers.ModelSerializer):
             "name",
             "osm_id",
             "isin_boundary",
+            "is_relevant",
+        ]
+
+
+class StationRowSerializer:
+    """Read-only fast path of 'StationSerializer' for large listings.
+
+    Stations are read with 'QuerySet.values' and converted straight to the
+    same JSON structure as 'StationSerializer', without creating model
+    instances or per-field serializers. Only the columns of the requested
+    fields are selected, and the coordinates are read as floats, which is
+    much faster than converting them to Decimals.
+    """
+
+    # The database column or expression of each field
+    columns = {
+        "id": "id",
+        "boundary": "boundary_id",
+        "location": None,
+        "name": "name",
+        "osm_id": "osm_id",
+        "isin_boundary": "isin_boundary",
+        "is_relevant": "is_relevant",
+    }
+
+    def __init__(self, fields=None):
+        self.fields = list(fields or self.columns)
+
+    def get_values(self, queryset, *extra_columns):
+        """Return the rows of the columns of the fields of a queryset."""
+        columns = [
+            self.columns[field] for field in self.fields if field != "location"
+        ]
+        expressions = {}
+        if "location" in self.fields:
+            expressions = {
+                "latitude": Cast("location__latitude", FloatField()),
+                "longitude": Cast("location__longitude", FloatField()),
+            }
+        return queryset.values(*columns, *extra_columns, **expressions)
+
+    def to_representation(self, row):
+        data = {}
+        for field in self.fields:
+            if field == "location":
+                # Formatted like the Location DecimalFields by DRF
+                data["location"] = {
+                    "latitude": f"{row['latitude']:.5f}",
+                    "longitude": f"{row['longitude']:.5f}",
+                }
+            else:
+                data[field] = row[self.columns[field]]
+        return data
+
+    def serialize(self, queryset):
+        """Return the representations of the stations of a queryset."""
+        return [
+            self.to_representation(row) for row in self.get_values(queryset)
         ]
 
 
@@ -38,7 +99,86 @@ class CheckBoundarySerializer(serializers.Serializer):
     area_value = serializers.CharField()
 
 
+def parse_floats(value, count, name):
+    try:
+        values = [float(v) for v in value.split(",")]
+    except ValueError:
+        values = []
+    if len(values) != count:
+        raise serializers.ValidationError(
+            f"{name} must be {count} comma separated numbers"
+        )
+    return values
+
+
+class StationFilterSerializer(serializers.Serializer):
+    boundary_id = serializers.IntegerField(required=False)
+    # south,west,north,east in degrees, as used by the Overpass API
+    bbox = serializers.CharField(required=False)
+    # latitude,longitude,radius with the radius in metres
+    near = serializers.CharField(required=False)
+    # Comma separated names of the fields to return
+    fields = serializers.CharField(required=False)
+
+    def validate_fields(self, value):
+        fields = [field.strip() for field in value.split(",")]
+        fields = [field for field in fields if field]
+        unknown = set(fields) - set(StationRowSerializer.columns)
+        if unknown:
+            raise serializers.ValidationError(
+                f"Unknown fields: {', '.join(sorted(unknown))}"
+            )
+        return fields
+
+    def validate_bbox(self, value):
+        south, west, north, east = parse_floats(value, 4, "bbox")
+        if not -90 <= south <= north <= 90:
+            raise serializers.ValidationError("bbox latitudes are invalid")
+        # West is greater than east for boxes crossing the antimeridian
+        if not (-180 <= west <= 180 and -180 <= east <= 180):
+            raise serializers.ValidationError("bbox longitudes are invalid")
+        return south, west, north, east
+
+    def validate_near(self, value):
+        latitude, longitude, radius = parse_floats(value, 3, "near")
+        if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+            raise serializers.ValidationError("near is invalid")
+        if radius < 0:
+            raise serializers.ValidationError("near is invalid")
+        return latitude, longitude, radius
+
+
+class PolygonLevelSerializer(serializers.Serializer):
+    boundary_id = serializers.IntegerField()
+    # Web map zoom level, used to choose the tolerance from the resolution
+    zoom = serializers.FloatField(required=False, min_value=0, max_value=30)
+    # Largest acceptable simplification tolerance in metres
+    tolerance = serializers.FloatField(required=False, min_value=0)
+
+
+class StationExportSerializer(StationFilterSerializer):
+    boundary_id = serializers.IntegerField()
+    # Encoding of the export, as 'format' is used by DRF
+    output = serializers.ChoiceField(choices=EXPORT_FORMATS, default="geojson")
+
+
+class PolygonExportSerializer(PolygonLevelSerializer):
+    output = serializers.ChoiceField(choices=EXPORT_FORMATS, default="geojson")
+
+
 class BoundaryPointSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.BoundaryPoint
         fields = "__all__"
+
+
+class CatchmentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.Catchment
+        fields = ["id", "boundary", "station", "polygon", "area"]
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.Job
+        fields = "__all__"
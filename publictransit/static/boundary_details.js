@@ -135,9 +135,16 @@ function downloadPolygonData(boundary_id) {
             'X-CSRFToken': getCsrfToken()
         },
         success: function (data) {
-            updatePolygonSummaryText(data);
-            $("#download-polygon-btn").hide(); // Hide elements
-            $("#remove-polygon-btn").show(); // Show elements
+            $("#download-polygon-btn").prop("disabled", true);
+            pollJob(data.job_id, function (job) {
+                $("#polygon-summary").text(jobProgressText(job));
+            }, function () {
+                $("#download-polygon-btn").prop("disabled", false);
+                getPolygonCountFromDb(boundary_id);
+            }, function (job) {
+                $("#download-polygon-btn").prop("disabled", false);
+                alert(`An error occurred while downloading the boundary polygon data: ${job.error}`);
+            });
         },
         error: function () {
             alert("An error occurred while downloading the boundary polygon data.");
@@ -145,6 +152,43 @@ function downloadPolygonData(boundary_id) {
     });
 }
 
+function pollJob(job_id, onProgress, onSuccess, onFailure) {
+    $.ajax({
+        url: `jobs/${job_id}/`,
+        type: 'GET',
+        success: function (job) {
+            if (job.status === "success") {
+                onSuccess(job);
+            } else if (job.status === "failed") {
+                onFailure(job);
+            } else {
+                onProgress(job);
+                setTimeout(function () {
+                    pollJob(job_id, onProgress, onSuccess, onFailure);
+                }, 1000);
+            }
+        },
+        error: function () {
+            alert("An error occurred while checking the progress of the download.");
+        }
+    });
+}
+
+function jobProgressText(job) {
+    const progress = job.progress ?? {};
+    const parts = [`Download ${job.status}`];
+    if (progress.rows_fetched !== undefined) {
+        parts.push(`${progress.rows_fetched} rows fetched`);
+    }
+    if (progress.points_simplified !== undefined) {
+        parts.push(`${progress.points_simplified} points simplified`);
+    }
+    if (progress.rows_written !== undefined) {
+        parts.push(`${progress.rows_written} rows written`);
+    }
+    return parts.join(", ") + "...";
+}
+
 
 function removeStationsData(boundary_id) {
     $.ajax({
@@ -177,14 +221,17 @@ function downloadStationsData(boundary_id) {
             'X-CSRFToken': getCsrfToken()
         },
         success: function (data) {
-            updateStationSummaryText(data.stations);
-            updateStationsTable(data.stations);
-            // Show elements
-            $("#remove-stations-btn").show();
-            $("#stations-map-btn").show();
-            $("#train-station-list").show();
-            // Hide elements
-            $("#download-stations-btn").hide();
+            $("#download-stations-btn").prop("disabled", true);
+            pollJob(data.job_id, function (job) {
+                $("#stations-summary").text(jobProgressText(job));
+            }, function () {
+                $("#download-stations-btn").prop("disabled", false);
+                $("#train-station-list").show();
+                getStationsFromDb(boundary_id);
+            }, function (job) {
+                $("#download-stations-btn").prop("disabled", false);
+                alert(`An error occurred while downloading the train stations data: ${job.error}`);
+            });
         },
         error: function () {
             alert("An error occurred while downloading the train stations data.");
@@ -18,14 +18,20 @@ $(document).ready(function () {
                 'osm_id': osmId
             },
             success: function (data) {
-                // handle the response here
-                updateCards(createCards);
                 const responseText = document.getElementById('response-text');
-                responseText.innerHTML = `Added boundary ${data.name}`;
+                responseText.innerHTML = 'Adding boundary...';
 
                 // hide the add button
                 const buttonToHide = document.getElementById('add_boundary');
                 buttonToHide.classList.add('hidden');
+
+                // wait for the background job to finish
+                waitForJob(data.job_id, function (job) {
+                    updateCards(createCards);
+                    responseText.innerHTML = `Added boundary ${job.result.name}`;
+                }, function (job) {
+                    responseText.innerHTML = `Error: ${job.error}`;
+                });
             },
             error: function (error) {
                 console.error('Error adding new boundary:', error);
@@ -35,6 +41,27 @@ $(document).ready(function () {
     });
 });
 
+function waitForJob(job_id, onSuccess, onFailure) {
+    $.ajax({
+        url: `jobs/${job_id}/`,
+        type: 'GET',
+        success: function (job) {
+            if (job.status === "success") {
+                onSuccess(job);
+            } else if (job.status === "failed") {
+                onFailure(job);
+            } else {
+                setTimeout(function () {
+                    waitForJob(job_id, onSuccess, onFailure);
+                }, 1000);
+            }
+        },
+        error: function (error) {
+            console.error('Error checking job status:', error);
+        }
+    });
+}
+
 function getCsrfToken() {
     return document.getElementsByName("csrfmiddlewaretoken")[0].value;
 }
@@ -30,14 +30,23 @@ $(document).ready(function () {
         attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
     }).addTo(map);
 
+    // The GeoJSON export is streamed, gzipped and revalidated with an ETag
     $.ajax({
-        url: `stations?boundary_id=${boundary_id}`,
+        url: `stations/export/?boundary_id=${boundary_id}`,
         type: 'GET',
+        dataType: 'json',
         headers: {
             'X-CSRFToken': getCsrfToken()
         },
         success: function (data) {
-            stationData = data;
+            stationData = data.features.map(feature => ({
+                name: feature.properties.name,
+                isin_boundary: feature.properties.isin_boundary,
+                location: {
+                    latitude: feature.geometry.coordinates[1],
+                    longitude: feature.geometry.coordinates[0]
+                }
+            }));
             addStationsToMap(stationData, GREEN_ICON, RED_ICON, map);
         },
         error: function (jqXHR, textStatus, errorThrown) {
@@ -46,6 +55,35 @@ $(document).ready(function () {
         }
     });
 
+    $.ajax({
+        url: `polygon/export/?boundary_id=${boundary_id}&tolerance=10`,
+        type: 'GET',
+        dataType: 'json',
+        headers: {
+            'X-CSRFToken': getCsrfToken()
+        },
+        success: function (data) {
+            L.geoJSON(data, { style: { weight: 2, fill: false } }).addTo(map);
+        },
+        error: function (jqXHR, textStatus, errorThrown) {
+            console.error("Ajax request failed to fetch the boundary polygon: " + textStatus + ", " + errorThrown);
+        }
+    });
+
+    $.ajax({
+        url: `catchments?boundary_id=${boundary_id}`,
+        type: 'GET',
+        headers: {
+            'X-CSRFToken': getCsrfToken()
+        },
+        success: function (data) {
+            addCatchmentsToMap(data, map);
+        },
+        error: function (jqXHR, textStatus, errorThrown) {
+            console.error("Ajax request failed to fetch station catchments: " + textStatus + ", " + errorThrown);
+        }
+    });
+
     // Get a reference to the show boundary stations toggle element
     const showBoundaryStationsToggle = document.getElementById('show-boundary-stations-toggle');
     // Add an event listener to the toggle element
@@ -91,6 +129,19 @@ function addStationsToMap(stationData, GREEN_ICON, RED_ICON, map) {
     map.setView([meanLat, meanLon], 12);
 }
 
+function addCatchmentsToMap(catchments, map) {
+    // Draw the Voronoi catchment of each station clipped to the boundary
+    catchments.forEach(catchment => {
+        if (catchment.polygon.length === 0) {
+            return;
+        }
+        const areaKm2 = (catchment.area / 1e6).toFixed(2);
+        L.polygon(catchment.polygon, { weight: 1, fillOpacity: 0.1 })
+            .bindPopup(`Catchment area: ${areaKm2} km&sup2;`)
+            .addTo(map);
+    });
+}
+
 function getBoundaryId() {
     const urlParams = new URLSearchParams(window.location.search);
     const boundary_id = urlParams.get('boundary_id');
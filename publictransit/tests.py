@@ -1,17 +1,63 @@
+import gzip
 import json
-from unittest.mock import patch
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import MagicMock, patch
 
-from django.test import TestCase
+import numpy as np
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
+from scipy.spatial import Voronoi
 
-from publictransit import views
-from publictransit.overpass_api import OverpassClient
+from publictransit import benchmarks, instrumentation, jobs, models, views
+from publictransit.overpass_api import (
+    OverpassClient,
+    OverpassError,
+    iter_json_elements,
+    parse_status,
+)
+from publictransit.overpass_cache import OverpassCache
+from publictransit.overpass_server import (
+    OverpassStandInServer,
+    Recordings,
+    scale_response,
+)
+from publictransit.serializers import StationSerializer
+from publictransit.utilities import boundary_tools, polygon_tools
+from publictransit.utilities.catchment_tools import update_catchments
+from publictransit.utilities.ingest_tools import (
+    reclassify_stations,
+    save_boundary_points,
+    save_boundary_rings,
+    save_classified_stations,
+    save_stations,
+    simplify_boundary_polygon,
+)
 
 
 class TestMyOverpassClient(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Recorded responses are replayed, so no network access is needed
+        cls.server = OverpassStandInServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
     def setUp(self):
-        self.client: OverpassClient = OverpassClient()
+        self.client: OverpassClient = OverpassClient(
+            endpoint=self.server.url, cache=None
+        )
 
     def test_get_json_response(self):
         query = """[out:json][timeout:25];
@@ -42,6 +88,237 @@ class TestMyOverpassClient(TestCase):
         self.assertIn("Victoria Memorial", response)
 
 
+class OverpassStandInTestCase(TestCase):
+    csv_query = """[out:csv(name)][timeout:25];
+                way(374945234);
+                out;"""
+
+    def test_latency(self):
+        with OverpassStandInServer(latency=0.2) as server:
+            client = OverpassClient(endpoint=server.url, cache=None)
+            start = time.monotonic()
+            self.assertEqual(
+                client.get(self.csv_query)[1], ["Victoria Memorial"]
+            )
+            self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_throttled_queries_are_retried(self):
+        with OverpassStandInServer(throttle_every=2, retry_after=0) as server:
+            client = OverpassClient(endpoint=server.url, cache=None)
+            for _ in range(3):
+                client.get(self.csv_query)
+        # The second and fourth queries are throttled and retried
+        self.assertEqual(server.counts["queries"], 5)
+        self.assertEqual(server.counts["throttled"], 2)
+
+    def test_missing_recording(self):
+        with OverpassStandInServer() as server:
+            client = OverpassClient(endpoint=server.url, cache=None)
+            with self.assertRaises(OverpassError):
+                client.get("[out:csv(name)];node(1);out;")
+        self.assertEqual(server.counts["missing"], 1)
+
+    def test_scaled_responses(self):
+        body = b"name\t@id\t@lat\t@lon\nBank\t1\t51.5\t-0.1\n"
+        scaled = scale_response("csv", body, 3).decode().splitlines()
+        self.assertEqual(len(scaled), 4)
+        self.assertEqual(scaled[3], f"Bank\t{2 * 10**12 + 1}\t51.5\t-0.1")
+        response = make_polygon_response([(51.5, -0.1), (51.6, -0.1)])
+        scaled = json.loads(
+            scale_response("json", json.dumps(response).encode(), 2)
+        )
+        self.assertEqual(len(scaled["elements"]), 8)
+        self.assertEqual(scaled["elements"][5]["nodes"][0], 10**12)
+
+    def test_record_from_upstream(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with OverpassStandInServer() as upstream:
+                with OverpassStandInServer(
+                    directory, upstream=upstream.url
+                ) as server:
+                    client = OverpassClient(endpoint=server.url, cache=None)
+                    client.get(self.csv_query)
+            self.assertEqual(
+                Recordings(directory).load(self.csv_query),
+                b"name\nVictoria Memorial\n",
+            )
+
+
+class OverpassCacheTestCase(TestCase):
+    endpoint = "https://overpass.example/api/interpreter"
+    query = """[out:csv(name)][timeout:25];
+                way(374945234);
+                out;"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = OverpassCache(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_lookup_ignores_whitespace(self):
+        self.cache.store(self.endpoint, self.query, "text/csv", "name\nA\n")
+        entry = self.cache.lookup(self.endpoint, " ".join(self.query.split()))
+        self.assertEqual(entry.read_text(), "name\nA\n")
+        self.assertIsNone(self.cache.lookup(self.endpoint, "[out:csv(id)];"))
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+    def test_expired_entries_are_not_served(self):
+        cache = OverpassCache(self.tmpdir.name, ttls={"csv": -1})
+        cache.store(self.endpoint, self.query, "text/csv", "name\n")
+        self.assertIsNone(cache.lookup(self.endpoint, self.query))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = OverpassCache(self.tmpdir.name, max_size=10)
+        cache.store(self.endpoint, "[out:csv(a)];", "text/csv", "12345")
+        cache.store(self.endpoint, "[out:csv(b)];", "text/csv", "12345")
+        cache.lookup(self.endpoint, "[out:csv(a)];")
+        cache.store(self.endpoint, "[out:csv(c)];", "text/csv", "12345")
+        self.assertIsNone(cache.lookup(self.endpoint, "[out:csv(b)];"))
+        self.assertIsNotNone(cache.lookup(self.endpoint, "[out:csv(a)];"))
+
+    @patch.object(OverpassClient, "get_session")
+    def test_client_uses_cached_response(self, mock_get_session):
+        self.cache.store(
+            self.endpoint, self.query, "text/csv", "name\nVictoria Memorial\n"
+        )
+        client = OverpassClient(endpoint=self.endpoint, cache=self.cache)
+        response = client.get(self.query)
+        self.assertEqual(response[1][0], "Victoria Memorial")
+        mock_get_session.assert_not_called()
+
+    @patch.object(OverpassClient, "get_session")
+    def test_streamed_response_is_cached(self, mock_get_session):
+        body = b"name\tid\nVictoria Memorial\t374945234\n"
+        response = make_mock_response(200)
+        response.iter_content.return_value = [body[:10], body[10:]]
+        mock_get_session.return_value.post.return_value = response
+        client = OverpassClient(
+            endpoint=self.endpoint, cache=self.cache, check_status=False
+        )
+        rows = list(client.get(self.query, stream=True))
+        self.assertEqual(rows[1], ["Victoria Memorial", "374945234"])
+        cached = list(client.get(self.query, stream=True))
+        self.assertEqual(cached, rows)
+        self.assertEqual(mock_get_session.return_value.post.call_count, 1)
+
+    @patch.object(OverpassClient, "get_session")
+    def test_runtime_errors_are_not_cached(self, mock_get_session):
+        query = "[out:json][timeout:25];way(374945234);out;"
+        body = (
+            '{"elements": [{"type": "way", "id": 374945234}],\n'
+            '"remark": "runtime error: Query timed out in \\"query\\" at'
+            ' line 1 after 26 seconds."}'
+        )
+        self.assertIsNone(
+            self.cache.store(self.endpoint, query, "application/json", body)
+        )
+        session = mock_get_session.return_value
+        session.post.return_value = make_mock_response(
+            200, body, "application/json"
+        )
+        session.post.return_value.iter_content.return_value = [
+            body[:20].encode(),
+            body[20:].encode(),
+        ]
+        client = OverpassClient(
+            endpoint=self.endpoint, cache=self.cache, check_status=False
+        )
+        self.assertEqual(len(client.get(query)["elements"]), 1)
+        self.assertEqual(len(list(client.get(query, stream=True))), 1)
+        self.assertIsNone(self.cache.lookup(self.endpoint, query))
+        self.assertEqual(self.cache.stats()["entries"], 0)
+        self.assertEqual(list(self.cache.directory.glob("*.tmp")), [])
+
+
+class IterJsonElementsTestCase(TestCase):
+    def test_elements_split_across_chunks(self):
+        data = {
+            "version": 0.6,
+            "osm3s": {"copyright": "ODbL ] }"},
+            "elements": [
+                {"type": "node", "id": i, "lat": 51.5 + i, "lon": -0.125}
+                for i in range(20)
+            ],
+        }
+        text = json.dumps(data)
+        for size in (1, 7, len(text)):
+            chunks = [text[i : i + size] for i in range(0, len(text), size)]
+            self.assertEqual(
+                list(iter_json_elements(chunks)), data["elements"]
+            )
+
+    def test_truncated_response_raises(self):
+        text = '{"elements": [{"type": "node", "id": 1}, {"type": "no'
+        with self.assertRaises(ValueError):
+            list(iter_json_elements([text]))
+
+
+def make_mock_response(status_code, text="", content_type="text/csv"):
+    response = MagicMock(status_code=status_code, text=text)
+    response.ok = status_code < 400
+    response.headers = {"content-type": content_type}
+    return response
+
+
+@patch("publictransit.overpass_api.time.sleep")
+@patch.object(OverpassClient, "get_session")
+class OverpassClientRetryTestCase(TestCase):
+    endpoints = [
+        "https://overpass.example/api/interpreter",
+        "https://mirror.example/api/interpreter",
+    ]
+
+    def make_client(self, mock_get_session, post_responses):
+        session = mock_get_session.return_value
+        session.post.side_effect = post_responses
+        session.get.return_value = make_mock_response(
+            200, "Rate limit: 2\n2 slots available now.\n"
+        )
+        return OverpassClient(endpoints=self.endpoints, cache=None)
+
+    def test_rate_limited_requests_are_retried(self, mock_get_session, _):
+        client = self.make_client(
+            mock_get_session,
+            [make_mock_response(429), make_mock_response(200, "name\nA\n")],
+        )
+        self.assertEqual(client.get("[out:csv(name)];"), [["name"], ["A"]])
+        self.assertEqual(mock_get_session.return_value.post.call_count, 2)
+
+    def test_failover_to_mirror(self, mock_get_session, _):
+        client = self.make_client(
+            mock_get_session,
+            [make_mock_response(503), make_mock_response(200, "name\n")],
+        )
+        client.get("[out:csv(name)];")
+        mirror = mock_get_session.return_value.post.call_args[0][0]
+        self.assertEqual(mirror, self.endpoints[1])
+
+    def test_error_raised_when_all_endpoints_fail(self, mock_get_session, _):
+        client = self.make_client(
+            mock_get_session, [make_mock_response(504)] * 10
+        )
+        with self.assertRaises(OverpassError):
+            client.get("[out:csv(name)];")
+        self.assertEqual(mock_get_session.return_value.post.call_count, 10)
+
+    def test_parse_status(self, *_):
+        self.assertEqual(
+            parse_status("Rate limit: 2\n1 slots available now."), 0
+        )
+        self.assertEqual(
+            parse_status(
+                "Rate limit: 2\n"
+                "Slot available after: 2023-04-20T10:00:05Z, in 7 seconds.\n"
+                "Slot available after: 2023-04-20T10:00:03Z, in 5 seconds.\n"
+            ),
+            5,
+        )
+
+
 class CheckBoundaryViewTestCase(APITestCase):
     def setUp(self):
         self.url = "/publictransit/check_boundary/"
@@ -75,3 +352,1328 @@ class CheckBoundaryViewTestCase(APITestCase):
         # Compare the response_data dictionary with the expected test_data
         # dictionary
         self.assertEqual(response_data, test_data)
+
+
+def create_test_boundary():
+    return models.MapBoundary.objects.create(
+        admin_level=6,
+        iso31662="GB-LND",
+        name="City of London",
+        osm_id=51800,
+        ref_gss="E09000001",
+    )
+
+
+class SaveStationsTestCase(TestCase):
+    def setUp(self):
+        self.boundary = create_test_boundary()
+
+    @staticmethod
+    def make_rows(start, count):
+        return [
+            [f"Station {i}", str(i), f"{51 + i * 1e-4}", f"{-0.1 - i * 1e-4}"]
+            for i in range(start, start + count)
+        ]
+
+    def test_query_count_does_not_grow_per_station(self):
+        with self.assertNumQueries(10):
+            save_stations(self.boundary, self.make_rows(0, 10))
+        with CaptureQueriesContext(connection) as queries:
+            save_stations(self.boundary, self.make_rows(10, 1000))
+        self.assertLess(len(queries), 30)
+        self.assertEqual(models.Station.objects.count(), 1010)
+        self.assertEqual(models.Location.objects.count(), 1010)
+
+    def test_stations_inside_take_precedence(self):
+        inside = self.make_rows(0, 3)
+        outside = self.make_rows(2, 3)
+        save_stations(self.boundary, inside, outside)
+        flags = dict(
+            models.Station.objects.values_list("osm_id", "isin_boundary")
+        )
+        self.assertEqual(
+            flags, {0: True, 1: True, 2: True, 3: False, 4: False}
+        )
+
+    def test_existing_stations_are_updated(self):
+        save_stations(self.boundary, self.make_rows(0, 2))
+        rows = self.make_rows(0, 2)
+        rows[0][0] = "Renamed"
+        save_stations(self.boundary, rows)
+        self.assertEqual(models.Station.objects.count(), 2)
+        self.assertTrue(
+            models.Station.objects.filter(osm_id=0, name="Renamed").exists()
+        )
+
+
+class SaveBoundaryPointsTestCase(TestCase):
+    def setUp(self):
+        self.boundary = create_test_boundary()
+        self.points = [(51.5, -0.1), (51.6, -0.1), (51.6, -0.2), (51.5, -0.1)]
+
+    def test_points_are_replaced_in_order(self):
+        save_boundary_points(self.boundary, [(50.0, 0.0)] * 5)
+        save_boundary_points(self.boundary, self.points, batch_size=2)
+        saved = models.BoundaryPoint.objects.filter(
+            boundary=self.boundary
+        ).order_by("order")
+        self.assertEqual(
+            [
+                (float(p.location.latitude), float(p.location.longitude))
+                for p in saved
+            ],
+            self.points,
+        )
+        # The closing point reuses the location of the first point
+        self.assertEqual(models.Location.objects.count(), 4)
+
+    def test_old_points_kept_when_write_fails(self):
+        save_boundary_points(self.boundary, self.points)
+        with patch.object(
+            models.BoundaryPoint.objects,
+            "bulk_create",
+            side_effect=RuntimeError,
+        ), self.assertRaises(RuntimeError):
+            save_boundary_points(self.boundary, [(52.0, 0.0)])
+        self.assertEqual(
+            models.BoundaryPoint.objects.filter(
+                boundary=self.boundary
+            ).count(),
+            4,
+        )
+
+
+class BoundaryGeometryTestCase(APITestCase):
+    def setUp(self):
+        self.boundary = create_test_boundary()
+        self.points = [(51.5, -0.1), (51.6, -0.1), (51.6, -0.2), (51.5, -0.1)]
+
+    def test_polygon_loaded_with_one_query(self):
+        save_boundary_points(self.boundary, self.points)
+        with self.assertNumQueries(1):
+            polygon = self.boundary.get_polygon()
+        np.testing.assert_array_equal(polygon, self.points)
+        geometry = models.BoundaryGeometry.objects.get(boundary=self.boundary)
+        self.assertEqual(geometry.version, 1)
+        self.assertEqual(geometry.num_points, 4)
+
+    def test_simplification_levels(self):
+        angles = np.linspace(0, 2 * np.pi, 2000)
+        circle = np.column_stack(
+            [51.5 + 0.05 * np.sin(angles), -0.1 + 0.08 * np.cos(angles)]
+        )
+        save_boundary_points(self.boundary, circle)
+        url = f"/publictransit/polygon/points/?boundary_id={self.boundary.pk}"
+        full = self.client.get(url).data
+        self.assertEqual(full["tolerance"], 0)
+        self.assertEqual(full["num_nodes"], 2000)
+        counts = []
+        for tolerance in (1, 10, 100, 1000):
+            data = self.client.get(f"{url}&tolerance={tolerance}").data
+            self.assertEqual(data["tolerance"], tolerance)
+            counts.append(data["num_nodes"])
+        self.assertEqual(counts, sorted(counts, reverse=True))
+        self.assertLess(counts[-1], 20)
+        # Zoomed out far enough for 1 km per pixel
+        data = self.client.get(f"{url}&zoom=6").data
+        self.assertEqual(data["tolerance"], 1000)
+        data = self.client.get(f"{url}&zoom=18").data
+        self.assertEqual(data["tolerance"], 0)
+
+    def test_small_rings_keep_three_points(self):
+        # About 100 m across, far below the coarsest tolerance
+        square = [(51.5, -0.1), (51.501, -0.1), (51.501, -0.099)]
+        square += [(51.5, -0.099), (51.5, -0.1)]
+        island = [(51.51, -0.09), (51.511, -0.09), (51.511, -0.089)]
+        save_boundary_rings(self.boundary, [square, island])
+        geometry = models.BoundaryGeometry.objects.get(boundary=self.boundary)
+        level, points, ring_starts = geometry.get_level(1000)
+        self.assertEqual(level, 1000)
+        self.assertEqual(list(ring_starts), [0, 4])
+        rings = polygon_tools.split_rings(points, ring_starts)
+        self.assertEqual(
+            [len(np.unique(ring, axis=0)) for ring in rings], [3, 3]
+        )
+        np.testing.assert_array_equal(rings[1], island)
+
+    def test_rows_are_optional(self):
+        with override_settings(STORE_BOUNDARY_POINT_ROWS=False):
+            save_boundary_points(self.boundary, self.points)
+        self.assertFalse(models.BoundaryPoint.objects.exists())
+        np.testing.assert_array_equal(self.boundary.get_polygon(), self.points)
+        response = self.client.get(
+            f"/publictransit/polygon/count/?boundary_id={self.boundary.pk}"
+        )
+        self.assertEqual(response.data, {"num_nodes": 4})
+
+    def test_legacy_rows_are_read(self):
+        save_boundary_points(self.boundary, self.points)
+        models.BoundaryGeometry.objects.all().delete()
+        np.testing.assert_array_equal(self.boundary.get_polygon(), self.points)
+
+    def test_corrupt_data_is_detected(self):
+        save_boundary_points(self.boundary, self.points)
+        models.BoundaryGeometry.objects.update(checksum="0" * 64)
+        with self.assertRaises(ValueError):
+            self.boundary.get_polygon()
+
+
+def make_polygon_response(coordinates):
+    """Return an Overpass JSON response for a relation with one outer way."""
+    nodes = [
+        {"type": "node", "id": i, "lat": lat, "lon": lon}
+        for i, (lat, lon) in enumerate(coordinates)
+    ]
+    node_ids = [node["id"] for node in nodes] + [0]
+    return {
+        "elements": [
+            {
+                "type": "relation",
+                "id": 51800,
+                "members": [{"type": "way", "ref": 1, "role": "outer"}],
+            },
+            {"type": "way", "id": 1, "nodes": node_ids},
+            *nodes,
+        ]
+    }
+
+
+class DownloadBoundariesCommandTestCase(TransactionTestCase):
+    def setUp(self):
+        self.boundary = create_test_boundary()
+        square = [
+            (51.50, -0.10),
+            (51.52, -0.10),
+            (51.52, -0.08),
+            (51.50, -0.08),
+        ]
+        self.polygon_response = make_polygon_response(square)
+        self.stations_response = [
+            ["name", "@id", "@lat", "@lon"],
+            ["Bank", "1", "51.513", "-0.089"],
+            ["Aldgate", "2", "51.514", "-0.075"],
+            # More than 2 km from the boundary
+            ["Stratford", "3", "51.541", "0.003"],
+        ]
+
+    def get_response(self, query):
+        if query == self.boundary.polygon_query:
+            return self.polygon_response
+        self.assertIn("(51.48201,-0.12889,51.53799,-0.05109)", query)
+        return self.stations_response
+
+    def test_download_boundaries(self):
+        with patch.object(
+            OverpassClient, "get", side_effect=self.get_response
+        ) as mock_get:
+            call_command(
+                "download_boundaries", "City of London", stdout=StringIO()
+            )
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(
+            models.BoundaryPoint.objects.filter(
+                boundary=self.boundary
+            ).count(),
+            5,
+        )
+        self.assertEqual(
+            dict(models.Station.objects.values_list("name", "isin_boundary")),
+            {"Bank": True, "Aldgate": False},
+        )
+
+    def test_boundary_without_polygon(self):
+        self.polygon_response = {"elements": []}
+        stdout = StringIO()
+        with patch.object(
+            OverpassClient, "get", side_effect=self.get_response
+        ) as mock_get, self.assertLogs(boundary_tools.logger, "WARNING"):
+            call_command(
+                "download_boundaries", "City of London", stdout=stdout
+            )
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertIn("City of London: no polygon", stdout.getvalue())
+        self.assertFalse(models.Station.objects.exists())
+
+    @patch(
+        (
+            "publictransit.management.commands.download_boundaries.Command"
+            ".save_polygon"
+        ),
+        return_value=0,
+    )
+    def test_stations_need_a_saved_polygon(self, mock_save_polygon):
+        stdout = StringIO()
+        with patch.object(OverpassClient, "get") as mock_get:
+            call_command(
+                "download_boundaries", "City of London", stdout=stdout
+            )
+        # Only the polygon is queried
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(stdout.getvalue(), "City of London: no polygon\n")
+
+
+class ReplayedDownloadTestCase(TransactionTestCase):
+    def test_download_boundaries(self):
+        boundary = create_test_boundary()
+        with OverpassStandInServer() as server:
+            with override_settings(
+                OVERPASS_ENDPOINTS=[server.url], OVERPASS_CACHE=None
+            ):
+                call_command(
+                    "download_boundaries", "City of London", stdout=StringIO()
+                )
+        self.assertEqual(server.counts["queries"], 2)
+        self.assertEqual(boundary.geometry.num_points, 561)
+        stations = models.Station.objects.filter(boundary=boundary)
+        self.assertEqual(stations.filter(isin_boundary=True).count(), 11)
+        self.assertTrue(stations.filter(name="London Bridge").exists())
+
+
+@override_settings(JOB_QUEUE={"EAGER": True})
+class DownloadJobTestCase(APITestCase):
+    def setUp(self):
+        self.boundary = create_test_boundary()
+        self.responses = {
+            self.boundary.stations_list_query: [
+                ["name", "@id", "@lat", "@lon"],
+                ["Bank", "1", "51.513", "-0.089"],
+            ],
+            self.boundary.stations_list_query_outside_boundary: [
+                ["name", "@id", "@lat", "@lon"],
+                ["Aldgate", "2", "51.514", "-0.075"],
+            ],
+        }
+
+    def get_response(self, query, stream=False):
+        response = self.responses[query]
+        return iter(response) if stream else response
+
+    def test_download_stations_job(self):
+        with patch.object(
+            OverpassClient, "get", side_effect=self.get_response
+        ):
+            response = self.client.post(
+                "/publictransit/stations/download_data/"
+                f"?boundary_id={self.boundary.pk}"
+            )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job_url = f"/publictransit/jobs/{response.data['job_id']}/"
+        job = self.client.get(job_url).data
+        self.assertEqual(job["status"], "success")
+        self.assertEqual(
+            job["progress"], {"rows_fetched": 2, "rows_written": 2}
+        )
+        self.assertEqual(models.Station.objects.count(), 2)
+
+    def test_stations_classified_with_saved_polygon(self):
+        save_boundary_points(
+            self.boundary,
+            [(51.50, -0.10), (51.52, -0.10), (51.52, -0.08), (51.50, -0.08)],
+        )
+        self.responses = {
+            self.boundary.get_stations_bbox_query(): [
+                ["name", "@id", "@lat", "@lon"],
+                ["Bank", "1", "51.513", "-0.089"],
+                ["Aldgate", "2", "51.514", "-0.075"],
+                ["Stratford", "3", "51.541", "0.003"],
+            ]
+        }
+        with patch.object(
+            OverpassClient, "get", side_effect=self.get_response
+        ) as mock_get:
+            self.client.post(
+                "/publictransit/stations/download_data/"
+                f"?boundary_id={self.boundary.pk}"
+            )
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(
+            dict(models.Station.objects.values_list("name", "isin_boundary")),
+            {"Bank": True, "Aldgate": False},
+        )
+
+        # A new polygon reclassifies the saved stations
+        save_boundary_points(
+            self.boundary,
+            [(51.50, -0.10), (51.52, -0.10), (51.52, -0.07), (51.50, -0.07)],
+        )
+        self.assertEqual(reclassify_stations(self.boundary), 1)
+        self.assertTrue(
+            models.Station.objects.get(name="Aldgate").isin_boundary
+        )
+
+    def test_failed_download_is_reported(self):
+        with patch.object(
+            OverpassClient, "get", side_effect=OverpassError("Timeout")
+        ):
+            response = self.client.post(
+                "/publictransit/polygon/download_data/"
+                f"?boundary_id={self.boundary.pk}"
+            )
+        job = models.Job.objects.get(pk=response.data["job_id"])
+        self.assertEqual(job.status, models.Job.Status.FAILED)
+        self.assertIn("Timeout", job.error)
+
+    def test_empty_polygon_keeps_saved_polygon(self):
+        square = [(51.50, -0.10), (51.52, -0.10), (51.52, -0.08)]
+        save_boundary_points(self.boundary, square)
+        self.responses = {self.boundary.polygon_query: []}
+        with patch.object(
+            OverpassClient, "get", side_effect=self.get_response
+        ), self.assertLogs(boundary_tools.logger, "WARNING"):
+            response = self.client.post(
+                "/publictransit/polygon/download_data/"
+                f"?boundary_id={self.boundary.pk}"
+            )
+        job = models.Job.objects.get(pk=response.data["job_id"])
+        self.assertEqual(job.status, models.Job.Status.FAILED)
+        self.assertIn("no ring", job.error)
+        self.assertFalse(
+            models.Job.objects.filter(kind="compute_catchments").exists()
+        )
+        self.boundary.refresh_from_db()
+        self.assertEqual(self.boundary.polygon_version, 1)
+        self.assertIsNotNone(self.boundary.bbox)
+        np.testing.assert_array_equal(self.boundary.get_polygon(), square)
+
+
+class JobRecoveryTestCase(TestCase):
+    def create_job(self, status, started):
+        job = models.Job.objects.create(kind="compute_catchments")
+        models.Job.objects.filter(pk=job.pk).update(
+            status=status, started=started
+        )
+        return job
+
+    def test_stale_running_jobs_are_failed(self):
+        now = timezone.now()
+        stale = self.create_job(
+            models.Job.Status.RUNNING, now - timedelta(hours=2)
+        )
+        running = self.create_job(
+            models.Job.Status.RUNNING, now - timedelta(minutes=5)
+        )
+        self.assertIsNone(jobs.claim_next_job())
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, models.Job.Status.FAILED)
+        self.assertIn("Abandoned", stale.error)
+        self.assertIsNotNone(stale.finished)
+        running.refresh_from_db()
+        self.assertEqual(running.status, models.Job.Status.RUNNING)
+
+    def test_new_worker_pool_runs_pending_jobs(self):
+        with patch.object(jobs, "_executor", None), patch.object(
+            jobs, "ThreadPoolExecutor"
+        ) as executor:
+            jobs.get_executor()
+            jobs.get_executor()
+        executor.return_value.submit.assert_called_once_with(
+            jobs.run_pending_jobs
+        )
+
+
+class RamerDouglasPeuckerTestCase(TestCase):
+    def test_importance_gives_every_level(self):
+        rng = np.random.default_rng(3)
+        points = np.cumsum(rng.normal(size=(3000, 2)), axis=0)
+        importance = polygon_tools.ramer_douglas_peucker_importance(points)
+        for epsilon in (0.5, 1, 10, 100):
+            np.testing.assert_array_equal(
+                importance > epsilon,
+                polygon_tools.ramer_douglas_peucker_mask(points, epsilon),
+            )
+
+    def test_matches_reference_implementation(self):
+        rng = np.random.default_rng(0)
+        for n in (3, 10, 2000):
+            points = np.cumsum(rng.normal(size=(n, 2)), axis=0)
+            expected = polygon_tools.ramer_douglas_peucker_reference(
+                [tuple(point) for point in points], 1.0
+            )
+            simplified = polygon_tools.ramer_douglas_peucker(points, 1.0)
+            np.testing.assert_array_equal(simplified, expected)
+
+    def test_long_boundary_does_not_recurse(self):
+        angles = np.linspace(0, 2 * np.pi, 100_000, endpoint=False)
+        points = np.column_stack([np.cos(angles), np.sin(angles)]) * 1e5
+        simplified = polygon_tools.simplify_points(points, epsilon=1)
+        self.assertLess(len(simplified), len(points))
+        np.testing.assert_array_equal(simplified[0], simplified[-1])
+
+
+def split_ring_into_ways(points, way_length, first_id=1):
+    """Split a closed ring of points into ways sharing their end points."""
+    ways = {}
+    for i, start in enumerate(range(0, len(points), way_length)):
+        coords = [tuple(p) for p in points[start : start + way_length + 1]]
+        if start + way_length >= len(points):
+            coords.append(tuple(points[0]))
+        ways[first_id + i] = coords
+    return ways
+
+
+class BuildPolygonTestCase(TestCase):
+    def test_shuffled_and_reversed_ways(self):
+        angles = np.linspace(0, 2 * np.pi, 5000, endpoint=False)
+        points = np.column_stack([np.cos(angles), np.sin(angles)])
+        ways = split_ring_into_ways(points, way_length=5)
+        rng = np.random.default_rng(0)
+        way_ids = rng.permutation(list(ways))
+        shuffled = {
+            int(way_id): ways[way_id][::-1] if way_id % 2 else ways[way_id]
+            for way_id in way_ids
+        }
+        rings = boundary_tools.build_rings(shuffled)
+        self.assertEqual(len(rings), 1)
+        self.assertEqual(len(rings[0]), len(points))
+        self.assertEqual(set(map(tuple, rings[0])), {tuple(p) for p in points})
+
+    def test_multipolygon_rings(self):
+        mainland = np.array([[0, 0], [0, 4], [4, 4], [4, 0]], dtype=float)
+        island = np.array([[6, 6], [6, 7], [7, 7], [7, 6]], dtype=float)
+        ways = {
+            **split_ring_into_ways(island, way_length=2, first_id=1),
+            **split_ring_into_ways(mainland, way_length=1, first_id=10),
+        }
+        rings = boundary_tools.build_rings(ways)
+        self.assertEqual(len(rings), 2)
+        self.assertEqual(set(map(tuple, rings[0])), {tuple(p) for p in island})
+        self.assertEqual(
+            set(map(tuple, rings[1])), {tuple(p) for p in mainland}
+        )
+        with self.assertLogs(boundary_tools.logger, "WARNING"):
+            polygon = boundary_tools.build_polygon(ways)
+        self.assertEqual(
+            set(map(tuple, polygon)), {tuple(p) for p in mainland}
+        )
+
+    def test_gaps_between_ways_are_bridged(self):
+        ways = {
+            1: [(0.0, 0.0), (0.0, 1.0)],
+            2: [(1.0, 1.0), (1.0, 0.0)],
+            3: [(0.0, 1.0001), (1.0001, 1.0)],
+        }
+        rings = boundary_tools.build_rings(ways)
+        self.assertEqual(len(rings), 1)
+        np.testing.assert_array_equal(
+            rings[0],
+            [
+                (0.0, 0.0),
+                (0.0, 1.0),
+                (0.0, 1.0001),
+                (1.0001, 1.0),
+                (1.0, 1.0),
+                (1.0, 0.0),
+            ],
+        )
+
+
+class GetBoundaryCoordinatesTestCase(TestCase):
+    def setUp(self):
+        self.elements = [
+            {
+                "type": "relation",
+                "id": 1,
+                "members": [
+                    {"type": "way", "ref": 20, "role": "outer"},
+                    {"type": "way", "ref": 21, "role": "inner"},
+                    {"type": "way", "ref": 10, "role": "outer"},
+                ],
+            },
+            {"type": "way", "id": 10, "nodes": [3, 1, 2]},
+            {"type": "way", "id": 20, "nodes": [2, 4, 3]},
+            {"type": "way", "id": 21, "nodes": [5, 5]},
+            {"type": "node", "id": 4, "lat": 51.4, "lon": -0.4},
+            {"type": "node", "id": 1, "lat": 51.1, "lon": -0.1},
+            {"type": "node", "id": 3, "lat": 51.3, "lon": -0.3},
+            {"type": "node", "id": 2, "lat": 51.2, "lon": -0.2},
+            {"type": "node", "id": 5, "lat": 51.5, "lon": -0.5},
+        ]
+
+    def test_outer_way_coordinates(self):
+        coordinates = boundary_tools.get_boundary_coordinates(
+            {"elements": self.elements}
+        )
+        self.assertEqual(list(coordinates), [20, 10])
+        np.testing.assert_array_equal(
+            coordinates[10], [[51.3, -0.3], [51.1, -0.1], [51.2, -0.2]]
+        )
+        np.testing.assert_array_equal(
+            coordinates[20], [[51.2, -0.2], [51.4, -0.4], [51.3, -0.3]]
+        )
+        # The ways are views of a single array
+        self.assertIs(coordinates[10].base, coordinates[20].base)
+
+    def test_streamed_elements(self):
+        coordinates = boundary_tools.get_boundary_coordinates(
+            iter(self.elements)
+        )
+        self.assertEqual(len(coordinates[10]), 3)
+
+    def test_missing_node(self):
+        elements = [e for e in self.elements if e.get("id") != 4]
+        with self.assertRaises(KeyError):
+            boundary_tools.get_boundary_coordinates(elements)
+
+
+class VoronoiBoundaryIntersectionTestCase(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        angles = np.linspace(0, 2 * np.pi, 2000, endpoint=False)
+        radii = 1000 + 100 * np.sin(7 * angles)
+        self.boundary = np.column_stack(
+            [radii * np.cos(angles), radii * np.sin(angles)]
+        )
+        stations = rng.uniform(-2000, 2000, size=(60, 2))
+        circle = polygon_tools.generate_circle(stations)
+        self.voronoi = Voronoi(np.vstack([stations, circle]))
+        self.indices = np.arange(len(stations))
+
+    def brute_force(self, index):
+        region = self.voronoi.regions[self.voronoi.point_region[index]]
+        if -1 in region:
+            return True
+        cell = self.voronoi.vertices[region]
+        for i in range(len(cell)):
+            for j in range(len(self.boundary)):
+                if polygon_tools.edge_intersection(
+                    cell[i],
+                    cell[(i + 1) % len(cell)],
+                    self.boundary[j],
+                    self.boundary[(j + 1) % len(self.boundary)],
+                ):
+                    return True
+        return False
+
+    def test_matches_pairwise_edge_tests(self):
+        intersects = polygon_tools.voronoi_cells_intersect_boundary(
+            self.voronoi, self.boundary, self.indices
+        )
+        self.assertTrue(intersects.any())
+        self.assertFalse(intersects.all())
+        self.assertEqual(
+            intersects.tolist(),
+            [self.brute_force(index) for index in self.indices],
+        )
+
+    def test_single_cell(self):
+        index = int(self.indices[-1])
+        self.assertEqual(
+            polygon_tools.voronoi_cell_intersect_boundary(
+                self.voronoi, self.boundary, index
+            ),
+            self.brute_force(index),
+        )
+
+
+class PolygonIndexTestCase(TestCase):
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(2)
+        angles = np.linspace(0, 2 * np.pi, 3000, endpoint=False)
+        radii = 30_000 + 5_000 * np.sin(13 * angles)
+        polygon = np.column_stack(
+            [radii * np.cos(angles), radii * np.sin(angles)]
+        )
+        points = rng.uniform(-40_000, 40_000, size=(500, 2))
+        index = polygon_tools.PolygonIndex(polygon)
+        np.testing.assert_array_equal(
+            index.contains(points),
+            polygon_tools.points_in_polygon(points, polygon),
+        )
+        distances = polygon_tools.segment_distances(
+            points[:, None], polygon[None], np.roll(polygon, -1, axis=0)[None]
+        ).min(axis=1)
+        np.testing.assert_allclose(
+            index.distances(points, 2000),
+            np.where(distances <= 2000, distances, np.inf),
+        )
+
+
+class PolygonGeometryTestCase(TestCase):
+    def setUp(self):
+        # An L shaped polygon
+        self.polygon = np.array(
+            [[0, 0], [4, 0], [4, 1], [1, 1], [1, 4], [0, 4]], dtype=float
+        )
+
+    def test_points_in_polygon(self):
+        points = [[0.5, 0.5], [2, 0.5], [2, 2], [0.5, 3], [5, 0.5]]
+        self.assertEqual(
+            polygon_tools.points_in_polygon(
+                points, self.polygon, chunk_size=4
+            ).tolist(),
+            [True, True, False, True, False],
+        )
+
+    def test_clip_polygon(self):
+        square = [[0.5, 0.5], [0.5, 2], [2, 2], [2, 0.5]]
+        clipped = polygon_tools.clip_polygon(self.polygon, square)
+        # Two 1.5 x 0.5 strips overlapping in a 0.5 x 0.5 square
+        self.assertAlmostEqual(polygon_tools.polygon_area(clipped), 1.25)
+        outside = [[2, 2], [3, 2], [3, 3]]
+        self.assertEqual(
+            len(polygon_tools.clip_polygon(self.polygon, outside)), 0
+        )
+
+
+class CatchmentTestCase(APITestCase):
+    def setUp(self):
+        self.boundary = create_test_boundary()
+        self.square = [
+            (51.50, -0.10),
+            (51.52, -0.10),
+            (51.52, -0.07),
+            (51.50, -0.07),
+        ]
+        save_boundary_points(self.boundary, self.square)
+        save_stations(
+            self.boundary,
+            [["Bank", "1", "51.513", "-0.089"]],
+            [
+                ["Aldgate", "2", "51.514", "-0.068"],
+                ["Stratford", "3", "51.541", "0.003"],
+            ],
+        )
+
+    def test_catchments_cover_boundary(self):
+        self.assertEqual(update_catchments(self.boundary), 3)
+        relevant = dict(
+            models.Station.objects.values_list("name", "is_relevant")
+        )
+        self.assertEqual(
+            relevant, {"Bank": True, "Aldgate": True, "Stratford": False}
+        )
+        areas = dict(
+            models.Catchment.objects.values_list("station__name", "area")
+        )
+        self.assertEqual(areas["Stratford"], 0)
+        crs = self.boundary.get_projected_crs()
+        boundary_area = polygon_tools.polygon_area(
+            polygon_tools.to_utm(self.square, crs=crs)
+        )
+        self.assertAlmostEqual(sum(areas.values()), boundary_area, places=0)
+
+    def test_only_recomputed_when_inputs_change(self):
+        update_catchments(self.boundary)
+        self.assertIsNone(update_catchments(self.boundary))
+        save_stations(self.boundary, [["Moorgate", "4", "51.518", "-0.088"]])
+        self.assertEqual(update_catchments(self.boundary), 4)
+        self.assertIsNone(update_catchments(self.boundary))
+        save_boundary_points(self.boundary, self.square[::-1])
+        self.assertEqual(update_catchments(self.boundary), 4)
+
+    def test_stations_version_only_changes_with_flags(self):
+        update_catchments(self.boundary)
+        self.boundary.refresh_from_db()
+        version = self.boundary.stations_version
+        # Recomputing the same catchments leaves the stations unchanged
+        self.assertEqual(update_catchments(self.boundary, force=True), 3)
+        self.boundary.refresh_from_db()
+        self.assertEqual(self.boundary.stations_version, version)
+        # Stratford's cell reaches into the larger boundary
+        save_boundary_points(
+            self.boundary, [*self.square[:2], (51.55, 0.01), (51.50, 0.01)]
+        )
+        update_catchments(self.boundary)
+        self.assertTrue(
+            models.Station.objects.get(name="Stratford").is_relevant
+        )
+        self.boundary.refresh_from_db()
+        self.assertEqual(self.boundary.stations_version, version + 1)
+
+    @override_settings(JOB_QUEUE={"EAGER": True})
+    def test_catchments_job(self):
+        response = self.client.post(
+            "/publictransit/stations/remove_irrelevant_stations/"
+            f"?boundary_id={self.boundary.pk}"
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = models.Job.objects.get(pk=response.data["job_id"])
+        self.assertEqual(job.result["num_catchments"], 3)
+        response = self.client.get(
+            f"/publictransit/catchments/?boundary_id={self.boundary.pk}"
+        )
+        self.assertEqual(len(response.data), 3)
+
+
+def ring_elements(rings):
+    """Return an Overpass JSON response with one closed way per ring."""
+    elements, members = [], []
+    node_id = 1
+    for way_id, ring in enumerate(rings, 1):
+        nodes = list(range(node_id, node_id + len(ring)))
+        node_id += len(ring)
+        elements.extend(
+            {"type": "node", "id": i, "lat": lat, "lon": lon}
+            for i, (lat, lon) in zip(nodes, ring)
+        )
+        elements.append(
+            {"type": "way", "id": way_id, "nodes": nodes + nodes[:1]}
+        )
+        members.append({"type": "way", "ref": way_id, "role": "outer"})
+    elements.append({"type": "relation", "id": 1, "members": members})
+    return {"elements": elements}
+
+
+class IslandBoundaryTestCase(APITestCase):
+    def setUp(self):
+        self.boundary = create_test_boundary()
+        self.mainland = [
+            (51.50, -0.10),
+            (51.52, -0.10),
+            (51.52, -0.07),
+            (51.50, -0.07),
+        ]
+        self.island = [
+            (51.53, -0.06),
+            (51.54, -0.06),
+            (51.54, -0.05),
+            (51.53, -0.05),
+        ]
+        rings = simplify_boundary_polygon(
+            self.boundary, ring_elements([self.mainland, self.island])
+        )
+        self.assertEqual(len(rings), 2)
+        save_boundary_rings(self.boundary, rings)
+        save_classified_stations(
+            self.boundary,
+            [
+                ["Bank", "1", "51.513", "-0.089"],
+                ["Islander", "2", "51.535", "-0.055"],
+                ["Between", "3", "51.525", "-0.065"],
+                ["Stratford", "4", "51.600", "0.100"],
+            ],
+        )
+
+    def test_island_stations_are_inside(self):
+        self.assertEqual(
+            dict(models.Station.objects.values_list("name", "isin_boundary")),
+            {"Bank": True, "Islander": True, "Between": False},
+        )
+
+    def test_catchments_cover_every_ring(self):
+        update_catchments(self.boundary)
+        areas = dict(
+            models.Catchment.objects.values_list("station__name", "area")
+        )
+        # The island lies within the cell of its station, which crosses no
+        # boundary edge but is still clipped to the island
+        crs = self.boundary.get_projected_crs()
+        island_area = polygon_tools.polygon_area(
+            polygon_tools.to_utm(self.island, crs=crs)
+        )
+        self.assertAlmostEqual(areas["Islander"], island_area, places=0)
+        self.assertGreater(areas["Bank"], 0)
+
+    def test_exports_every_ring(self):
+        query = f"?boundary_id={self.boundary.pk}"
+        response = self.client.get(f"/publictransit/polygon/points/{query}")
+        # The simplified rings are closed
+        self.assertEqual(response.data["ring_starts"], [0, 5])
+
+        response = self.client.get(
+            f"/publictransit/polygon/export/{query}&output=geojson"
+        )
+        geometry = json.loads(b"".join(response.streaming_content))[
+            "features"
+        ][0]["geometry"]
+        self.assertEqual(geometry["type"], "MultiPolygon")
+        self.assertEqual(
+            [len(polygon[0]) for polygon in geometry["coordinates"]], [5, 5]
+        )
+
+        response = self.client.get(
+            f"/publictransit/polygon/export/{query}&output=binary"
+        )
+        self.assertEqual(response["X-Ring-Starts"], "0,5")
+
+
+class StationSpatialQueryTestCase(APITestCase):
+    def setUp(self):
+        self.boundary = create_test_boundary()
+        save_stations(
+            self.boundary,
+            [
+                ["Bank", "1", "51.513", "-0.089"],
+                ["Moorgate", "2", "51.518", "-0.088"],
+                ["Edinburgh", "3", "55.952", "-3.189"],
+                ["Greenwich", "4", "51.478", "0.001"],
+            ],
+        )
+
+    def get_names(self, query):
+        response = self.client.get(f"/publictransit/stations/?{query}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [station["name"] for station in response.data]
+
+    def test_listing_matches_model_serializer(self):
+        url = f"/publictransit/stations/?boundary_id={self.boundary.pk}"
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        expected = StationSerializer(
+            models.Station.objects.order_by("name"), many=True
+        ).data
+        self.assertEqual(response.json(), json.loads(json.dumps(expected)))
+
+    def test_fields_projection(self):
+        response = self.client.get(
+            f"/publictransit/stations/?boundary_id={self.boundary.pk}"
+            "&fields=name,location"
+        )
+        self.assertEqual(
+            response.data[0],
+            {
+                "name": "Bank",
+                "location": {"latitude": "51.51300", "longitude": "-0.08900"},
+            },
+        )
+        response = self.client.get(
+            f"/publictransit/stations/?boundary_id={self.boundary.pk}"
+            "&fields=name,colour"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # Blank names are ignored
+        response = self.client.get(
+            f"/publictransit/stations/?boundary_id={self.boundary.pk}"
+            "&fields=name, ,osm_id,"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(response.data[0]), ["name", "osm_id"])
+
+    def test_cursor_pagination(self):
+        url = (
+            f"/publictransit/stations/?boundary_id={self.boundary.pk}"
+            "&fields=name&page_size=3"
+        )
+        page = self.client.get(url).data
+        self.assertEqual(
+            [station["name"] for station in page["results"]],
+            ["Bank", "Edinburgh", "Greenwich"],
+        )
+        page = self.client.get(page["next"]).data
+        self.assertEqual(page["results"], [{"name": "Moorgate"}])
+        self.assertIsNone(page["next"])
+
+    def test_grid_cells(self):
+        self.assertEqual(
+            models.grid_cell(51.513, -0.089),
+            models.grid_row(51.513) * models.GRID_COLUMNS + 1799,
+        )
+        self.assertEqual(
+            models.Location.objects.get(latitude="51.51300").cell,
+            models.grid_cell(51.513, -0.089),
+        )
+
+    def test_bbox_filter(self):
+        self.assertEqual(
+            self.get_names("bbox=51.5,-0.1,51.6,0.1"), ["Bank", "Moorgate"]
+        )
+        self.assertEqual(
+            self.get_names("bbox=51.4,-3.2,56,0.1"),
+            ["Bank", "Edinburgh", "Greenwich", "Moorgate"],
+        )
+        self.assertEqual(
+            self.get_names(
+                f"bbox=51.4,-3.2,56,0.1&boundary_id={self.boundary.pk + 1}"
+            ),
+            [],
+        )
+
+    def test_bbox_crossing_antimeridian(self):
+        models.Location.objects.create(latitude=-17.7, longitude=60)
+        models.Location.objects.create(latitude=-17.7, longitude=-60)
+        models.Location.objects.create(latitude=-17.7, longitude=0)
+        self.assertEqual(
+            models.Location.objects.in_bbox(-18, 50, -17, -50).count(), 2
+        )
+
+    def test_whole_world_bbox(self):
+        names = ["Bank", "Edinburgh", "Greenwich", "Moorgate"]
+        self.assertEqual(self.get_names("bbox=-90,-180,90,180"), names)
+        # Too many rows for one cell range each
+        self.assertEqual(self.get_names("bbox=-90,-170,90,170"), names)
+        self.assertEqual(self.get_names("bbox=-90,170,90,160"), names)
+        self.assertEqual(
+            models.Station.objects.near(51.513, -0.089, 2e7).count(), 4
+        )
+
+    def test_near_filter(self):
+        # Bank and Moorgate are about 560 m apart
+        self.assertEqual(self.get_names("near=51.513,-0.089,400"), ["Bank"])
+        self.assertEqual(
+            self.get_names("near=51.513,-0.089,1000"), ["Bank", "Moorgate"]
+        )
+
+    def test_invalid_filters(self):
+        for query in (
+            "bbox=1,2,3",
+            "bbox=60,0,50,1",
+            "bbox=50,-200,60,1",
+            "near=a,b,c",
+            "near=51,181,10",
+        ):
+            response = self.client.get(f"/publictransit/stations/?{query}")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_boundary_bbox(self):
+        self.assertIsNone(self.boundary.bbox)
+        save_boundary_points(
+            self.boundary, [(51.5, -0.1), (51.6, -0.1), (51.6, -0.2)]
+        )
+        self.boundary.refresh_from_db()
+        self.assertEqual(self.boundary.bbox, (51.5, -0.2, 51.6, -0.1))
+
+
+class ExportTestCase(APITestCase):
+    def setUp(self):
+        self.boundary = create_test_boundary()
+        save_stations(
+            self.boundary,
+            [
+                ["Bank", "1", "51.513", "-0.089"],
+                ["Moorgate", "2", "51.518", "-0.088"],
+            ],
+        )
+        self.points = [(51.5, -0.1), (51.6, -0.1), (51.6, -0.2)]
+        save_boundary_points(self.boundary, self.points)
+
+    def get(self, path, **headers):
+        return self.client.get(
+            f"/publictransit/{path}&boundary_id={self.boundary.pk}", **headers
+        )
+
+    def test_stations_geojson(self):
+        response = self.get("stations/export/?output=geojson")
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/geo+json")
+        data = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(data["type"], "FeatureCollection")
+        self.assertEqual(
+            data["features"][0]["geometry"],
+            {"type": "Point", "coordinates": [-0.089, 51.513]},
+        )
+        self.assertEqual(
+            [feature["properties"]["name"] for feature in data["features"]],
+            ["Bank", "Moorgate"],
+        )
+
+    def test_stations_binary(self):
+        response = self.get("stations/export/?output=binary")
+        points = np.frombuffer(
+            b"".join(response.streaming_content), dtype="<f8"
+        ).reshape(-1, 2)
+        np.testing.assert_array_equal(
+            points, [[51.513, -0.089], [51.518, -0.088]]
+        )
+
+    def test_etag_revalidation(self):
+        response = self.get("stations/export/?output=geojson")
+        etag = response["ETag"]
+        response = self.get(
+            "stations/export/?output=geojson", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        # Saving the stations changes the entity tag
+        save_stations(self.boundary, [["Bank", "1", "51.513", "-0.089"]])
+        response = self.get(
+            "stations/export/?output=geojson", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        # Removing the stations changes it too
+        etag = response["ETag"]
+        response = self.client.post(
+            "/publictransit/stations/remove_data/"
+            f"?boundary_id={self.boundary.pk}"
+        )
+        self.assertEqual(response.data, {"stations": []})
+        response = self.get(
+            "stations/export/?output=geojson", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_remove_data_of_unknown_boundary(self):
+        response = self.client.post(
+            "/publictransit/stations/remove_data/?boundary_id=999999"
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_gzip(self):
+        response = self.get(
+            "stations/export/?output=geojson", HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        data = json.loads(
+            gzip.decompress(b"".join(response.streaming_content))
+        )
+        self.assertEqual(len(data["features"]), 2)
+
+    def test_polygon_exports(self):
+        response = self.get("polygon/export/?output=geojson")
+        data = json.loads(b"".join(response.streaming_content))
+        (feature,) = data["features"]
+        # The ring is closed
+        self.assertEqual(
+            feature["geometry"]["coordinates"],
+            [[[-0.1, 51.5], [-0.1, 51.6], [-0.2, 51.6], [-0.1, 51.5]]],
+        )
+        self.assertEqual(feature["properties"]["tolerance"], 0)
+        response = self.get("polygon/export/?output=binary")
+        points = np.frombuffer(
+            b"".join(response.streaming_content), dtype="<f8"
+        ).reshape(-1, 2)
+        np.testing.assert_array_equal(points, self.points)
+
+    def test_invalid_output(self):
+        response = self.get("polygon/export/?output=shapefile")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get("/publictransit/stations/export/")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BenchmarkTestCase(TestCase):
+    def test_fractal_coastline_builds_one_ring(self):
+        points = benchmarks.fractal_coastline(1000)
+        self.assertEqual(points.shape, (1000, 2))
+        elements = benchmarks.polygon_elements(points, 7)
+        polygon = boundary_tools.build_polygon(
+            boundary_tools.get_boundary_coordinates(elements)
+        )
+        # The shuffled ways are stitched back into the whole ring
+        self.assertEqual(len(polygon), 1000)
+
+    def test_run_benchmarks(self):
+        results = benchmarks.run_benchmarks(
+            sizes=[200], stages=benchmarks.STAGES, repeat=1
+        )
+        self.assertEqual(
+            [result["stage"] for result in results], list(benchmarks.STAGES)
+        )
+        download = results[-1]
+        self.assertGreater(download["queries"], 0)
+        self.assertGreater(download["peak_memory"], 0)
+        self.assertFalse(models.MapBoundary.objects.exists())
+
+    def test_compare_results(self):
+        baseline = [
+            {
+                "stage": "to_utm",
+                "size": 1000,
+                "seconds": 1.0,
+                "peak_memory": 100,
+                "queries": 0,
+            }
+        ]
+        self.assertEqual(
+            benchmarks.compare_results(baseline, baseline, threshold=0.1), []
+        )
+        slower = [{**baseline[0], "seconds": 1.2, "queries": 1}]
+        self.assertEqual(
+            benchmarks.compare_results(slower, baseline, threshold=0.1),
+            [
+                "to_utm (1000): seconds 1 -> 1.2 (+20%)",
+                "to_utm (1000): queries 0 -> 1",
+            ],
+        )
+
+
+class ImportTimeTestCase(TestCase):
+    def test_parse_importtime(self):
+        output = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       100 |        100 |   numpy.core\n"
+            "import time:       200 |        300 | numpy\n"
+            "import time:        50 |         50 | json\n"
+        )
+        total, modules = benchmarks.parse_importtime(output)
+        self.assertAlmostEqual(total, 350e-6)
+        self.assertEqual(modules["numpy.core"], 100e-6)
+
+    def test_serving_imports_exclude_slow_packages(self):
+        _, modules = benchmarks.measure_import_time(repeat=1)
+        self.assertIn("publictransit.views", modules)
+        for name in benchmarks.SERVING_EXCLUDED_MODULES:
+            self.assertNotIn(name, modules)
+
+
+class RenderBatchTestCase(TestCase):
+    def setUp(self):
+        self.boundary = models.MapBoundary.objects.create(
+            admin_level=6, iso31662="x", name="Circle Town", osm_id=1
+        )
+        angles = np.linspace(0, 2 * np.pi, 50)
+        save_boundary_points(
+            self.boundary,
+            np.c_[51.5 + 0.05 * np.sin(angles), -0.1 + 0.08 * np.cos(angles)],
+        )
+        rng = np.random.default_rng(1)
+        self.inside = [
+            [
+                f"in{i}",
+                str(i),
+                str(51.5 + rng.uniform(-0.03, 0.03)),
+                str(-0.1 + rng.uniform(-0.05, 0.05)),
+            ]
+            for i in range(15)
+        ]
+        self.outside = [
+            [
+                f"out{i}",
+                str(100 + i),
+                str(51.5 + 0.07 * np.sin(angle)),
+                str(-0.1 + 0.11 * np.cos(angle)),
+            ]
+            for i, angle in enumerate(np.linspace(0, 6, 12))
+        ]
+        save_stations(self.boundary, self.inside, self.outside)
+        self.output_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.output_dir.cleanup)
+
+    def render(self, command, *args):
+        out = StringIO()
+        call_command(
+            command,
+            *args,
+            output_dir=self.output_dir.name,
+            workers=1,
+            stdout=out,
+        )
+        return out.getvalue()
+
+    def test_minimal_stations_skips_unchanged_boundaries(self):
+        output = self.render("minimal_stations", "--all")
+        self.assertIn("Rendered 1 figures", output)
+        path = f"{self.output_dir.name}/circle_town_1.png"
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(8), b"\x89PNG\r\n\x1a\n")
+
+        output = self.render("minimal_stations", "Circle Town")
+        self.assertIn("Rendered 0 figures", output)
+        self.assertIn("1 up to date", output)
+
+        save_stations(self.boundary, self.inside, self.outside[:6])
+        output = self.render("minimal_stations", "--all")
+        self.assertIn("Rendered 1 figures", output)
+
+    def test_boundary_plot_renders_in_worker_processes(self):
+        out = StringIO()
+        call_command(
+            "boundary_plot",
+            "--all",
+            output_dir=self.output_dir.name,
+            fmt="svg",
+            workers=2,
+            stdout=out,
+        )
+        self.assertIn("Rendered 1 figures", out.getvalue())
+        path = f"{self.output_dir.name}/circle_town_1_polygon.svg"
+        with open(path, encoding="utf-8") as f:
+            self.assertIn("<svg", f.read())
+
+
+class InstrumentationTestCase(APITestCase):
+    def test_nested_spans_are_not_counted_twice(self):
+        with instrumentation.trace() as trace:
+            with instrumentation.span("outer"):
+                with instrumentation.span("inner"):
+                    time.sleep(0.05)
+        self.assertGreaterEqual(trace.durations["inner"], 0.05)
+        self.assertLess(trace.durations["outer"], 0.05)
+        self.assertGreater(
+            instrumentation.SPAN_SECONDS.get("inner")["count"], 0
+        )
+
+    def test_server_timing_header(self):
+        boundary = create_test_boundary()
+        response = self.client.get(
+            f"/publictransit/stations/?boundary_id={boundary.pk}"
+        )
+        self.assertRegex(
+            response["Server-Timing"],
+            r'db;dur=[\d.]+;desc="1 queries", total;dur=[\d.]+$',
+        )
+
+    def test_metrics(self):
+        self.client.get("/publictransit/stations/")
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(
+            (
+                "publictransit_request_seconds_count"
+                '{view="publictransit:station-list"}'
+            ),
+            response.content.decode(),
+        )
+        response = self.client.get("/metrics", REMOTE_ADDR="203.0.113.1")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(JOB_QUEUE={"EAGER": True}, OVERPASS_CACHE=None)
+    def test_job_timings(self):
+        boundary = create_test_boundary()
+        with OverpassStandInServer() as server:
+            with override_settings(OVERPASS_ENDPOINTS=[server.url]):
+                response = self.client.post(
+                    "/publictransit/polygon/download_data/"
+                    f"?boundary_id={boundary.pk}"
+                )
+        job = models.Job.objects.get(pk=response.data["job_id"])
+        self.assertEqual(job.status, models.Job.Status.SUCCESS)
+        self.assertLessEqual(
+            {"overpass", "boundary_parse", "simplify", "db_write", "queries"},
+            set(job.timings),
+        )
+
+
+class CoordinateTransformTestCase(TestCase):
+    def test_transformers_are_cached(self):
+        self.assertIs(
+            polygon_tools.get_transformer("EPSG:4326", "EPSG:32630"),
+            polygon_tools.get_transformer("EPSG:4326", "EPSG:32630"),
+        )
+
+    def test_round_trip(self):
+        points = np.array([[51.5007, -0.1246], [53.4808, -2.2426]])
+        utm_points = polygon_tools.to_utm(points)
+        self.assertEqual(utm_points.shape, (2, 2))
+        np.testing.assert_allclose(
+            polygon_tools.to_latlon(utm_points), points, atol=1e-9
+        )
+
+
+class ProjectedCrsTestCase(TestCase):
+    def test_utm_zone_from_longitude(self):
+        self.assertEqual(
+            polygon_tools.select_projected_crs(51.5007, -0.1246), "EPSG:32630"
+        )
+        self.assertEqual(
+            polygon_tools.select_projected_crs(52.6309, 1.2974), "EPSG:32631"
+        )
+        self.assertEqual(
+            polygon_tools.select_projected_crs(-33.8688, 151.2093),
+            "EPSG:32756",
+        )
+
+    def test_british_national_grid(self):
+        self.assertEqual(
+            polygon_tools.select_projected_crs(
+                52.6309, 1.2974, prefer_national_grid=True
+            ),
+            polygon_tools.BRITISH_NATIONAL_GRID,
+        )
+        # Outside Great Britain the UTM zone is used
+        self.assertEqual(
+            polygon_tools.select_projected_crs(
+                48.8566, 2.3522, prefer_national_grid=True
+            ),
+            "EPSG:32631",
+        )
+
+    def test_crs_is_saved_on_boundary(self):
+        boundary = create_test_boundary()
+        points = np.array([[52.6, 1.2], [52.7, 1.4]])
+        self.assertEqual(boundary.get_projected_crs(points), "EPSG:32631")
+        boundary.refresh_from_db()
+        self.assertEqual(boundary.crs, "EPSG:32631")
+        # The saved coordinate system is reused for other points
+        self.assertEqual(
+            boundary.get_projected_crs([[51.5, -0.1]]), "EPSG:32631"
+        )
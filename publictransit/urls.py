@@ -8,6 +8,8 @@ router = routers.DefaultRouter()
 router.register(r"polygon", views.BoundaryPointViewSet)
 router.register(r"map_boundaries", views.MapBoundaryViewSet)
 router.register(r"stations", views.StationViewSet)
+router.register(r"catchments", views.CatchmentViewSet)
+router.register(r"jobs", views.JobViewSet)
 
 # URL patterns for HTML views
 html_patterns = [
@@ -1,75 +1,97 @@
-import sys
+import logging
+from array import array
+from collections import defaultdict
 
-import matplotlib.pyplot as plt
+import numpy as np
 
+from publictransit.instrumentation import timed
 from publictransit.utilities.polygon_tools import (
-    voronoi_cell_intersect_boundary,
+    polygon_area,
+    voronoi_cells_intersect_boundary,
 )
 
+logger = logging.getLogger(__name__)
 
+
+@timed("boundary_parse")
 def get_boundary_coordinates(data):
     """Extract boundary coordinates from OpenStreetMap JSON data.
 
+    The elements are read in a single pass. Node coordinates are stored in
+    compact arrays rather than per-node Python objects, and the coordinates
+    of the outer ways are gathered into one array, so the elements can be
+    consumed from a stream without holding the whole response in memory.
+
     Parameters
     ----------
-    data : dict
-        OpenStreetMap JSON data containing node and way elements.
+    data : dict or iterable of dict
+        OpenStreetMap JSON data containing node and way elements, or an
+        iterable of the elements themselves, such as the generator returned
+        by 'OverpassClient.get' in streaming mode.
 
     Returns
     -------
     dict
-        Dictionary of way IDs and their corresponding ordered coordinates
-        (lat, lon).
+        Dictionary of way IDs and their corresponding ordered coordinates,
+        as views of shape (n, 2) of (lat, lon) into a shared array.
     """
-    coordinates = {}
-
-    # Get all way elements from the JSON data
-    ways = [
-        element for element in data["elements"] if element["type"] == "way"
-    ]
-
-    # Create a dictionary with way IDs as keys and their node IDs as values
-    way_nodes = {way["id"]: way["nodes"] for way in ways}
-
-    # Get all node elements from the JSON data
-    nodes = [
-        element for element in data["elements"] if element["type"] == "node"
-    ]
-
-    # Create a dictionary with node IDs as keys and their coordinates as values
-    node_coordinates = {
-        node["id"]: (node["lat"], node["lon"]) for node in nodes
-    }
-
-    # Find the relation element
-    relation = next(
-        (
-            element
-            for element in data["elements"]
-            if element["type"] == "relation"
-        ),
-        None,
-    )
+    if isinstance(data, dict):
+        data = data["elements"]
+
+    node_ids = array("q")
+    node_coordinates = array("d")
+    way_nodes = {}
+    relation = None
+    for element in data:
+        element_type = element["type"]
+        if element_type == "node":
+            node_ids.append(element["id"])
+            node_coordinates.append(element["lat"])
+            node_coordinates.append(element["lon"])
+        elif element_type == "way":
+            way_nodes[element["id"]] = array("q", element["nodes"])
+        elif element_type == "relation" and relation is None:
+            relation = element
 
     if not relation:
-        print("No relation found.")
-        return coordinates
+        logger.warning("No relation found")
+        return {}
 
     # Get the outer way members from the relation
-    outer_way_members = [
-        member
+    outer_way_ids = [
+        member["ref"]
         for member in relation["members"]
         if member["type"] == "way" and member["role"] == "outer"
     ]
-
-    # Get the coordinates from the ordered way IDs
-    for way in outer_way_members:
-        way_id = way["ref"]
-        current_way_nodes = way_nodes[way_id]
-        coordinates[way_id] = [
-            node_coordinates[node_id] for node_id in current_way_nodes
+    outer_way_ids = list(dict.fromkeys(outer_way_ids))
+    if not outer_way_ids:
+        return {}
+
+    # Look up the nodes of all the outer ways at once in the sorted node IDs
+    ids = np.frombuffer(node_ids, dtype=np.int64)
+    coordinates = np.frombuffer(node_coordinates, dtype=np.float64)
+    coordinates = coordinates.reshape(-1, 2)
+    order = np.argsort(ids, kind="stable")
+    sorted_ids = ids[order]
+    wanted_ids = np.concatenate(
+        [
+            np.frombuffer(way_nodes[way_id], dtype=np.int64)
+            for way_id in outer_way_ids
         ]
-    return coordinates
+    )
+    positions = np.searchsorted(sorted_ids, wanted_ids)
+    positions = np.minimum(positions, len(sorted_ids) - 1)
+    missing = sorted_ids[positions] != wanted_ids
+    if missing.any():
+        raise KeyError(int(wanted_ids[missing][0]))
+    way_coordinates = coordinates[order[positions]]
+
+    # Split the coordinates into one view per way
+    ends = np.cumsum([len(way_nodes[way_id]) for way_id in outer_way_ids])
+    return {
+        way_id: way_coordinates[end - len(way_nodes[way_id]) : end]
+        for way_id, end in zip(outer_way_ids, ends)
+    }
 
 
 def distance(coord1, coord2):
@@ -92,81 +114,179 @@ def distance(coord1, coord2):
     return (lat1 - lat2) ** 2 + (lon1 - lon2) ** 2
 
 
-def find_best_matching_way(way_coords_dict, last_coord):
-    """Find the best matching way based on the distance to the last coordinate.
+def as_coordinate(point):
+    """Return a point as a hashable (lat, lon) tuple of floats."""
+    lat, lon = point
+    return float(lat), float(lon)
+
+
+class WayEndpointIndex:
+    """Index of the first and last coordinates of a set of ways.
+
+    Ways which share an end node have identical end coordinates, so exact
+    matches are found with a hash map. A KD-tree over all the end points is
+    used as a fallback to bridge small gaps between ways which do not share a
+    node.
 
     Parameters
     ----------
-    way_coords_dict : dict
+    boundary_coordinates : dict
         Dictionary of way IDs and their corresponding ordered coordinates
         (lat, lon).
-    last_coord : tuple of float
-        Last coordinate (lat, lon) to find the best matching way.
-
-    Returns
-    -------
-    tuple
-        A tuple containing the best matching way ID and a boolean indicating
-        if the best match starts with the first coordinate.
     """
-    best_match_way_id = None
-    best_match_distance = sys.float_info.max
-    best_match_start = None
 
-    for way_id, coords in way_coords_dict.items():
-        start_distance = distance(last_coord, coords[0])
-        end_distance = distance(last_coord, coords[-1])
-
-        if start_distance < best_match_distance:
-            best_match_distance = start_distance
-            best_match_way_id = way_id
-            best_match_start = True
+    def __init__(self, boundary_coordinates):
+        self.endpoints = []
+        self.exact = defaultdict(list)
+        for way_id, coords in boundary_coordinates.items():
+            for coord, is_start in ((coords[0], True), (coords[-1], False)):
+                self.exact[as_coordinate(coord)].append(len(self.endpoints))
+                self.endpoints.append((way_id, is_start))
+        self.unused = set(boundary_coordinates)
+        self._tree = None
+        self._points = [
+            boundary_coordinates[way_id][0 if is_start else -1]
+            for way_id, is_start in self.endpoints
+        ]
 
-        if end_distance < best_match_distance:
-            best_match_distance = end_distance
-            best_match_way_id = way_id
-            best_match_start = False
-    return best_match_way_id, best_match_start
+    def remove(self, way_id):
+        """Mark a way as used so it is no longer matched."""
+        self.unused.discard(way_id)
+
+    def find_exact(self, coord):
+        """Return the (way ID, is_start) of an unused way ending at 'coord'."""
+        for i in self.exact.get(as_coordinate(coord), ()):
+            way_id, is_start = self.endpoints[i]
+            if way_id in self.unused:
+                return way_id, is_start
+        return None
+
+    def find_nearest(self, coord):
+        """Return the nearest unused way end to 'coord'.
+
+        Returns
+        -------
+        tuple or None
+            The squared distance to the way end, the way ID and a boolean
+            indicating if the way end is its first coordinate, or None if
+            all ways have been used.
+        """
+        if not self.unused:
+            return None
+        if self._tree is None:
+            # Imported here as scipy is slow to import and rarely needed
+            from scipy.spatial import cKDTree
+
+            self._tree = cKDTree(np.asarray(self._points, dtype=np.float64))
+        # Query more neighbours until one belongs to an unused way
+        k = 1
+        while True:
+            k = min(2 * k, len(self.endpoints))
+            distances, indices = self._tree.query(coord, k=k)
+            for dist, i in zip(
+                np.atleast_1d(distances), np.atleast_1d(indices)
+            ):
+                way_id, is_start = self.endpoints[i]
+                if way_id in self.unused:
+                    return dist**2, way_id, is_start
+            if k == len(self.endpoints):
+                return None
 
 
 def remove_identical_points(points):
     """Deduplicate a list of points.
 
-    Remove identical points in a list of (latitude, longitude) tuples, keeping
-    the start and end points intact.
+    Remove consecutive identical points in an array of (latitude, longitude)
+    points, and the end point if it repeats the start point.
 
     Parameters
     ----------
-    points : list of tuples
-        A list of (latitude, longitude) tuples representing the polygon.
+    points : array_like
+        Array of shape (n, 2), or list of tuples, of (latitude, longitude)
+        points representing the polygon.
 
     Returns
     -------
-    list of tuples
-        The list of (latitude, longitude) tuples with identical points removed.
+    numpy.ndarray
+        Array of shape (m, 2) of the points with identical points removed.
     """
-    if not points:
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) == 0:
         return points
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = np.any(points[1:] != points[:-1], axis=1)
+    unique_points = points[keep]
+    if len(unique_points) > 1 and np.array_equal(
+        unique_points[0], unique_points[-1]
+    ):
+        unique_points = unique_points[:-1]
+    return unique_points
 
-    unique_points = [points[0]]
 
-    for i in range(1, len(points) - 1):
-        if points[i] != unique_points[-1]:
-            unique_points.append(points[i])
+def build_rings(boundary_coordinates):
+    """Stitch the outer ways of a boundary relation into closed rings.
 
-    # Append the end point if it's not already the last point
-    if unique_points[-1] != points[-1] and points[-1] != points[0]:
-        unique_points.append(points[-1])
-    return unique_points
+    Each ring is extended with the way which shares its last coordinate, or
+    failing that with the nearest unused way end. A ring is finished when it
+    returns to its first coordinate, or when its first coordinate is closer
+    than any unused way end, and the next ring then starts from the first
+    unused way. Stitching W ways takes O(W log W) time.
+
+    Parameters
+    ----------
+    boundary_coordinates : dict
+        Dictionary of way IDs and their corresponding ordered coordinates
+        (lat, lon).
+
+    Returns
+    -------
+    list of numpy.ndarray
+        The rings of a multipolygon relation, in the order of their first
+        way, each as an array of shape (n, 2) of ordered latitude and
+        longitude coordinates.
+    """
+    index = WayEndpointIndex(boundary_coordinates)
+    rings = []
+    for first_way_id, first_coords in boundary_coordinates.items():
+        if first_way_id not in index.unused:
+            continue
+        index.remove(first_way_id)
+        segments = [first_coords]
+        ring_start = as_coordinate(first_coords[0])
+        ring_end = as_coordinate(first_coords[-1])
+
+        while ring_start != ring_end:
+            match = index.find_exact(ring_end)
+            if match is None:
+                nearest = index.find_nearest(ring_end)
+                if nearest is None:
+                    break
+                match_distance, *match = nearest
+                if distance(ring_end, ring_start) <= match_distance:
+                    break
+            way_id, is_start = match
+            matched_coords = boundary_coordinates[way_id]
+            if not is_start:
+                matched_coords = matched_coords[::-1]
+            segments.append(matched_coords)
+            ring_end = as_coordinate(matched_coords[-1])
+            index.remove(way_id)
+
+        rings.append(remove_identical_points(np.concatenate(segments)))
+    return rings
 
 
+@timed("build_polygon")
 def build_polygon(boundary_coordinates):
     """Build a polygon from the given boundary coordinates.
 
     The build_polygon function constructs a polygon from the given boundary
     coordinates, which are provided as a dictionary of way IDs and their
     corresponding ordered coordinates. It returns a list of ordered latitude
-    and longitude coordinates that form the polygon.
+    and longitude coordinates that form the polygon. If the ways form several
+    rings, such as a mainland and its islands, only the ring with the largest
+    area is returned and a warning is logged; use 'build_rings' to keep all
+    of them, as 'simplify_boundary_polygon' does.
 
     Parameters
     ----------
@@ -176,63 +296,29 @@ def build_polygon(boundary_coordinates):
 
     Returns
     -------
-    list of tuple
-        List of ordered latitude and longitude coordinates forming a polygon.
+    numpy.ndarray
+        Array of shape (n, 2) of ordered latitude and longitude coordinates
+        forming a polygon.
     """
-    shape_coords = []
-    way_coords_dict = boundary_coordinates.copy()
-
-    # Start with the first way
-    first_way_id = next(iter(way_coords_dict))
-    shape_coords.extend(way_coords_dict[first_way_id])
-    del way_coords_dict[first_way_id]
-
-    while way_coords_dict:
-        last_coord = shape_coords[-1]
-        best_match_way_id, best_match_start = find_best_matching_way(
-            way_coords_dict, last_coord
+    rings = build_rings(boundary_coordinates)
+    if len(rings) > 1:
+        logger.warning(
+            "Dropping %d of %d rings, use build_rings to keep them",
+            len(rings) - 1,
+            len(rings),
         )
-
-        if best_match_way_id is not None:
-            matched_coords = way_coords_dict[best_match_way_id]
-            if not best_match_start:
-                matched_coords = matched_coords[::-1]
-            shape_coords.extend(matched_coords)
-            del way_coords_dict[best_match_way_id]
-        else:
-            break
-    shape_coords = remove_identical_points(shape_coords)
-    return shape_coords
-
-
-def plot_boundary_coordinates(coordinates_dict):
-    plt.figure(figsize=(10, 10))
-
-    for way_id, coordinates in coordinates_dict.items():
-        lats, lons = zip(*coordinates)
-        plt.plot(
-            lons,
-            lats,
-            marker="o",
-            markersize=2,
-            linewidth=1,
-            label=f"Way {way_id}",
-        )
-
-    plt.xlabel("Longitude")
-    plt.ylabel("Latitude")
-    plt.legend()
-    plt.title("Boundary Coordinates")
-    plt.grid(True)
-    plt.show()
+    return max(rings, key=polygon_area)
 
 
 def remove_irrelevant_stations(
-    boundary, stations_inside, stations_outside, vor
+    boundary, stations_inside, stations_outside, vor, ring_starts=None
 ):
-    relevant_stations_outside = []
-    for i, station in enumerate(stations_outside):
-        station_index = len(stations_inside) + i
-        if voronoi_cell_intersect_boundary(vor, boundary, station_index):
-            relevant_stations_outside.append(station)
-    return relevant_stations_outside
+    indices = len(stations_inside) + np.arange(len(stations_outside))
+    relevant = voronoi_cells_intersect_boundary(
+        vor, boundary, indices, ring_starts=ring_starts
+    )
+    return [
+        station
+        for station, is_relevant in zip(stations_outside, relevant)
+        if is_relevant
+    ]
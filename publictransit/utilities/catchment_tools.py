@@ -0,0 +1,205 @@
+"""Voronoi catchments of the stations of a boundary."""
+
+import hashlib
+
+import numpy as np
+from django.db import transaction
+
+from publictransit import models
+from publictransit.instrumentation import span, timed
+from publictransit.utilities.ingest_tools import STATION_BATCH_SIZE
+from publictransit.utilities.polygon_tools import (
+    clip_rings,
+    generate_circle,
+    points_in_polygon,
+    polygon_area,
+    split_rings,
+    to_latlon,
+    to_utm,
+    voronoi_cells_intersect_boundary,
+)
+
+
+@timed("catchments")
+def compute_catchments(boundary, stations, isin_boundary, ring_starts=None):
+    """Clip the Voronoi cells of stations to a boundary polygon.
+
+    Parameters
+    ----------
+    boundary : array_like
+        Array of shape (n, 2) of the ordered points of the boundary polygon
+        in a projected coordinate system.
+    stations : array_like
+        Array of shape (m, 2) of the station coordinates in the same
+        coordinate system.
+    isin_boundary : array_like
+        Boolean array of shape (m,) which is True for the stations inside
+        the boundary, which are always relevant.
+    ring_starts : array_like, optional
+        The index of the first point of each ring of the boundary, such as
+        islands, see 'join_rings'. A cell overlapping several rings is
+        clipped to each of them, see 'clip_rings'.
+
+    Returns
+    -------
+    polygons : list of numpy.ndarray
+        The catchment of each station, as an array of shape (k, 2) which is
+        empty if the cell of the station does not overlap the boundary.
+    areas : numpy.ndarray
+        The area of each catchment.
+    relevant : numpy.ndarray
+        Boolean array which is True for the stations inside the boundary and
+        the outside stations whose cell reaches into the boundary.
+    """
+    # Imported here to keep scipy out of the web application's imports
+    from scipy.spatial import Voronoi
+
+    boundary = np.asarray(boundary, dtype=np.float64).reshape(-1, 2)
+    stations = np.asarray(stations, dtype=np.float64).reshape(-1, 2)
+    isin_boundary = np.asarray(isin_boundary, dtype=bool)
+
+    # Surround the stations and the boundary with extra points so that the
+    # cells of the stations are bounded
+    circle_points = generate_circle(np.vstack([stations, boundary]))
+    voronoi = Voronoi(np.vstack([stations, circle_points]))
+    indices = np.arange(len(stations))
+    crosses = voronoi_cells_intersect_boundary(
+        voronoi, boundary, indices, ring_starts=ring_starts
+    )
+    # A cell which does not cross the boundary is either inside or outside
+    # of it, like its station, unless a whole ring such as a small island
+    # lies within the cell
+    inside = points_in_polygon(stations, boundary, ring_starts=ring_starts)
+    rings = split_rings(boundary, ring_starts)
+    first_points = np.array([ring[0] for ring in rings if len(ring)])
+
+    polygons = []
+    empty = np.empty((0, 2))
+    for index in indices:
+        region = voronoi.regions[voronoi.point_region[index]]
+        if -1 in region or not region:
+            polygons.append(empty)
+        elif (
+            crosses[index]
+            or points_in_polygon(first_points, voronoi.vertices[region]).any()
+        ):
+            polygons.append(clip_rings(rings, voronoi.vertices[region]))
+        elif inside[index]:
+            polygons.append(voronoi.vertices[region])
+        else:
+            polygons.append(empty)
+    areas = np.array([polygon_area(polygon) for polygon in polygons])
+    relevant = isin_boundary | crosses | (areas > 0)
+    return polygons, areas, relevant
+
+
+def get_catchment_key(boundary, stations):
+    """Return a fingerprint of the inputs of the catchments of a boundary.
+
+    Parameters
+    ----------
+    boundary : MapBoundary
+        The boundary, whose 'polygon_version' is part of the fingerprint.
+    stations : list of tuple
+        Rows of (pk, osm_id, latitude, longitude, isin_boundary) ordered by
+        OSM ID.
+
+    Returns
+    -------
+    str
+        The hexadecimal SHA-256 digest.
+    """
+    digest = hashlib.sha256(f"{boundary.polygon_version}".encode())
+    for _, osm_id, lat, lon, isin_boundary in stations:
+        digest.update(f"\n{osm_id},{lat},{lon},{isin_boundary:d}".encode())
+    return digest.hexdigest()
+
+
+def update_catchments(boundary, force=False):
+    """Recompute and store the catchments of a boundary if they are stale.
+
+    The catchments are only recomputed if the polygon version of the
+    boundary or its set of stations has changed since they were last
+    stored, unless 'force' is set. The stations version of the boundary is
+    only incremented if the 'is_relevant' flag of a station changes.
+
+    Parameters
+    ----------
+    boundary : MapBoundary
+        The boundary to compute the catchments of.
+    force : bool, optional
+        Recompute the catchments even if they are up to date.
+
+    Returns
+    -------
+    int or None
+        The number of catchments written, or None if they were up to date.
+    """
+    boundary.refresh_from_db(fields=["polygon_version", "catchment_key"])
+    stations = list(
+        models.Station.objects.filter(boundary=boundary)
+        .order_by("osm_id")
+        .values_list(
+            "pk",
+            "osm_id",
+            "location__latitude",
+            "location__longitude",
+            "isin_boundary",
+            "is_relevant",
+        )
+    )
+    was_relevant = [is_relevant for *_, is_relevant in stations]
+    stations = [station[:5] for station in stations]
+    key = get_catchment_key(boundary, stations)
+    if key == boundary.catchment_key and not force:
+        return None
+
+    points, ring_starts = boundary.get_polygon_rings()
+
+    catchments = []
+    relevant = np.ones(len(stations), dtype=bool)
+    if len(points) >= 3 and stations:
+        crs = boundary.get_projected_crs(points)
+        station_points = np.array(
+            [(lat, lon) for _, _, lat, lon, _ in stations], dtype=np.float64
+        )
+        polygons, areas, relevant = compute_catchments(
+            to_utm(points, crs=crs),
+            to_utm(station_points, crs=crs),
+            [isin_boundary for *_, isin_boundary in stations],
+            ring_starts=ring_starts,
+        )
+        for (pk, *_), polygon, area in zip(stations, polygons, areas):
+            if len(polygon):
+                polygon = np.round(to_latlon(polygon, crs=crs), 6)
+            catchments.append(
+                models.Catchment(
+                    boundary=boundary,
+                    station_id=pk,
+                    polygon=polygon.tolist(),
+                    area=float(area),
+                )
+            )
+
+    with span("db_write"), transaction.atomic():
+        models.Catchment.objects.filter(boundary=boundary).delete()
+        models.Catchment.objects.bulk_create(
+            catchments, batch_size=STATION_BATCH_SIZE
+        )
+        changed = [
+            models.Station(pk=pk, is_relevant=bool(is_relevant))
+            for (pk, *_), is_relevant, old in zip(
+                stations, relevant, was_relevant
+            )
+            if bool(is_relevant) != old
+        ]
+        models.Station.objects.bulk_update(
+            changed, ["is_relevant"], batch_size=STATION_BATCH_SIZE
+        )
+        models.MapBoundary.objects.filter(pk=boundary.pk).update(
+            catchment_key=key
+        )
+        if changed:
+            boundary.increment_stations_version()
+    boundary.catchment_key = key
+    return len(catchments)
@@ -0,0 +1,199 @@
+"""Streaming GeoJSON and binary exports of stations and boundary polygons.
+
+The exports are generators of chunks for a 'StreamingHttpResponse'. The
+stations are read from the database in batches with a server-side
+iterator, so a large boundary is never held in memory all at once.
+
+The binary format is a flat array of little-endian float64 (latitude,
+longitude) pairs, the same layout as 'BoundaryGeometry.data', which can be
+read in a browser with 'new Float64Array(buffer)'. The index of the first
+point of each ring of a polygon is sent in the 'X-Ring-Starts' header.
+"""
+
+import hashlib
+import json
+from itertools import islice
+
+import numpy as np
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+
+from publictransit.utilities.polygon_tools import split_rings
+
+EXPORT_FORMATS = ("geojson", "binary")
+CONTENT_TYPES = {
+    "geojson": "application/geo+json",
+    "binary": "application/octet-stream",
+}
+
+# Number of stations read from the database per batch
+EXPORT_BATCH_SIZE = 2000
+# Number of polygon points per chunk
+POINTS_PER_CHUNK = 4096
+
+
+def get_etag(*parts):
+    """Return a strong entity tag identifying the parts of an export."""
+    text = "\n".join(str(part) for part in parts)
+    return f'"{hashlib.sha256(text.encode()).hexdigest()[:32]}"'
+
+
+def iter_batches(rows, batch_size):
+    """Split an iterable of rows into lists of at most 'batch_size' rows."""
+    rows = iter(rows)
+    while batch := list(islice(rows, batch_size)):
+        yield batch
+
+
+def format_positions(points):
+    """Return (latitude, longitude) points as comma separated positions.
+
+    GeoJSON positions are (longitude, latitude), and the coordinates are
+    written with the 5 decimal places they are stored with.
+    """
+    return ",".join(f"[{lon:.5f},{lat:.5f}]" for lat, lon in points)
+
+
+def get_station_rows(queryset, batch_size=EXPORT_BATCH_SIZE):
+    """Iterate over the export columns of the stations of a queryset."""
+    return queryset.values_list(
+        "id",
+        "name",
+        "osm_id",
+        "isin_boundary",
+        "is_relevant",
+        Cast("location__latitude", FloatField()),
+        Cast("location__longitude", FloatField()),
+    ).iterator(chunk_size=batch_size)
+
+
+def format_station_feature(row):
+    """Return a row of 'get_station_rows' as a GeoJSON Point feature."""
+    pk, name, osm_id, isin_boundary, is_relevant, lat, lon = row
+    properties = json.dumps(
+        {
+            "name": name,
+            "osm_id": osm_id,
+            "isin_boundary": isin_boundary,
+            "is_relevant": is_relevant,
+        },
+        separators=(",", ":"),
+    )
+    return (
+        f'{{"type":"Feature","id":{pk},"geometry":{{"type":"Point",'
+        f'"coordinates":[{lon:.5f},{lat:.5f}]}},"properties":{properties}}}'
+    )
+
+
+def stream_stations_geojson(queryset, batch_size=EXPORT_BATCH_SIZE):
+    """Yield the stations of a queryset as a GeoJSON FeatureCollection.
+
+    Parameters
+    ----------
+    queryset : QuerySet
+        The stations to export.
+    batch_size : int, optional
+        Number of stations read from the database and written per chunk.
+
+    Yields
+    ------
+    str
+        Chunks of the GeoJSON document.
+    """
+    yield '{"type":"FeatureCollection","features":['
+    separator = ""
+    for batch in iter_batches(
+        get_station_rows(queryset, batch_size), batch_size
+    ):
+        yield separator + ",".join(
+            format_station_feature(row) for row in batch
+        )
+        separator = ","
+    yield "]}"
+
+
+def stream_stations_binary(queryset, batch_size=EXPORT_BATCH_SIZE):
+    """Yield the coordinates of the stations of a queryset as float64 pairs.
+
+    Parameters
+    ----------
+    queryset : QuerySet
+        The stations to export.
+    batch_size : int, optional
+        Number of stations read from the database and written per chunk.
+
+    Yields
+    ------
+    bytes
+        Chunks of little-endian float64 (latitude, longitude) pairs.
+    """
+    rows = queryset.values_list(
+        Cast("location__latitude", FloatField()),
+        Cast("location__longitude", FloatField()),
+    ).iterator(chunk_size=batch_size)
+    for batch in iter_batches(rows, batch_size):
+        yield np.array(batch, dtype="<f8").tobytes()
+
+
+def stream_polygon_geojson(boundary, points, tolerance, ring_starts=None):
+    """Yield a boundary polygon as a GeoJSON FeatureCollection.
+
+    A polygon with several rings, such as a mainland and its islands, is
+    written as a MultiPolygon with one polygon per ring.
+
+    Parameters
+    ----------
+    boundary : MapBoundary
+        The boundary the polygon belongs to.
+    points : numpy.ndarray
+        Array of shape (n, 2) of the ordered (latitude, longitude) points of
+        the polygon, such as a level of 'BoundaryGeometry.get_level'.
+    tolerance : float
+        The simplification tolerance of the points in metres.
+    ring_starts : array_like, optional
+        The index in 'points' of the first point of each ring, see
+        'join_rings'. By default the points form a single ring.
+
+    Yields
+    ------
+    str
+        Chunks of the GeoJSON document.
+    """
+    # GeoJSON rings must be closed
+    rings = [
+        (
+            ring
+            if np.array_equal(ring[0], ring[-1])
+            else np.vstack([ring, ring[:1]])
+        )
+        for ring in split_rings(points, ring_starts)
+        if len(ring)
+    ]
+    properties = json.dumps(
+        {
+            "boundary_id": boundary.pk,
+            "name": boundary.name,
+            "tolerance": tolerance,
+            "num_nodes": sum(len(ring) for ring in rings),
+        },
+        separators=(",", ":"),
+    )
+    geometry_type = "MultiPolygon" if len(rings) > 1 else "Polygon"
+    yield (
+        '{"type":"FeatureCollection","features":[{"type":"Feature",'
+        f'"geometry":{{"type":"{geometry_type}","coordinates":['
+    )
+    for i, ring in enumerate(rings):
+        yield ("," if i else "") + ("[[" if len(rings) > 1 else "[")
+        for start in range(0, len(ring), POINTS_PER_CHUNK):
+            chunk = format_positions(ring[start : start + POINTS_PER_CHUNK])
+            yield ("," if start else "") + chunk
+        yield "]]" if len(rings) > 1 else "]"
+    yield f']}},"properties":{properties}}}]}}'
+
+
+def stream_polygon_binary(points):
+    """Yield the points of a polygon as little-endian float64 pairs."""
+    for start in range(0, len(points), POINTS_PER_CHUNK):
+        chunk = points[start : start + POINTS_PER_CHUNK]
+        yield np.ascontiguousarray(chunk, dtype="<f8").tobytes()
@@ -0,0 +1,358 @@
+"""Bulk database writers for data downloaded from the Overpass API."""
+
+import logging
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from publictransit import models
+from publictransit.instrumentation import timed
+from publictransit.utilities.boundary_tools import (
+    build_rings,
+    get_boundary_coordinates,
+)
+from publictransit.utilities.polygon_tools import (
+    PolygonIndex,
+    join_rings,
+    ramer_douglas_peucker_importance,
+    simplify_points,
+    split_rings,
+    to_latlon,
+    to_utm,
+)
+
+# Number of rows written per INSERT statement by the bulk writers
+STATION_BATCH_SIZE = 200
+BOUNDARY_POINT_BATCH_SIZE = 250
+
+# Stations within this distance in metres of a boundary are kept
+STATION_BUFFER = 2000
+
+logger = logging.getLogger(__name__)
+
+
+def parse_station_rows(rows):
+    """Convert Overpass CSV station rows into typed tuples.
+
+    Parameters
+    ----------
+    rows : iterable of list
+        Rows of (name, osm_id, lat, lon) strings, without the header row.
+
+    Returns
+    -------
+    dict
+        Dictionary of OSM IDs and their (name, lat, lon) values. Repeated IDs
+        keep the last row seen.
+    """
+    stations = {}
+    for name, osm_id, lat, lon in rows:
+        stations[int(osm_id)] = (name, float(lat), float(lon))
+    return stations
+
+
+@timed("db_write")
+def save_stations(boundary, stations_inside, stations_outside=()):
+    """Insert or update the stations of a boundary in one transaction.
+
+    The locations of all stations are resolved with
+    'LocationManager.get_or_create_many' and the stations are then upserted on
+    the ('osm_id', 'boundary') unique constraint, so the number of queries
+    does not depend on the number of stations.
+
+    Parameters
+    ----------
+    boundary : MapBoundary
+        The boundary the stations belong to.
+    stations_inside : iterable of list
+        Overpass CSV rows (name, osm_id, lat, lon) for stations inside the
+        boundary, without the header row.
+    stations_outside : iterable of list, optional
+        Overpass CSV rows for stations near the boundary. Stations which are
+        also in 'stations_inside' are ignored.
+
+    Returns
+    -------
+    int
+        The number of stations written.
+    """
+    inside = parse_station_rows(stations_inside)
+    outside = parse_station_rows(stations_outside)
+    for osm_id in inside:
+        outside.pop(osm_id, None)
+
+    with transaction.atomic():
+        locations = models.Location.objects.get_or_create_many(
+            (lat, lon)
+            for stations in (inside, outside)
+            for _, lat, lon in stations.values()
+        )
+        new_stations = [
+            models.Station(
+                boundary=boundary,
+                location=locations[models.location_key(lat, lon)],
+                name=name,
+                osm_id=osm_id,
+                isin_boundary=isin_boundary,
+            )
+            for stations, isin_boundary in ((inside, True), (outside, False))
+            for osm_id, (name, lat, lon) in stations.items()
+        ]
+        models.Station.objects.bulk_create(
+            new_stations,
+            batch_size=STATION_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=["osm_id", "boundary"],
+            update_fields=["location", "name", "isin_boundary"],
+        )
+        boundary.increment_stations_version()
+    return len(new_stations)
+
+
+@timed("classify")
+def classify_stations(boundary, coordinates, radius=STATION_BUFFER):
+    """Classify points against the stored polygon of a boundary.
+
+    Points inside any ring of the polygon, such as an island, are inside the
+    boundary.
+
+    Parameters
+    ----------
+    boundary : MapBoundary
+        The boundary, whose boundary points must have been saved.
+    coordinates : array_like
+        Array of shape (n, 2) of (latitude, longitude) points.
+    radius : float, optional
+        Distance in metres from the boundary within which outside points
+        are near it.
+
+    Returns
+    -------
+    inside : numpy.ndarray
+        Boolean array which is True for the points inside the boundary.
+    near : numpy.ndarray
+        Boolean array which is True for the points inside the boundary or
+        within 'radius' of it.
+    """
+    points, ring_starts = boundary.get_polygon_rings()
+    crs = boundary.get_projected_crs(points)
+    index = PolygonIndex(to_utm(points, crs=crs), ring_starts=ring_starts)
+    projected = to_utm(coordinates, crs=crs)
+    inside = index.contains(projected)
+    near = inside | (index.distances(projected, radius) <= radius)
+    return inside, near
+
+
+def save_classified_stations(boundary, rows, radius=STATION_BUFFER):
+    """Save the stations near a boundary, classified with its polygon.
+
+    Parameters
+    ----------
+    boundary : MapBoundary
+        The boundary the stations belong to, whose boundary points must have
+        been saved.
+    rows : iterable of list
+        Overpass CSV rows (name, osm_id, lat, lon), such as the response to
+        'MapBoundary.get_stations_bbox_query', without the header row.
+    radius : float, optional
+        Distance in metres from the boundary within which outside stations
+        are kept.
+
+    Returns
+    -------
+    int
+        The number of stations written.
+    """
+    rows = [list(row) for row in rows]
+    if not rows:
+        return 0
+    coordinates = [(float(lat), float(lon)) for _, _, lat, lon in rows]
+    inside, near = classify_stations(boundary, coordinates, radius=radius)
+    return save_stations(
+        boundary,
+        [row for row, is_inside in zip(rows, inside) if is_inside],
+        [
+            row
+            for row, is_inside, is_near in zip(rows, inside, near)
+            if is_near and not is_inside
+        ],
+    )
+
+
+def reclassify_stations(boundary):
+    """Update 'isin_boundary' of the saved stations from the polygon.
+
+    Returns
+    -------
+    int
+        The number of stations whose flag changed.
+    """
+    stations = list(
+        models.Station.objects.filter(boundary=boundary).values_list(
+            "pk", "location__latitude", "location__longitude", "isin_boundary"
+        )
+    )
+    if not stations:
+        return 0
+    inside, _ = classify_stations(
+        boundary, [(lat, lon) for _, lat, lon, _ in stations], radius=0
+    )
+    changed = [
+        models.Station(pk=pk, isin_boundary=bool(is_inside))
+        for (pk, _, _, isin_boundary), is_inside in zip(stations, inside)
+        if isin_boundary != is_inside
+    ]
+    if changed:
+        with transaction.atomic():
+            models.Station.objects.bulk_update(
+                changed, ["isin_boundary"], batch_size=STATION_BATCH_SIZE
+            )
+            boundary.increment_stations_version()
+    return len(changed)
+
+
+def simplify_boundary_polygon(boundary, elements, epsilon=1):
+    """Build a simplified boundary polygon from Overpass JSON elements.
+
+    Every ring of the relation, such as a mainland and its islands, is
+    simplified separately. Rings left with fewer than 3 points are dropped.
+
+    Parameters
+    ----------
+    boundary : MapBoundary
+        The boundary the polygon belongs to. Its projected coordinate system
+        is chosen from the polygon if it has not been set yet.
+    elements : dict or iterable of dict
+        The response to a 'MapBoundary.polygon_query', or its elements.
+    epsilon : float, optional
+        The simplification tolerance in metres.
+
+    Returns
+    -------
+    list of numpy.ndarray
+        The rings of the simplified polygon, each as an array of shape
+        (n, 2) of ordered (latitude, longitude) points.
+    """
+    # Convert response coordinates into closed rings
+    boundary_coordinates = get_boundary_coordinates(elements)
+    points, ring_starts = join_rings(build_rings(boundary_coordinates))
+    logger.debug(
+        "Num coordinates: %d in %d rings", len(points), len(ring_starts)
+    )
+
+    # Convert the geographic coordinates to projected coordinates
+    crs = boundary.get_projected_crs(points)
+    projected_points = to_utm(points, crs=crs)
+
+    simplified_rings = [
+        simplified
+        for ring in split_rings(projected_points, ring_starts)
+        if len(simplified := simplify_points(ring, epsilon=epsilon)) >= 3
+    ]
+    if not simplified_rings:
+        return []
+
+    # Convert the simplified coordinates back to geographic coordinates
+    simplified_points, simplified_starts = join_rings(simplified_rings)
+    simplified_points = to_latlon(simplified_points, crs=crs)
+    logger.debug("Num simplified coordinates: %d", len(simplified_points))
+    return split_rings(simplified_points, simplified_starts)
+
+
+@timed("db_write")
+def save_boundary_points(
+    boundary, points, batch_size=BOUNDARY_POINT_BATCH_SIZE, ring_starts=None
+):
+    """Replace the ordered boundary points of a boundary atomically.
+
+    The old points are deleted and the new ones inserted inside a single
+    transaction, so readers keep seeing the old polygon until the new one is
+    committed. The points are packed into the BoundaryGeometry row of the
+    boundary, together with their simplification levels, and also written as
+    BoundaryPoint rows unless the 'STORE_BOUNDARY_POINT_ROWS' setting is
+    False. The polygon version and bounding box of the boundary are updated.
+
+    Parameters
+    ----------
+    boundary : MapBoundary
+        The boundary the points belong to.
+    points : iterable of tuple
+        Ordered (latitude, longitude) points of the boundary polygon.
+    batch_size : int, optional
+        Number of BoundaryPoint rows written per INSERT statement.
+    ring_starts : array_like, optional
+        The index of the first point of each ring of the polygon, see
+        'join_rings'. By default the points form a single ring.
+
+    Returns
+    -------
+    int
+        The number of boundary points written.
+    """
+    keys = [models.location_key(lat, lon) for lat, lon in points]
+    # Pack the rounded coordinates, which match the BoundaryPoint rows
+    coordinates = np.array(keys, dtype=np.float64).reshape(-1, 2)
+    data, checksum = models.BoundaryGeometry.pack(coordinates)
+    # The simplification levels of each ring of the polygon, see 'get_level'
+    crs = boundary.get_projected_crs(coordinates)
+    projected = to_utm(coordinates, crs=crs)
+    importance = np.concatenate(
+        [np.empty(0)]
+        + [
+            ramer_douglas_peucker_importance(ring)
+            for ring in split_rings(projected, ring_starts)
+            if len(ring)
+        ]
+    )
+    if ring_starts is None or len(ring_starts) < 2:
+        packed_ring_starts = b""
+    else:
+        packed_ring_starts = np.asarray(ring_starts, dtype="<i8").tobytes()
+    with transaction.atomic():
+        models.BoundaryPoint.objects.filter(boundary=boundary).delete()
+        if getattr(settings, "STORE_BOUNDARY_POINT_ROWS", True):
+            locations = models.Location.objects.get_or_create_many(keys)
+            models.BoundaryPoint.objects.bulk_create(
+                [
+                    models.BoundaryPoint(
+                        boundary=boundary, location=locations[key], order=i
+                    )
+                    for i, key in enumerate(keys)
+                ],
+                batch_size=batch_size,
+            )
+        boundary.increment_polygon_version()
+        models.BoundaryGeometry.objects.update_or_create(
+            boundary=boundary,
+            defaults={
+                "version": boundary.polygon_version,
+                "num_points": len(keys),
+                "checksum": checksum,
+                "data": data,
+                "importance": importance.astype("<f8").tobytes(),
+                "ring_starts": packed_ring_starts,
+            },
+        )
+        boundary.update_bbox(keys)
+    return len(keys)
+
+
+def save_boundary_rings(boundary, rings):
+    """Save the rings of a boundary polygon with 'save_boundary_points'.
+
+    Parameters
+    ----------
+    boundary : MapBoundary
+        The boundary the rings belong to.
+    rings : list of array_like
+        The rings of the polygon, such as the result of
+        'simplify_boundary_polygon'.
+
+    Returns
+    -------
+    int
+        The number of boundary points written.
+    """
+    points, ring_starts = join_rings(rings)
+    return save_boundary_points(boundary, points, ring_starts=ring_starts)
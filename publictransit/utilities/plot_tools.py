@@ -0,0 +1,312 @@
+"""Plots of boundary data for the management commands.
+
+matplotlib is slow to import, so it is only imported by this module, which
+the web application does not use.
+
+The figures are drawn on Axes by the 'draw_*' functions, so the same
+drawing code is used to show a figure interactively with pyplot and to
+render figures headless with 'RenderBatch'. The batch renders each figure
+in a worker process on a 'matplotlib.figure.Figure', which does not need a
+display or the pyplot state, and skips the figures whose inputs have not
+changed since they were last rendered.
+"""
+
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from matplotlib.figure import Figure
+
+from publictransit.utilities.boundary_tools import remove_irrelevant_stations
+from publictransit.utilities.polygon_tools import generate_circle, split_rings
+
+# Increment when the drawing code changes, so that all figures are rendered
+# again by the next batch
+RENDER_VERSION = 2
+MANIFEST_NAME = "render_manifest.json"
+
+
+def snake_case(s):
+    return s.lower().replace(" ", "_")
+
+
+def add_batch_arguments(parser):
+    """Add the batch rendering options to a management command."""
+    parser.add_argument(
+        "--output-dir",
+        help=(
+            "Render the figures headless to this directory instead of"
+            " showing them"
+        ),
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="Render a figure for every MapBoundary",
+    )
+    parser.add_argument(
+        "--format", choices=("png", "svg"), default="png", dest="fmt"
+    )
+    parser.add_argument("--dpi", type=int, default=200)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes rendering the figures",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Render the figures even if their inputs have not changed",
+    )
+
+
+def draw_boundary_coordinates(ax, coordinates_dict, title=None):
+    for way_id, coordinates in coordinates_dict.items():
+        lats, lons = zip(*coordinates)
+        ax.plot(
+            lons,
+            lats,
+            marker="o",
+            markersize=2,
+            linewidth=1,
+            label=f"Way {way_id}",
+        )
+
+    ax.set_xlabel("Longitude")
+    ax.set_ylabel("Latitude")
+    ax.legend()
+    ax.set_title(title or "Boundary Coordinates")
+    ax.grid(True)
+
+
+def plot_boundary_coordinates(coordinates_dict):
+    import matplotlib.pyplot as plt
+
+    _, ax = plt.subplots(figsize=(10, 10))
+    draw_boundary_coordinates(ax, coordinates_dict)
+    plt.show()
+
+
+def draw_stations_voronoi(
+    ax, title, boundary, stations_inside, stations_outside, ring_starts=None
+):
+    """Draw a boundary, its stations and their Voronoi diagram.
+
+    The outside stations whose Voronoi cell reaches into the boundary are
+    highlighted as the ones to keep.
+
+    Parameters
+    ----------
+    ax : matplotlib.axes.Axes
+        The Axes to draw on.
+    title : str
+        The name of the boundary, used in the title.
+    boundary : numpy.ndarray
+        Array of shape (n, 2) of the boundary polygon in projected
+        coordinates.
+    stations_inside : numpy.ndarray
+        Array of shape (m, 2) of the stations inside the boundary.
+    stations_outside : numpy.ndarray
+        Array of shape (k, 2) of the stations outside the boundary.
+    ring_starts : array_like, optional
+        The index in 'boundary' of the first point of each ring.
+    """
+    # Imported here as scipy is slow to import
+    from scipy.spatial import Voronoi
+
+    boundary = np.asarray(boundary).reshape(-1, 2)
+    stations_inside = np.asarray(stations_inside).reshape(-1, 2)
+    stations_outside = np.asarray(stations_outside).reshape(-1, 2)
+    stations = np.vstack([stations_inside, stations_outside])
+
+    ax.axis("equal")
+    for i, ring in enumerate(split_rings(boundary, ring_starts)):
+        ring = np.vstack([ring, ring[:1]])
+        ax.plot(
+            ring[:, 0],
+            ring[:, 1],
+            c="black",
+            label=None if i else "Boundary",
+        )
+    ax.scatter(
+        stations_inside[:, 0],
+        stations_inside[:, 1],
+        c="blue",
+        label="Inside boundary stations",
+    )
+    ax.scatter(
+        stations_outside[:, 0],
+        stations_outside[:, 1],
+        c="red",
+        label="Outside boundary stations",
+    )
+
+    if len(stations) and len(boundary):
+        # Add points on a circle around the outer stations so that their
+        # cells are bounded
+        circle_points = generate_circle(
+            stations_outside if len(stations_outside) else stations
+        )
+        vor = Voronoi(np.vstack([stations, circle_points]))
+        relevant_stations_outside = np.asarray(
+            remove_irrelevant_stations(
+                boundary,
+                stations_inside,
+                stations_outside,
+                vor,
+                ring_starts=ring_starts,
+            )
+        ).reshape(-1, 2)
+        ax.scatter(
+            relevant_stations_outside[:, 0],
+            relevant_stations_outside[:, 1],
+            c="green",
+            label="Outside stations to keep",
+        )
+        for simplex in vor.ridge_vertices:
+            if -1 not in simplex:
+                x = vor.vertices[simplex, 0]
+                y = vor.vertices[simplex, 1]
+                ax.plot(x, y, "k-", linewidth=0.5)
+
+        # Set x and y limits to min and max values of station locations
+        (xmin, ymin), (xmax, ymax) = stations.min(axis=0), stations.max(axis=0)
+        ax.set_xlim(xmin, xmax)
+        ax.set_ylim(ymin, ymax)
+
+    ax.set_xlabel("Longitude")
+    ax.set_ylabel("Latitude")
+    ax.set_title(f"Boundary, stations, and Voronoi diagram for {title}")
+    ax.legend()
+
+
+DRAW_FUNCTIONS = {
+    "boundary_coordinates": draw_boundary_coordinates,
+    "stations_voronoi": draw_stations_voronoi,
+}
+
+
+def render_figure(task):
+    """Render a figure of a 'RenderBatch' to its file.
+
+    Returns
+    -------
+    str
+        The path of the rendered file.
+    """
+    fig = Figure(figsize=task["figsize"])
+    ax = fig.subplots()
+    DRAW_FUNCTIONS[task["kind"]](ax, **task["data"])
+    fig.savefig(task["path"], dpi=task["dpi"], bbox_inches="tight")
+    return task["path"]
+
+
+def get_render_key(*parts):
+    """Return a fingerprint of the inputs of a figure."""
+    text = "\n".join(str(part) for part in (RENDER_VERSION, *parts))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class RenderBatch:
+    """Figures rendered to a directory by a pool of worker processes.
+
+    A manifest in the directory records the fingerprint of the inputs of
+    each rendered file, so figures whose inputs have not changed are not
+    rendered again unless 'force' is set.
+
+    Parameters
+    ----------
+    output_dir : str or Path
+        The directory the figures are written to, which is created if
+        needed.
+    force : bool, optional
+        Render all figures, even if they are up to date.
+    """
+
+    def __init__(self, output_dir, force=False):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.force = force
+        self.tasks = []
+        self.manifest_path = self.output_dir / MANIFEST_NAME
+        try:
+            self.manifest = json.loads(self.manifest_path.read_text())
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def is_current(self, filename, key):
+        """Return True if a file was rendered from the same inputs."""
+        return (
+            not self.force
+            and self.manifest.get(filename) == key
+            and (self.output_dir / filename).exists()
+        )
+
+    def add(self, filename, key, kind, data, figsize=(8, 7), dpi=200):
+        """Add a figure to render.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the file, whose extension selects the format.
+        key : str
+            The fingerprint of the inputs, see 'get_render_key'.
+        kind : str
+            The figure to draw, from 'DRAW_FUNCTIONS'.
+        data : dict
+            Keyword arguments of the drawing function, which are sent to the
+            worker processes.
+        figsize : tuple, optional
+            The size of the figure in inches.
+        dpi : int, optional
+            The resolution of raster formats.
+        """
+        self.tasks.append(
+            {
+                "filename": filename,
+                "key": key,
+                "kind": kind,
+                "data": data,
+                "figsize": figsize,
+                "dpi": dpi,
+                "path": str(self.output_dir / filename),
+            }
+        )
+
+    def run(self, workers=None):
+        """Render the added figures and update the manifest.
+
+        Parameters
+        ----------
+        workers : int, optional
+            The number of worker processes, by default one per CPU. With one
+            worker the figures are rendered in the current process.
+
+        Returns
+        -------
+        list of str
+            The names of the rendered files.
+        """
+        tasks, self.tasks = self.tasks, []
+        if workers == 1:
+            paths = map(render_figure, tasks)
+            return self._record(tasks, paths)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return self._record(tasks, pool.map(render_figure, tasks))
+
+    def _record(self, tasks, paths):
+        rendered = []
+        try:
+            for task, _ in zip(tasks, paths):
+                self.manifest[task["filename"]] = task["key"]
+                rendered.append(task["filename"])
+        finally:
+            # Figures rendered before a failure are not rendered again
+            self.manifest_path.write_text(
+                json.dumps(self.manifest, indent=2, sort_keys=True)
+            )
+        return rendered
@@ -1,55 +1,149 @@
 import math
+import threading
 from typing import List, Tuple
 
 import numpy as np
-from pyproj import Transformer
 
+from publictransit.instrumentation import timed
 
-def to_utm(points):
-    """Convert a list of (latitude, longitude) tuples to UTM coordinates.
+WGS84 = "EPSG:4326"
+UTM_ZONE_30N = "EPSG:32630"
+BRITISH_NATIONAL_GRID = "EPSG:27700"
+
+# Area of use of the British National Grid as (min_lat, min_lon, max_lat,
+# max_lon)
+BRITISH_NATIONAL_GRID_BOUNDS = (49.75, -9.0, 61.01, 2.01)
+
+_transformers = threading.local()
+
+
+def get_transformer(crs_from, crs_to):
+    """Return a cached pyproj Transformer between two coordinate systems.
+
+    Creating a Transformer requires a PROJ database lookup, so one is created
+    for each pair of coordinate systems and reused. Transformers are not
+    thread-safe, so each thread has its own cache.
 
     Parameters
     ----------
-    points : list of tuples
-        A list of (latitude, longitude) tuples.
+    crs_from : str
+        The source coordinate reference system, e.g. "EPSG:4326".
+    crs_to : str
+        The target coordinate reference system.
 
     Returns
     -------
-    list of tuples
-        A list of (Easting, Northing) tuples.
+    pyproj.Transformer
+        The transformer from 'crs_from' to 'crs_to'.
     """
-    # Create a pyproj transformer object to convert between WGS84 (lat/lon)
-    # and UTM coordinates
-    transformer = Transformer.from_crs(
-        "EPSG:4326", "EPSG:32630"
-    )  # WGS84 to UTM Zone 30N
+    cache = getattr(_transformers, "cache", None)
+    if cache is None:
+        cache = _transformers.cache = {}
+    key = (crs_from, crs_to)
+    if key not in cache:
+        # pyproj is imported on first use, as it is slow to import
+        from pyproj import Transformer
+
+        cache[key] = Transformer.from_crs(crs_from, crs_to)
+    return cache[key]
 
-    # Convert the latitude and longitude to UTM coordinates
-    return [transformer.transform(point[0], point[1]) for point in points]
 
+def transform_points(points, crs_from, crs_to):
+    """Transform an array of points between two coordinate systems.
 
-def to_latlon(utm_points):
+    Parameters
+    ----------
+    points : array_like
+        Array of shape (n, 2), or list of tuples, of point coordinates in the
+        axis order of 'crs_from'.
+    crs_from : str
+        The source coordinate reference system.
+    crs_to : str
+        The target coordinate reference system.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (n, 2) of the transformed coordinates, in the axis
+        order of 'crs_to'.
     """
-    Convert a list of UTM coordinates to (latitude, longitude) tuples.
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    transformer = get_transformer(crs_from, crs_to)
+    x, y = transformer.transform(points[:, 0], points[:, 1])
+    return np.column_stack([x, y])
+
+
+def select_projected_crs(latitude, longitude, prefer_national_grid=False):
+    """Choose a projected coordinate system for metric computations.
 
     Parameters
     ----------
-    utm_points : list of tuples
-        A list of (Easting, Northing) tuples.
+    latitude : float
+        Latitude of the centre of the area of interest.
+    longitude : float
+        Longitude of the centre of the area of interest.
+    prefer_national_grid : bool, optional
+        If True, the British National Grid is used for points within its area
+        of use.
 
     Returns
     -------
-    list of tuples
-        A list of (latitude, longitude) tuples.
+    str
+        The EPSG code of the British National Grid, or of the WGS84 UTM zone
+        containing the point.
     """
-    # Create a pyproj transformer object to convert between UTM coordinates and
-    #  WGS84 (lat/lon)
-    transformer = Transformer.from_crs(
-        "EPSG:32630", "EPSG:4326"
-    )  # UTM Zone 30N to WGS84
+    if prefer_national_grid:
+        min_lat, min_lon, max_lat, max_lon = BRITISH_NATIONAL_GRID_BOUNDS
+        if min_lat <= latitude <= max_lat and min_lon <= longitude <= max_lon:
+            return BRITISH_NATIONAL_GRID
+    zone = min(max(int((longitude + 180) // 6) + 1, 1), 60)
+    hemisphere = 326 if latitude >= 0 else 327
+    return f"EPSG:{hemisphere}{zone:02d}"
+
+
+@timed("projection")
+def to_utm(points, crs=UTM_ZONE_30N):
+    """Convert (latitude, longitude) points to UTM coordinates.
 
-    # Convert the UTM coordinates to latitude and longitude
-    return [transformer.transform(point[0], point[1]) for point in utm_points]
+    Parameters
+    ----------
+    points : array_like
+        Array of shape (n, 2), or list of tuples, of (latitude, longitude)
+        points.
+    crs : str, optional
+        The projected coordinate system, see 'select_projected_crs'. Defaults
+        to UTM zone 30N.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (n, 2) of (Easting, Northing) coordinates.
+    """
+    # WGS84 (lat/lon) to the projected coordinate system
+    return transform_points(points, WGS84, crs)
+
+
+@timed("projection")
+def to_latlon(utm_points, crs=UTM_ZONE_30N):
+    """
+    Convert UTM coordinates to (latitude, longitude) points.
+
+    Parameters
+    ----------
+    utm_points : array_like
+        Array of shape (n, 2), or list of tuples, of (Easting, Northing)
+        coordinates.
+    crs : str, optional
+        The projected coordinate system of the points. Defaults to UTM zone
+        30N.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (n, 2) of (latitude, longitude) points.
+    """
+    # The projected coordinate system to WGS84 (lat/lon)
+    return transform_points(utm_points, crs, WGS84)
 
 
 def point_line_distance(
@@ -86,11 +180,155 @@ def point_line_distance(
     return distance
 
 
-def ramer_douglas_peucker(
+def line_distances(points, line_start, line_end):
+    """Calculate the perpendicular distances from points to a line.
+
+    Vectorised equivalent of 'point_line_distance'. If the line start and end
+    coincide, the distances to that single point are returned instead.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        Array of shape (n, 2) of point coordinates.
+    line_start : numpy.ndarray
+        Coordinates of the line start point.
+    line_end : numpy.ndarray
+        Coordinates of the line end point.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (n,) of perpendicular distances.
+    """
+    dx = line_end[0] - line_start[0]
+    dy = line_end[1] - line_start[1]
+    den = math.sqrt(dy**2 + dx**2)
+    if den == 0:
+        return np.hypot(
+            points[:, 0] - line_start[0], points[:, 1] - line_start[1]
+        )
+    num = np.abs(
+        dy * points[:, 0]
+        - dx * points[:, 1]
+        + line_end[0] * line_start[1]
+        - line_end[1] * line_start[0]
+    )
+    return num / den
+
+
+def ramer_douglas_peucker_mask(points, epsilon):
+    """Find the points kept by the Ramer-Douglas-Peucker algorithm.
+
+    Iterative implementation which keeps a stack of the segments still to be
+    split, and computes the distances of all the points of a segment in one
+    array operation.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        Array of shape (n, 2) of point coordinates.
+    epsilon : float
+        Tolerance value that determines the minimum distance a point must be
+        from a line segment to be retained.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean array of shape (n,) which is True for the retained points.
+    """
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    if n < 3:
+        keep[:] = True
+        return keep
+    keep[0] = keep[-1] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        distances = line_distances(
+            points[start + 1 : end], points[start], points[end]
+        )
+        i = int(np.argmax(distances))
+        if distances[i] > epsilon:
+            index = start + 1 + i
+            keep[index] = True
+            stack.append((index, end))
+            stack.append((start, index))
+    return keep
+
+
+@timed("simplify")
+def ramer_douglas_peucker_importance(points):
+    """Find the largest tolerance at which each point is kept by RDP.
+
+    The points are split as by 'ramer_douglas_peucker_mask' until every
+    segment is split, and each point is given the distance at which it was
+    split off, capped by the importance of the segment it was split from.
+    The points kept with a tolerance 'epsilon' are then exactly those with
+    an importance greater than 'epsilon', so a single pass gives every
+    simplification level.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        Array of shape (n, 2) of point coordinates.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (n,) of the importance of each point, which is
+        infinite for the end points.
+    """
+    n = len(points)
+    importance = np.zeros(n)
+    importance[[0, -1]] = np.inf
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        start, end, limit = stack.pop()
+        if end - start < 2:
+            continue
+        distances = line_distances(
+            points[start + 1 : end], points[start], points[end]
+        )
+        i = int(np.argmax(distances))
+        index = start + 1 + i
+        importance[index] = min(distances[i], limit)
+        stack.append((index, end, importance[index]))
+        stack.append((start, index, importance[index]))
+    return importance
+
+
+def ramer_douglas_peucker(points, epsilon):
+    """Simplify a list of points using the Ramer-Douglas-Peucker algorithm.
+
+    Parameters
+    ----------
+    points : array_like
+        Array of shape (n, 2), or list of tuples, of point coordinates.
+    epsilon : float
+        Tolerance value that determines the minimum distance a point must be
+        from a line segment to be retained.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (m, 2) of the retained points, in order.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return points[ramer_douglas_peucker_mask(points, epsilon)]
+
+
+def ramer_douglas_peucker_reference(
     points: List[Tuple[float, float]], epsilon: float
 ) -> List[Tuple[float, float]]:
     """Simplify a list of points using the Ramer-Douglas-Peucker algorithm.
 
+    Recursive pure Python implementation, kept as a reference for testing
+    'ramer_douglas_peucker'.
+
     Parameters
     ----------
     points : list of tuple
@@ -118,14 +356,17 @@ def ramer_douglas_peucker(
             index = i
 
     if max_distance > epsilon:
-        left_points = ramer_douglas_peucker(points[: index + 1], epsilon)
-        right_points = ramer_douglas_peucker(points[index:], epsilon)
+        left_points = ramer_douglas_peucker_reference(
+            points[: index + 1], epsilon
+        )
+        right_points = ramer_douglas_peucker_reference(points[index:], epsilon)
 
         return left_points[:-1] + right_points
     else:
         return [points[0], points[-1]]
 
 
+@timed("simplify")
 def simplify_points(points, epsilon):
     """
     Simplify a list of points using the Ramer-Douglas-Peucker algorithm.
@@ -137,32 +378,29 @@ def simplify_points(points, epsilon):
 
     Parameters
     ----------
-    points : list of tuple
-        List of tuples containing latitude and longitude coordinates
-        (lat, lon).
+    points : array_like
+        Array of shape (n, 2), or list of tuples, of point coordinates.
     epsilon : float
-        The distance threshold for removing points.
+        The distance threshold for removing points, in the units of the
+        point coordinates.
 
     Returns
     -------
-    list of tuple
-        Simplified list of latitude and longitude points.
-
-    Notes
-    -----
-    The distance_threshold is converted to tolerance (in degrees) for use
-    within the Ramer-Douglas-Peucker algorithm. The conversion factor is
-    approximately 111.32 * 1000.
+    numpy.ndarray
+        Array of shape (m, 2) of the simplified polygon, which is closed so
+        the last point is equal to the first.
     """
-
-    if not points:
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) == 0:
         return points
 
     simplified_points = ramer_douglas_peucker(points, epsilon)
 
     # Ensure the polygon is closed
-    if simplified_points[0] != simplified_points[-1]:
-        simplified_points.append(simplified_points[0])
+    if not np.array_equal(simplified_points[0], simplified_points[-1]):
+        simplified_points = np.vstack(
+            [simplified_points, simplified_points[0]]
+        )
 
     return simplified_points
 
@@ -191,6 +429,373 @@ def generate_circle(points, num_points=64, radius_multiplier=1.5):
     return circle_points.tolist()
 
 
+def signed_area(points):
+    """Return the signed area of a polygon, positive if counterclockwise.
+
+    Parameters
+    ----------
+    points : array_like
+        Array of shape (n, 2) of the ordered points of the polygon.
+
+    Returns
+    -------
+    float
+        The signed area in squared coordinate units.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) < 3:
+        return 0.0
+    x, y = points[:, 0], points[:, 1]
+    return float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+
+
+def polygon_area(points):
+    """Return the absolute area of a polygon in squared coordinate units."""
+    return abs(signed_area(points))
+
+
+def join_rings(rings):
+    """Concatenate the rings of a polygon.
+
+    Parameters
+    ----------
+    rings : list of array_like
+        The rings, each as an array of shape (n, 2) of ordered points.
+
+    Returns
+    -------
+    points : numpy.ndarray
+        Array of shape (m, 2) of the points of all rings.
+    ring_starts : numpy.ndarray
+        The index in 'points' of the first point of each ring.
+    """
+    rings = [
+        np.asarray(ring, dtype=np.float64).reshape(-1, 2) for ring in rings
+    ]
+    if not rings:
+        return np.empty((0, 2)), np.zeros(1, dtype=np.intp)
+    lengths = [len(ring) for ring in rings]
+    ring_starts = np.cumsum([0] + lengths[:-1], dtype=np.intp)
+    return np.vstack(rings), ring_starts
+
+
+def split_rings(points, ring_starts=None):
+    """Split the points of a polygon into its rings, see 'join_rings'."""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if ring_starts is None or len(ring_starts) < 2:
+        return [points]
+    return np.split(points, np.asarray(ring_starts, dtype=np.intp)[1:])
+
+
+def ring_edges(points, ring_starts=None):
+    """Return the edges of the rings of a polygon.
+
+    Each ring is closed by an edge from its last point back to its first.
+
+    Parameters
+    ----------
+    points : array_like
+        Array of shape (n, 2) of the ordered points of all rings.
+    ring_starts : array_like, optional
+        The index of the first point of each ring, see 'join_rings'. By
+        default the points form a single ring.
+
+    Returns
+    -------
+    starts, ends : numpy.ndarray
+        Arrays of shape (n, 2) of the start and end points of the edges.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    ends = np.roll(points, -1, axis=0)
+    if ring_starts is not None and len(ring_starts) > 1:
+        ring_starts = np.asarray(ring_starts, dtype=np.intp)
+        ring_ends = np.append(ring_starts[1:], len(points)) - 1
+        ends[ring_ends] = points[ring_starts]
+    return points, ends
+
+
+def points_in_polygon(
+    points, polygon, chunk_size=2**20, edges=None, ring_starts=None
+):
+    """Check which points lie inside a polygon with the even-odd rule.
+
+    Parameters
+    ----------
+    points : array_like
+        Array of shape (n, 2) of the points to check.
+    polygon : array_like
+        Array of shape (m, 2) of the ordered points of the polygon.
+    chunk_size : int, optional
+        Maximum number of point and edge pairs tested at once, which bounds
+        the size of the temporary arrays.
+    edges : tuple of numpy.ndarray, optional
+        Arrays of the start and end points of the polygon edges to test,
+        used instead of 'polygon'. See 'PolygonIndex'.
+    ring_starts : array_like, optional
+        The index of the first point of each ring of the polygon, such as
+        islands, see 'join_rings'.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean array of shape (n,) which is True for the points inside.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    inside = np.zeros(len(points), dtype=bool)
+    if edges is None:
+        polygon = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+        if len(polygon) < 3:
+            return inside
+        edges = ring_edges(polygon, ring_starts)
+    starts, ends = edges
+    x0, y0 = starts[:, 0], starts[:, 1]
+    x1, y1 = ends[:, 0], ends[:, 1]
+    # Skip horizontal edges, which never cross a horizontal ray
+    sloped = y0 != y1
+    x0, y0, x1, y1 = x0[sloped], y0[sloped], x1[sloped], y1[sloped]
+    step = max(1, chunk_size // max(len(x0), 1))
+    for start in range(0, len(points), step):
+        px = points[start : start + step, 0, None]
+        py = points[start : start + step, 1, None]
+        crosses = (y0 > py) != (y1 > py)
+        x_cross = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+        inside[start : start + step] = (
+            np.count_nonzero(crosses & (px < x_cross), axis=1) % 2 == 1
+        )
+    return inside
+
+
+def segment_distances(points, starts, ends):
+    """Return the distances from points to line segments.
+
+    The arguments are arrays of shape (..., 2), which are broadcast against
+    each other.
+    """
+    direction = ends - starts
+    length_squared = np.sum(direction**2, axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.sum((points - starts) * direction, axis=-1) / length_squared
+    t = np.clip(np.nan_to_num(t), 0, 1)
+    closest = starts + t[..., None] * direction
+    return np.sqrt(np.sum((points - closest) ** 2, axis=-1))
+
+
+class PolygonIndex:
+    """Polygon edges indexed by horizontal bands for fast point queries.
+
+    The y range of the polygon is split into bands and each band lists the
+    edges which overlap it, so a point is only tested against the edges of
+    its own band (ray casting) or of the bands within a distance of it.
+
+    Parameters
+    ----------
+    polygon : array_like
+        Array of shape (n, 2) of the ordered points of the polygon, in a
+        projected coordinate system for distances in metres.
+    num_bands : int, optional
+        Number of bands, defaults to the square root of the number of edges.
+    ring_starts : array_like, optional
+        The index of the first point of each ring of the polygon, see
+        'join_rings'. By default the points form a single ring.
+    """
+
+    def __init__(self, polygon, num_bands=None, ring_starts=None):
+        polygon = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+        if (
+            ring_starts is None
+            and len(polygon) > 1
+            and np.array_equal(polygon[0], polygon[-1])
+        ):
+            polygon = polygon[:-1]
+        if len(polygon) < 3:
+            raise ValueError("A polygon needs at least 3 points")
+        self.starts, self.ends = ring_edges(polygon, ring_starts)
+        edge_min = np.minimum(self.starts[:, 1], self.ends[:, 1])
+        edge_max = np.maximum(self.starts[:, 1], self.ends[:, 1])
+
+        num_edges = len(polygon)
+        self.num_bands = num_bands or max(1, int(math.sqrt(num_edges)))
+        self.y_min = edge_min.min()
+        self.band_height = (edge_max.max() - self.y_min) / self.num_bands
+        if self.band_height == 0:
+            self.band_height = 1.0
+        first = self._band(edge_min)
+        last = self._band(edge_max)
+
+        # Compressed lists of the edges overlapping each band, sorted by band
+        counts = last - first + 1
+        edges = np.repeat(np.arange(num_edges), counts)
+        offsets = np.arange(len(edges)) - np.repeat(
+            np.cumsum(counts) - counts, counts
+        )
+        bands = np.repeat(first, counts) + offsets
+        order = np.argsort(bands, kind="stable")
+        self.band_edges = edges[order]
+        self.band_offsets = np.searchsorted(
+            bands[order], np.arange(self.num_bands + 1)
+        )
+
+    def _band(self, y):
+        band = np.floor((y - self.y_min) / self.band_height).astype(np.intp)
+        return np.clip(band, 0, self.num_bands - 1)
+
+    def _edges(self, first_band, last_band):
+        """Return the edges overlapping a range of bands."""
+        edges = self.band_edges[
+            self.band_offsets[first_band] : self.band_offsets[last_band + 1]
+        ]
+        return np.unique(edges) if last_band > first_band else edges
+
+    def contains(self, points):
+        """Check which points lie inside the polygon (even-odd rule).
+
+        Parameters
+        ----------
+        points : array_like
+            Array of shape (n, 2) of the points to check.
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean array of shape (n,) which is True for the points inside.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        inside = np.zeros(len(points), dtype=bool)
+        bands = self._band(points[:, 1])
+        for band in np.unique(bands):
+            selected = np.flatnonzero(bands == band)
+            edges = self._edges(band, band)
+            inside[selected] = points_in_polygon(
+                points[selected],
+                None,
+                edges=(self.starts[edges], self.ends[edges]),
+            )
+        return inside
+
+    def distances(self, points, max_distance):
+        """Return the distances from points to the edges of the polygon.
+
+        Parameters
+        ----------
+        points : array_like
+            Array of shape (n, 2) of the points.
+        max_distance : float
+            Only edges within this distance of a point are considered, and
+            points further away from the polygon get a distance of infinity.
+
+        Returns
+        -------
+        numpy.ndarray
+            Array of shape (n,) of the distances.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        distances = np.full(len(points), np.inf)
+        reach = int(math.ceil(max_distance / self.band_height))
+        bands = np.floor(
+            (points[:, 1] - self.y_min) / self.band_height
+        ).astype(np.intp)
+        for band in np.unique(bands):
+            first, last = band - reach, band + reach
+            if last < 0 or first >= self.num_bands:
+                continue
+            selected = np.flatnonzero(bands == band)
+            edges = self._edges(max(first, 0), min(last, self.num_bands - 1))
+            nearest = segment_distances(
+                points[selected, None],
+                self.starts[None, edges],
+                self.ends[None, edges],
+            ).min(axis=1)
+            distances[selected] = np.where(
+                nearest <= max_distance, nearest, np.inf
+            )
+        return distances
+
+
+def clip_polygon(subject, clip):
+    """Clip a polygon by a convex polygon (Sutherland-Hodgman).
+
+    The subject polygon may be concave, in which case the separate parts of
+    the result are joined by zero-area edges along the clip polygon, which
+    do not change its area.
+
+    Parameters
+    ----------
+    subject : array_like
+        Array of shape (n, 2) of the ordered points of the polygon to clip.
+    clip : array_like
+        Array of shape (m, 2) of the ordered points of the convex clipping
+        polygon, in either orientation.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (k, 2) of the points of the clipped polygon, empty if
+        the polygons do not overlap.
+    """
+    output = np.asarray(subject, dtype=np.float64).reshape(-1, 2)
+    clip = np.asarray(clip, dtype=np.float64).reshape(-1, 2)
+    if signed_area(clip) < 0:
+        clip = clip[::-1]
+    for a, b in zip(clip, np.roll(clip, -1, axis=0)):
+        if len(output) == 0:
+            break
+        previous = np.roll(output, 1, axis=0)
+        # Positive on the inner side of the clip edge
+        edge = b - a
+        d = edge[0] * (output[:, 1] - a[1]) - edge[1] * (output[:, 0] - a[0])
+        d_previous = np.roll(d, 1)
+        is_inside = d >= 0
+        crosses = is_inside != (d_previous >= 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = d_previous / (d_previous - d)
+            intersections = previous + t[:, None] * (output - previous)
+        # Each point contributes the crossing into or out of the clip edge
+        # followed by the point itself if it is inside
+        candidates = np.stack([intersections, output], axis=1)
+        keep = np.column_stack([crosses, is_inside])
+        output = candidates[keep]
+    return output
+
+
+def clip_rings(rings, clip):
+    """Clip the rings of a polygon by a convex polygon.
+
+    Each ring is clipped with 'clip_polygon'. The clipped parts are oriented
+    counterclockwise and joined by pairs of opposite edges, which do not
+    change the area of the result.
+
+    Parameters
+    ----------
+    rings : list of array_like
+        The rings of the polygon to clip, see 'split_rings'.
+    clip : array_like
+        Array of shape (m, 2) of the ordered points of the convex clipping
+        polygon.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (k, 2) of the points of the clipped polygon, empty if
+        the polygons do not overlap.
+    """
+    if len(rings) == 1:
+        return clip_polygon(rings[0], clip)
+    parts = []
+    for ring in rings:
+        part = clip_polygon(ring, clip)
+        if len(part) < 3:
+            continue
+        parts.append(part if signed_area(part) >= 0 else part[::-1])
+    if not parts:
+        return np.empty((0, 2))
+    # Go back to the first point of the first part after each other part
+    anchor = parts[0][:1]
+    return np.vstack(
+        [parts[0]]
+        + [np.vstack([anchor, part, part[:1]]) for part in parts[1:]]
+    )
+
+
 def ccw(A, B, C):
     return (C[1] - A[1]) * (B[0] - A[0]) > (B[1] - A[1]) * (C[0] - A[0])
 
@@ -199,27 +804,102 @@ def edge_intersection(A, B, C, D):
     return ccw(A, C, D) != ccw(B, C, D) and ccw(A, B, C) != ccw(A, B, D)
 
 
-def voronoi_cell_intersect_boundary(voronoi, boundary, index):
-    cell_region = voronoi.regions[voronoi.point_region[index]]
-    if -1 in cell_region:
-        return True
-    cell_points = [
-        voronoi.vertices[vertex_index] for vertex_index in cell_region
-    ]
+def segments_intersect(a, b, c, d):
+    """Vectorised version of 'edge_intersection'.
 
-    cell_edges = [
-        (cell_points[i], cell_points[(i + 1) % len(cell_points)])
-        for i in range(len(cell_points))
-    ]
-    boundary_edges = [
-        (boundary[i], boundary[(i + 1) % len(boundary)])
-        for i in range(len(boundary))
-    ]
+    The arguments are arrays of shape (..., 2) of segment end points, which
+    are broadcast against each other.
 
-    for cell_edge in cell_edges:
-        for boundary_edge in boundary_edges:
-            if edge_intersection(
-                cell_edge[0], cell_edge[1], boundary_edge[0], boundary_edge[1]
-            ):
-                return True
-    return False
+    Returns
+    -------
+    numpy.ndarray
+        Boolean array which is True where segment ab intersects segment cd.
+    """
+
+    def orientation(p, q, r):
+        return (r[..., 1] - p[..., 1]) * (q[..., 0] - p[..., 0]) > (
+            q[..., 1] - p[..., 1]
+        ) * (r[..., 0] - p[..., 0])
+
+    return (orientation(a, c, d) != orientation(b, c, d)) & (
+        orientation(a, b, c) != orientation(a, b, d)
+    )
+
+
+def voronoi_cells_intersect_boundary(
+    voronoi, boundary, indices, ring_starts=None
+):
+    """Check which Voronoi cells cross the edges of a boundary polygon.
+
+    The boundary edges are built once and sorted by their smallest x value,
+    so the edges whose bounding boxes overlap a cell are found with a binary
+    search, and only those are tested against the cell edges.
+
+    Parameters
+    ----------
+    voronoi : scipy.spatial.Voronoi
+        The Voronoi diagram of the stations.
+    boundary : array_like
+        Array of shape (n, 2) of the ordered points of the boundary polygon,
+        in the same coordinate system as the Voronoi diagram.
+    indices : iterable of int
+        Indices of the Voronoi input points of the cells to check.
+    ring_starts : array_like, optional
+        The index of the first point of each ring of the boundary, see
+        'join_rings'.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean array which is True for the cells which are unbounded or
+        cross an edge of the boundary.
+    """
+    starts, ends = ring_edges(boundary, ring_starts)
+    edge_min = np.minimum(starts, ends)
+    edge_max = np.maximum(starts, ends)
+    order = np.argsort(edge_min[:, 0], kind="stable")
+    starts, ends = starts[order], ends[order]
+    edge_min, edge_max = edge_min[order], edge_max[order]
+    max_width = (edge_max[:, 0] - edge_min[:, 0]).max(initial=0)
+
+    indices = np.asarray(indices, dtype=np.intp).reshape(-1)
+    intersects = np.zeros(len(indices), dtype=bool)
+    for i, index in enumerate(indices):
+        cell_region = voronoi.regions[voronoi.point_region[index]]
+        if -1 in cell_region or not cell_region:
+            intersects[i] = True
+            continue
+        cell_starts = voronoi.vertices[cell_region]
+        cell_ends = np.roll(cell_starts, -1, axis=0)
+        cell_min = cell_starts.min(axis=0)
+        cell_max = cell_starts.max(axis=0)
+
+        # Edges starting left of the cell can only overlap it if they are
+        # within 'max_width' of it
+        candidates = slice(
+            np.searchsorted(edge_min[:, 0], cell_min[0] - max_width, "left"),
+            np.searchsorted(edge_min[:, 0], cell_max[0], "right"),
+        )
+        overlap = np.all(
+            (edge_max[candidates] >= cell_min)
+            & (edge_min[candidates] <= cell_max),
+            axis=1,
+        )
+        if not overlap.any():
+            continue
+        c = starts[candidates][overlap]
+        d = ends[candidates][overlap]
+        intersects[i] = segments_intersect(
+            cell_starts[:, None], cell_ends[:, None], c[None], d[None]
+        ).any()
+    return intersects
+
+
+def voronoi_cell_intersect_boundary(voronoi, boundary, index):
+    """Check if a single Voronoi cell crosses the edges of a boundary.
+
+    See 'voronoi_cells_intersect_boundary'.
+    """
+    return bool(
+        voronoi_cells_intersect_boundary(voronoi, boundary, [index])[0]
+    )
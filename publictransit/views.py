@@ -1,31 +1,85 @@
-from django.http import JsonResponse
+import math
+
+from django.conf import settings
+from django.http import (
+    HttpResponse,
+    HttpResponseForbidden,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, render
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import method_decorator
+from django.views.decorators.gzip import gzip_page
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from publictransit import models
-from publictransit.overpass_api import OverpassClient, get_boundary_check_query
-from publictransit.utilities.boundary_tools import (
-    build_polygon,
-    get_boundary_coordinates
-
-)
-from publictransit.utilities.polygon_tools import (
-    simplify_points,
-    to_latlon,
-    to_utm,
+from publictransit import instrumentation, jobs, models
+from publictransit.overpass_api import (
+    OverpassClient,
+    OverpassError,
+    get_boundary_check_query,
 )
+from publictransit.utilities import export_tools
 
 from .serializers import (
     BoundaryPointSerializer,
+    CatchmentSerializer,
     CheckBoundarySerializer,
+    JobSerializer,
     MapBoundarySerializer,
+    PolygonExportSerializer,
+    PolygonLevelSerializer,
+    StationExportSerializer,
+    StationFilterSerializer,
+    StationRowSerializer,
     StationSerializer,
 )
 
 
+def overpass_error_response(error):
+    """Return an error response for a failed Overpass API request."""
+    return Response(
+        {"status": "error", "error": str(error)},
+        status=status.HTTP_502_BAD_GATEWAY,
+    )
+
+
+def ground_resolution(boundary, zoom):
+    """Return the metres per pixel of a web map at the boundary's latitude."""
+    latitude = 0
+    if boundary.bbox is not None:
+        latitude = (boundary.min_latitude + boundary.max_latitude) / 2
+    return 156543.03392 * math.cos(math.radians(latitude)) / 2**zoom
+
+
+def export_response(request, chunks, output, etag):
+    """Return a streaming export, or 304 if the client's copy is current.
+
+    The chunks are only generated if the export is sent, and clients must
+    revalidate their copy with the entity tag before reusing it.
+    """
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = StreamingHttpResponse(
+            chunks, content_type=export_tools.CONTENT_TYPES[output]
+        )
+    response["ETag"] = etag
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+def job_response(job):
+    """Return the response for an action which has started a job."""
+    return Response(
+        {"job_id": job.pk, "status": job.status},
+        status=status.HTTP_202_ACCEPTED,
+    )
+
+
 class MapBoundaryViewSet(viewsets.ModelViewSet):
     queryset = models.MapBoundary.objects.all()
     serializer_class = MapBoundarySerializer
@@ -42,59 +96,95 @@ class MapBoundaryViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=["post"])
     def add_boundary(self, request):
         osm_id = request.data.get("osm_id")
-        if osm_id:
-            name = self.get_or_create_boundary(osm_id)
-            return Response({"status": "success", "name": name})
+        if osm_id and str(osm_id).isdigit():
+            job = jobs.enqueue("add_boundary", osm_id=int(osm_id))
+            return job_response(job)
         else:
             return Response(
-                {"status": "error", "message": "osm_id is missing"},
+                {"status": "error", "message": "osm_id is missing or invalid"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-    @staticmethod
-    def get_or_create_boundary(osm_id):
-        query = f"[out:json];\nrelation({osm_id});\nout tags;"
-        client = OverpassClient()
-        response = client.get(query)
-        tags = response["elements"][0]["tags"]
-        admin_level = tags["admin_level"]
-        iso31662 = tags["ISO3166-2"]
-        name = tags["name"]
-        ref_gss = tags["ref:gss"]
-        map_boundary, _ = models.MapBoundary.objects.get_or_create(
-            admin_level=admin_level,
-            iso31662=iso31662,
-            name=name,
-            osm_id=osm_id,
-            ref_gss=ref_gss,
-        )
-        return name
+
+class StationCursorPagination(CursorPagination):
+    ordering = ("name", "id")
+    page_size = 1000
+    page_size_query_param = "page_size"
+    max_page_size = 10000
 
 
 class StationViewSet(viewsets.ModelViewSet):
     queryset = models.Station.objects.all()
     serializer_class = StationSerializer
+    pagination_class = StationCursorPagination
+
+    def get_filters(self):
+        serializer = StationFilterSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
 
     def get_queryset(self):
-        boundary_id = self.request.query_params.get("boundary_id", None)
-        if boundary_id is not None:
-            queryset = models.Station.objects.filter(
-                boundary_id=boundary_id
-            ).order_by("name")
+        filters = self.get_filters()
+        if not {"boundary_id", "bbox", "near"} & set(filters):
+            # Return an empty queryset if no filter is provided
+            return models.Station.objects.none()
+        queryset = models.Station.objects.select_related("location")
+        if "boundary_id" in filters:
+            queryset = queryset.filter(boundary_id=filters["boundary_id"])
+        if "bbox" in filters:
+            queryset = queryset.in_bbox(*filters["bbox"])
+        if "near" in filters:
+            queryset = queryset.near(*filters["near"])
+        return queryset.order_by("name", "id")
+
+    def list(self, request, *args, **kwargs):
+        # Read-only fast path which skips the model serializer. Pages are
+        # only returned when a cursor or page size is requested.
+        serializer = StationRowSerializer(self.get_filters().get("fields"))
+        queryset = self.get_queryset()
+        params = request.query_params
+        if "cursor" in params or "page_size" in params:
+            page = self.paginate_queryset(
+                serializer.get_values(queryset, "name")
+            )
+            return self.get_paginated_response(
+                [serializer.to_representation(row) for row in page]
+            )
+        return Response(serializer.serialize(queryset))
+
+    @action(detail=False, methods=["get"])
+    @method_decorator(gzip_page)
+    def export(self, request):
+        """Stream the stations of a boundary as GeoJSON or binary."""
+        serializer = StationExportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        filters = serializer.validated_data
+        boundary = get_object_or_404(
+            models.MapBoundary, pk=filters["boundary_id"]
+        )
+        output = filters["output"]
+        etag = export_tools.get_etag(
+            "stations",
+            boundary.pk,
+            boundary.stations_version,
+            filters.get("bbox"),
+            filters.get("near"),
+            output,
+        )
+        queryset = self.get_queryset()
+        if output == "binary":
+            chunks = export_tools.stream_stations_binary(queryset)
         else:
-            # Return an empty queryset if no boundary_id is provided
-            queryset = models.Station.objects.none()
-        return queryset
+            chunks = export_tools.stream_stations_geojson(queryset)
+        return export_response(request, chunks, output, etag)
 
     @action(detail=False, methods=["post"])
     def download_data(self, request):
         boundary_id = request.query_params.get("boundary_id", None)
         if boundary_id:
-            self.fetch_and_save_stations(boundary_id)
-            self.fetch_and_save_nearby_stations(boundary_id)
-            queryset = self.get_queryset().filter(boundary_id=boundary_id)
-            serializer = self.get_serializer(queryset, many=True)
-            return Response({"stations": serializer.data})
+            boundary = get_object_or_404(models.MapBoundary, pk=boundary_id)
+            job = jobs.enqueue("download_stations", boundary=boundary)
+            return job_response(job)
         else:
             return Response(
                 {"error": "boundary_id is missing"},
@@ -105,8 +195,10 @@ class StationViewSet(viewsets.ModelViewSet):
     def remove_data(self, request):
         boundary_id = request.query_params.get("boundary_id", None)
         if boundary_id:
-            queryset = self.get_queryset().filter(boundary_id=boundary_id)
+            boundary = get_object_or_404(models.MapBoundary, pk=boundary_id)
+            queryset = self.get_queryset().filter(boundary=boundary)
             queryset.delete()
+            boundary.increment_stations_version()
             serializer = self.get_serializer(queryset, many=True)
             return Response({"stations": serializer.data})
         else:
@@ -117,63 +209,17 @@ class StationViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=["post"])
     def remove_irrelevant_stations(self, request):
+        # Flags the outside stations whose catchment misses the boundary
         boundary_id = request.query_params.get("boundary_id", None)
         if boundary_id:
-            pass
-
-    @staticmethod
-    def fetch_and_save_stations(boundary_id):
-        """Download station data from API and save it to the database."""
-        # Get stations data from API
-        boundary = get_object_or_404(models.MapBoundary, pk=boundary_id)
-        client = OverpassClient()
-        response = client.get(boundary.stations_list_query)
-
-        # Save stations data in Station model
-        for station in response[1:]:
-            name, osm_id, lat, lon = station
-            location, _ = models.Location.objects.get_or_create(
-                latitude=float(lat), longitude=float(lon)
-            )
-            boundary = models.MapBoundary.objects.get(pk=boundary_id)
-            qs = models.Station.objects.filter(
-                boundary=boundary, osm_id=int(osm_id)
-            )
-            if not qs.exists():
-                models.Station.objects.create(
-                    boundary=boundary,
-                    location=location,
-                    name=name,
-                    osm_id=int(osm_id),
-                    isin_boundary=True,
-                )
-
-    @staticmethod
-    def fetch_and_save_nearby_stations(boundary_id):
-        """Download station data from API and save it to the database."""
-        # Get stations data from API
-        boundary = get_object_or_404(models.MapBoundary, pk=boundary_id)
-        client = OverpassClient()
-        response = client.get(boundary.stations_list_query_outside_boundary)
-
-        # Save stations data in Station model
-        for station in response[1:]:
-            name, osm_id, lat, lon = station
-            location, _ = models.Location.objects.get_or_create(
-                latitude=float(lat), longitude=float(lon)
-            )
-            boundary = models.MapBoundary.objects.get(pk=boundary_id)
-            qs = models.Station.objects.filter(
-                boundary=boundary, osm_id=int(osm_id)
+            boundary = get_object_or_404(models.MapBoundary, pk=boundary_id)
+            job = jobs.enqueue("compute_catchments", boundary=boundary)
+            return job_response(job)
+        else:
+            return Response(
+                {"error": "boundary_id is missing"},
+                status=status.HTTP_400_BAD_REQUEST,
             )
-            if not qs.exists():
-                models.Station.objects.create(
-                    boundary=boundary,
-                    location=location,
-                    name=name,
-                    osm_id=int(osm_id),
-                    isin_boundary=False,
-                )
 
 
 class CheckBoundaryView(APIView):
@@ -182,9 +228,12 @@ class CheckBoundaryView(APIView):
         serializer.is_valid(raise_exception=True)
         area_standard = serializer.validated_data["area_standard"]
         area_value = serializer.validated_data["area_value"]
-        response = self.process_check_boundary_request(
-            area_value, area_standard
-        )
+        try:
+            response = self.process_check_boundary_request(
+                area_value, area_standard
+            )
+        except OverpassError as e:
+            return overpass_error_response(e)
         json_response = JsonResponse(response)
         return json_response
 
@@ -202,7 +251,7 @@ class CheckBoundaryView(APIView):
                 f" href='https://www.openstreetmap.org/relation/{osm_id}'"
                 f" target='_blank'>{name}</a>"
             )
-            response = {"success": (success_text), "osm_id": osm_id}
+            response = {"success": success_text, "osm_id": osm_id}
         else:
             response = {
                 "error": (
@@ -232,6 +281,25 @@ class StationsMapView(APIView):
         return render(request, "stations_map.html", {"boundary": boundary})
 
 
+class MetricsView(APIView):
+    """Latency histograms in the Prometheus text format.
+
+    Only served to local clients and the addresses in 'INTERNAL_IPS'.
+    """
+
+    local_addresses = ("127.0.0.1", "::1")
+
+    def get(self, request):
+        address = request.META.get("REMOTE_ADDR")
+        allowed = (*self.local_addresses, *settings.INTERNAL_IPS)
+        if address not in allowed:
+            return HttpResponseForbidden()
+        return HttpResponse(
+            instrumentation.render_metrics(),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
+
+
 class BoundaryPointViewSet(viewsets.ModelViewSet):
     queryset = models.BoundaryPoint.objects.all()
     serializer_class = BoundaryPointSerializer
@@ -252,8 +320,14 @@ class BoundaryPointViewSet(viewsets.ModelViewSet):
         boundary_id = request.query_params.get("boundary_id", None)
         if boundary_id:
             num_nodes = (
-                self.get_queryset().filter(boundary_id=boundary_id).count()
+                models.BoundaryGeometry.objects.filter(boundary_id=boundary_id)
+                .values_list("num_points", flat=True)
+                .first()
             )
+            if num_nodes is None:
+                num_nodes = (
+                    self.get_queryset().filter(boundary_id=boundary_id).count()
+                )
             return Response({"num_nodes": num_nodes})
         else:
             return Response(
@@ -261,65 +335,87 @@ class BoundaryPointViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+    @action(detail=False, methods=["get"])
+    def points(self, request):
+        """Return the polygon simplified to fit a zoom level or tolerance."""
+        serializer = PolygonLevelSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        boundary = get_object_or_404(
+            models.MapBoundary, pk=serializer.validated_data["boundary_id"]
+        )
+        geometry = get_object_or_404(
+            models.BoundaryGeometry, boundary=boundary
+        )
+        filters = serializer.validated_data
+        tolerance = filters.get("tolerance", 0)
+        if "zoom" in filters:
+            tolerance = ground_resolution(boundary, filters["zoom"])
+        level, points, ring_starts = geometry.get_level(tolerance)
+        return Response(
+            {
+                "tolerance": level,
+                "num_nodes": len(points),
+                "points": points.tolist(),
+                "ring_starts": ring_starts.tolist(),
+            }
+        )
+
+    @action(detail=False, methods=["get"])
+    @method_decorator(gzip_page)
+    def export(self, request):
+        """Stream a level of the polygon as GeoJSON or binary."""
+        serializer = PolygonExportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        filters = serializer.validated_data
+        boundary = get_object_or_404(
+            models.MapBoundary, pk=filters["boundary_id"]
+        )
+        geometry = get_object_or_404(
+            models.BoundaryGeometry, boundary=boundary
+        )
+        tolerance = filters.get("tolerance", 0)
+        if "zoom" in filters:
+            tolerance = ground_resolution(boundary, filters["zoom"])
+        level, points, ring_starts = geometry.get_level(tolerance)
+        output = filters["output"]
+        etag = export_tools.get_etag(
+            "polygon", boundary.pk, geometry.checksum, level, output
+        )
+        if output == "binary":
+            chunks = export_tools.stream_polygon_binary(points)
+        else:
+            chunks = export_tools.stream_polygon_geojson(
+                boundary, points, level, ring_starts=ring_starts
+            )
+        response = export_response(request, chunks, output, etag)
+        if output == "binary":
+            # The binary points have no separators between the rings
+            response["X-Ring-Starts"] = ",".join(map(str, ring_starts))
+        return response
+
     @action(detail=False, methods=["post"])
     def download_data(self, request):
         boundary_id = request.query_params.get("boundary_id", None)
         if boundary_id:
-            self.fetch_and_save_polygon(boundary_id)
-            num_nodes = (
-                self.get_queryset().filter(boundary_id=boundary_id).count()
-            )
-            return Response({"num_nodes": num_nodes})
+            boundary = get_object_or_404(models.MapBoundary, pk=boundary_id)
+            job = jobs.enqueue("download_polygon", boundary=boundary)
+            return job_response(job)
         else:
             return Response(
                 {"error": "boundary_id is missing"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-    @staticmethod
-    def fetch_and_save_polygon(boundary_id):
-        """Download polygon data from API and save it to the database."""
-        # Get stations data from API
-        boundary = get_object_or_404(models.MapBoundary, pk=boundary_id)
-        client = OverpassClient()
-        response = client.get(boundary.polygon_query)
-
-        # Convert response coordinates into a continuous polygon
-        boundary_coordinates = get_boundary_coordinates(response)
-        polygon = build_polygon(boundary_coordinates)
-        print(f"Num coordinates: {len(polygon)}")
-
-        # Convert the geographic coordinates to UTM coordinates
-        utm_points = to_utm(polygon)
-
-        simplified_polygon = simplify_points(utm_points, epsilon=1)
-
-        # Convert the simplified UTM coordinates back to geographic coordinates
-        simplified_points = to_latlon(simplified_polygon)
-        print(f"Num simplified coordinates: {len(simplified_points)}")
-
-        # Remove all existing points for the given boundary
-        existing_qs = models.BoundaryPoint.objects.filter(boundary=boundary)
-        existing_qs.delete()
-        for i, (lat, lon) in enumerate(simplified_points):
-            # Create a new Location object and save it
-            location, _ = models.Location.objects.get_or_create(
-                latitude=lat, longitude=lon
-            )
-            location.save()
-
-            # Create a new BoundaryPoint object and save it
-            boundary_point = models.BoundaryPoint(
-                boundary=boundary, location=location, order=i
-            )
-            boundary_point.save()
-
     @action(detail=False, methods=["post"])
     def remove_data(self, request):
         boundary_id = request.query_params.get("boundary_id", None)
         if boundary_id:
+            boundary = get_object_or_404(models.MapBoundary, pk=boundary_id)
             queryset = self.get_queryset().filter(boundary_id=boundary_id)
             queryset.delete()
+            models.BoundaryGeometry.objects.filter(boundary=boundary).delete()
+            boundary.increment_polygon_version()
+            boundary.update_bbox([])
             num_nodes = (
                 self.get_queryset().filter(boundary_id=boundary_id).count()
             )
@@ -329,3 +425,30 @@ class BoundaryPointViewSet(viewsets.ModelViewSet):
                 {"error": "boundary_id is missing"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
+
+
+class CatchmentViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = models.Catchment.objects.all()
+    serializer_class = CatchmentSerializer
+
+    def get_queryset(self):
+        boundary_id = self.request.query_params.get("boundary_id", None)
+        if boundary_id is not None:
+            queryset = models.Catchment.objects.filter(
+                boundary_id=boundary_id
+            ).order_by("station__name")
+        else:
+            # Return an empty queryset if no boundary_id is provided
+            queryset = models.Catchment.objects.none()
+        return queryset
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = models.Job.objects.all()
+    serializer_class = JobSerializer
+
+    def retrieve(self, request, *args, **kwargs):
+        # Clients polling a job after a restart start the workers, which
+        # resume the pending jobs and fail the abandoned ones
+        jobs.start_workers()
+        return super().retrieve(request, *args, **kwargs)